@@ -0,0 +1,37 @@
+using CrystalNets
+
+# long-lived worker: reads one shard directory per line from stdin, writes the
+# topology of every cif in the shard to <shard>/topology.tsv and reports back
+# on stdout with a "@@SHARD" prefixed status line
+
+const OPTIONS = CrystalNets.Options(export_subnets=false, export_net=false, export_clusters=false, export_input=false, export_trimmed=false, structure=StructureType.MOF, bonding=Bonding.Input, detect_organiccycles=false, clusterings=[Clustering.Auto, Clustering.Standard])
+
+function run_shard(shard)
+        results = determine_topology_dataset(shard, false, true, false, OPTIONS)
+        open(joinpath(shard, "topology.tsv"), "w") do io
+                for (name, result) in results
+                        topology = replace(string(result), r"\s*\n\s*" => "; ")
+                        println(io, name, "\t", topology)
+                end
+        end
+        return length(results)
+end
+
+function main()
+        println("@@SHARD READY")
+        flush(stdout)
+        for line in eachline(stdin)
+                shard = strip(line)
+                isempty(shard) && continue
+                try
+                        n = run_shard(shard)
+                        println("@@SHARD DONE\t", shard, "\t", n)
+                catch e
+                        msg = replace(sprint(showerror, e), r"\s+" => " ")
+                        println("@@SHARD FAIL\t", shard, "\t", msg)
+                end
+                flush(stdout)
+        end
+end
+
+main()
@@ -1,16 +1,44 @@
 #!/usr/bin/env python3
 import os
+import sys
 import glob
 import time
+import json
+import shutil
+import hashlib
 import argparse
 
 import numpy as np
 import pandas as pd
 
-from multiprocessing import Pool
+from functools import partial
 from subprocess import PIPE, Popen
 from pymatgen.core import Structure
-from mofdscribe.featurizers.topology import AtomCenteredPH
+
+from scheduler import count_atoms, order_by_size, schedule
+
+CODE_PATH = os.path.dirname(os.path.realpath(__file__))
+# shared mosaec package (packed cif archives & structure cache)
+sys.path.append(os.path.dirname(CODE_PATH))
+
+# atom-type groups & homology dimensions of the descriptors
+ATOM_TYPES = (
+    "H",
+    "C",
+    "N-P",
+    "O-S-Se",
+    "F-Cl-Br-I",
+    "Li-Be-Na-Mg-K-Ca-Rb-Sr-Cs-Ba-Fr-Ra",
+    "Al-Si-Ga-Ge-As-In-Sn-Sb-Te-Tl-Pb-Bi-Po-At",
+    "Sc-Ti-V-Cr-Mn-Fe-Co-Ni-Cu-Zn-Y-Zr-Nb-Mo-Tc-Ru-Rh-"
+    "Pd-Ag-Cd-Hf-Ta-W-Re-Os-Ir-Pt-Au-Hg",
+    "La-Ce-Pr-Nd-Pm-Sm-Eu-Gd-Tb-Dy-Ho-Er-Tm-Yb-Lu-Ac-"
+    "Th-Pa-U-Np-Pu-Am-Cm-Bk-Cf-Es-Fm-Md-No-Lr",
+)
+DIMENSIONS = (0, 1, 2)
+# neighbourhood radius (A) & statistics of mofdscribe AtomCenteredPH (defaults)
+CUTOFF = 12.0
+AGGREGATIONS = ("min", "max", "mean", "std")
 
 
 def run_bash(cmd):
@@ -19,63 +47,537 @@ def run_bash(cmd):
     return out.decode("utf-8").strip().split()
 
 
-dest_path = f"{args.search_path}/homology_vectors"
-run_bash(f"mkdir -p {dest_path}")
+# content hash used to key checkpoint entries
+def file_hash(file, archive=None):
+    if archive is not None:
+        return hashlib.sha256(archive.read_bytes(file)).hexdigest()
+    sha = hashlib.sha256()
+    with open(file, "rb") as rb:
+        for chunk in iter(lambda: rb.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+# read the latest checkpoint entry recorded for each structure
+def read_checkpoint(ckpt_path):
+    if not os.path.exists(ckpt_path):
+        return {}
+    df = pd.read_csv(ckpt_path, dtype=str, keep_default_na=False)
+    df = df.drop_duplicates(subset="cif", keep="last")
+    return {row.cif: (row.hash, row.status, row.error) for row in df.itertuples()}
+
+
+# append a single structure's outcome to the checkpoint
+def write_checkpoint(ckpt_path, cif, cif_hash, status, error=""):
+    row = pd.DataFrame(
+        {"cif": [cif], "hash": [cif_hash], "status": [status], "error": [error]}
+    )
+    if os.path.exists(ckpt_path):
+        row.to_csv(ckpt_path, mode="a", header=False, index=False)
+    else:
+        row.to_csv(ckpt_path, index=False)
+
+
+# select files still to be processed given the prior checkpoint
+def filter_completed(files, checkpoint, failed="retry", archive=None):
+    todo = []
+    for file in files:
+        bname = os.path.basename(file).replace(".cif", "")
+        prior = checkpoint.get(bname)
+        if prior is None:
+            # never attempted
+            if failed != "only":
+                todo.append(file)
+            continue
+        cif_hash, status, _ = prior
+        if cif_hash != file_hash(file, archive):
+            # structure changed since it was processed
+            todo.append(file)
+        elif status != "done" and failed in ("retry", "only"):
+            todo.append(file)
+    return todo
+
+
+# drop stale rows of structures about to be (re)computed from the feature csv
+def drop_stale_rows(df_path, files):
+    if not os.path.exists(df_path) or len(files) == 0:
+        return
+    names = {os.path.basename(f).replace(".cif", "") for f in files}
+    df = pd.read_csv(df_path)
+    stale = df["cif"].astype(str).isin(names)
+    if stale.any():
+        df[~stale].to_csv(df_path, index=False)
+
+
+# features of a representative copied to its identical structures (aliases)
+def copy_to_aliases(results, dest_path, members):
+    rep = members[0][1]
+    rows = [results]
+    for _, name in members[1:]:
+        shutil.copyfile(f"{dest_path}/{rep}.npy", f"{dest_path}/{name}.npy")
+        rows.append(results.assign(cif=name))
+    return pd.concat(rows, ignore_index=True)
+
+
+# checkpoint & event of a structure, and the same outcome for its aliases
+def record_members(
+    progress, ckpt_path, members, ckpt_status, status, duration, error, archive=None
+):
+    rep = members[0][1]
+    for k, (file, name) in enumerate(members):
+        write_checkpoint(ckpt_path, name, file_hash(file, archive), ckpt_status, error)
+        if k == 0:
+            progress.record(name, status, duration, error or None)
+        else:
+            progress.record(name, status, 0.0, error or None, alias_of=rep)
+
+
+# append a per-structure timing record to this worker's jsonl file
+def write_timings(dest_path, record):
+    with open(f"{dest_path}/timings_{os.getpid()}.jsonl", "a") as af:
+        af.write(json.dumps(record) + "\n")
+
+
+# atom-type group of an element, matched by substring as in mofdscribe
+# (e.g., B falls in F-Cl-Br-I)
+def atom_type_of(symbol):
+    for atom_type in ATOM_TYPES:
+        if symbol in atom_type:
+            return atom_type
+    return None
+
+
+def feature_labels():
+    site_labels = [
+        f"dim{dim}_{parameter}_{aggregation}"
+        for dim in DIMENSIONS
+        for parameter in ("birth", "death", "persistence")
+        for aggregation in AGGREGATIONS
+    ]
+    return [
+        f"{atom_type}_{aggregation}_{label}"
+        for atom_type in ATOM_TYPES + ("all",)
+        for aggregation in AGGREGATIONS
+        for label in site_labels
+    ]
+
+
+# neighbours within cutoff of every site (cartesian), from a single
+# periodic neighbour search of the structure
+def site_environments(struct, cutoff=CUTOFF):
+    centers, points, images, _ = struct.get_neighbor_list(cutoff)
+    coords = struct.lattice.get_cartesian_coords(struct.frac_coords[points] + images)
+    order = np.argsort(centers, kind="stable")
+    bounds = np.searchsorted(centers[order], np.arange(len(struct) + 1))
+    return [coords[order[bounds[i] : bounds[i + 1]]] for i in range(len(struct))]
+
+
+def equivalent_sites(struct, envs, symprec=1e-3, tol=1e-4):
+    """
+    Sites whose neighbourhood is congruent to that of another site. Each
+    site is mapped to the first site of its symmetry orbit, only if a
+    symmetry operation maps one neighbourhood onto the other to within tol,
+    so that the persistence diagrams of both are the same.
+
+        Parameters:
+            struct (Pymatgen Structure object): structure
+            envs (list of numpy array): neighbour coordinates of each site
+            symprec (float): symmetry finding tolerance (A)
+            tol (float): largest neighbour displacement (A) between
+                         congruent neighbourhoods
+
+        Returns:
+            rep (numpy array): representative site of each site (itself if
+                               its diagrams must be computed)
+    """
+    from scipy.spatial import cKDTree
+    from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+
+    rep = np.arange(len(struct))
+    try:
+        sga = SpacegroupAnalyzer(struct, symprec=symprec)
+        dataset = sga.get_symmetry_dataset()
+        ops = sga.get_symmetry_operations()
+    except Exception:
+        return rep
+    if dataset is None:
+        return rep
+    if isinstance(dataset, dict):
+        equivalent = dataset["equivalent_atoms"]
+    else:
+        equivalent = dataset.equivalent_atoms
+    matrix = struct.lattice.matrix
+    inv_matrix = np.linalg.inv(matrix)
+    frac, cart = struct.frac_coords, struct.cart_coords
+    images = np.array([op.operate_multi(frac) for op in ops])
+    for j, r in enumerate(equivalent):
+        if r == j or len(envs[r]) != len(envs[j]):
+            continue
+        # operation taking site r onto site j
+        d = images[:, r] - frac[j]
+        d -= np.round(d)
+        op = ops[int(np.argmin(np.linalg.norm(d @ matrix, axis=1)))]
+        rotation = inv_matrix @ op.rotation_matrix.T @ matrix
+        dist, idx = cKDTree(envs[j] - cart[j]).query((envs[r] - cart[r]) @ rotation)
+        if len(dist) == 0 or (dist.max() < tol and len(np.unique(idx)) == len(idx)):
+            rep[j] = r
+    return rep
+
+
+# statistics of the persistence diagrams of one site's neighbourhood
+def site_features(coords):
+    from mofdscribe.featurizers.utils import flatten
+    from mofdscribe.featurizers.topology._tda_helpers import (
+        construct_pds_cached,
+        diagrams_to_bd_arrays,
+        persistent_diagram_stats,
+    )
+
+    diagrams = diagrams_to_bd_arrays(construct_pds_cached(coords))
+    results = {
+        f"dim{dim}": persistent_diagram_stats(diagrams[f"dim{dim}"], AGGREGATIONS)
+        for dim in DIMENSIONS
+    }
+    return np.array(list(flatten(results).values()))
+
+
+def featurize(struct, reference=False):
+    """
+    Atom-specific persistent homology features of a structure, as computed
+    by mofdscribe AtomCenteredPH. The neighbourhoods of all sites come from
+    one neighbour search, and the diagrams of symmetry-equivalent sites are
+    computed once per orbit.
+
+        Parameters:
+            struct (Pymatgen Structure object): structure to featurize
+            reference (bool): use AtomCenteredPH itself (every site)
+
+        Returns:
+            feats (numpy array): feature vector
+            labels (list of str): feature names, in the order of feats
+    """
+    if reference:
+        # imported by the workers only, not to list, shard or resume structures
+        from mofdscribe.featurizers.topology import AtomCenteredPH
+
+        featurizer = AtomCenteredPH(atom_types=ATOM_TYPES, dimensions=DIMENSIONS)
+        return featurizer.featurize(struct), featurizer.feature_labels()
+    envs = site_environments(struct)
+    rep = equivalent_sites(struct, envs)
+    features = {}
+    groups = {}
+    for i, site in enumerate(struct):
+        if rep[i] == i:
+            features[i] = site_features(envs[i])
+        atom_type = atom_type_of(site.specie.symbol)
+        if atom_type is not None:
+            groups.setdefault(atom_type, []).append(features[rep[i]])
+        groups.setdefault("all", []).append(features[rep[i]])
+    num_site_feats = len(DIMENSIONS) * 3 * len(AGGREGATIONS)
+    feats = []
+    for atom_type in ATOM_TYPES + ("all",):
+        if atom_type not in groups:
+            feats.extend(np.zeros(num_site_feats * len(AGGREGATIONS)))
+            continue
+        v = np.array(groups[atom_type])
+        for aggregation in AGGREGATIONS:
+            feats.extend(getattr(np, aggregation)(v, axis=0))
+    return np.array(feats), feature_labels()
 
 
-def gen_descriptors(file):
+def verify_features(struct, feats, rtol=1e-6, atol=1e-8):
+    """
+    Check features of the fast path against mofdscribe AtomCenteredPH.
+
+        Parameters:
+            struct (Pymatgen Structure object): featurized structure
+            feats (numpy array): features from featurize(struct)
+            rtol, atol (float): tolerances of numpy.allclose
+
+        Returns:
+            None (raises ValueError naming the largest mismatch)
+    """
+    ref, labels = featurize(struct, reference=True)
+    if np.allclose(feats, ref, rtol=rtol, atol=atol):
+        return
+    i = int(np.argmax(np.abs(feats - ref)))
+    raise ValueError(
+        f"features differ from AtomCenteredPH ({labels[i]}: {feats[i]} != {ref[i]})"
+    )
+
+
+def gen_descriptors(
+    file, dest_path, archive=None, cache=None, reference=False, verify=False
+):
     stime = time.time()
+    timings = {"cif": os.path.basename(file), "pid": os.getpid(), "start": stime}
     try:
         # read into pymatgen.Structure
-        struct = Structure.from_file(file)
-        # select mofdscribe featurizers
-        new_types = (
-            "H",
-            "C",
-            "N-P",
-            "O-S-Se",
-            "F-Cl-Br-I",
-            "Li-Be-Na-Mg-K-Ca-Rb-Sr-Cs-Ba-Fr-Ra",
-            "Al-Si-Ga-Ge-As-In-Sn-Sb-Te-Tl-Pb-Bi-Po-At",
-            "Sc-Ti-V-Cr-Mn-Fe-Co-Ni-Cu-Zn-Y-Zr-Nb-Mo-Tc-Ru-Rh-"
-            "Pd-Ag-Cd-Hf-Ta-W-Re-Os-Ir-Pt-Au-Hg",
-            "La-Ce-Pr-Nd-Pm-Sm-Eu-Gd-Tb-Dy-Ho-Er-Tm-Yb-Lu-Ac-"
-            "Th-Pa-U-Np-Pu-Am-Cm-Bk-Cf-Es-Fm-Md-No-Lr",
-        )
-        new_dimens = (0, 1, 2)
-        featurizer = AtomCenteredPH(atom_types=new_types, dimensions=new_dimens)
+        if cache is not None:
+            from mosaec.cache import load_structure
+
+            text = archive.read(file) if archive is not None else None
+            struct = load_structure(file, text, cache)
+        elif archive is not None:
+            struct = Structure.from_str(archive.read(file), fmt="cif")
+        else:
+            struct = Structure.from_file(file)
+        timings["natoms"] = len(struct)
+        timings["parse"] = time.time() - stime
         # calculate features
-        feats = featurizer.featurize(struct)
-        labels = featurizer.feature_labels()
+        ftime = time.time()
+        feats, labels = featurize(struct, reference)
+        timings["featurize"] = time.time() - ftime
+        if verify and not reference:
+            vtime = time.time()
+            verify_features(struct, feats)
+            timings["verify"] = time.time() - vtime
         # output features
+        otime = time.time()
         bname = os.path.basename(file).replace(".cif", "")
         np.save(f"{dest_path}/{bname}.npy", feats)
+        timings["save"] = time.time() - otime
         elapsedtime = time.time() - stime
         print(file, elapsedtime, "s")
     except Exception as e:
         print(f"{file} >> FEATURE CALCULATION Failed {e}\n")
-        return None
+        timings.update(
+            {
+                "total": time.time() - stime,
+                "status": "failed",
+                "error": type(e).__name__,
+            }
+        )
+        write_timings(dest_path, timings)
+        return file, None, f"{type(e).__name__}: {e}", timings["total"]
     else:
+        timings.update({"total": elapsedtime, "status": "done"})
+        write_timings(dest_path, timings)
         row = {"cif": [bname]}
         row.update({f"{label}": feats[i] for i, label in enumerate(labels)})
-        return pd.DataFrame(row)
+        return file, pd.DataFrame(row), "", elapsedtime
 
 
 if __name__ == "__main__":
     code_desc = "Calculate Atom-specific Persistent Homology features as implemented in mofdscribe."
     parser = argparse.ArgumentParser(description=code_desc)
     parser.add_argument(
-        "search_path", help="path where the structure files (cif) are located."
+        "search_path",
+        help="path where the structure files (cif) are located, or a packed cif archive (.cifpack).",
     )
     parser.add_argument("num_cpus", help="no. cpus available for multiprocessing.")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip structures already recorded in the checkpoint (by name & hash).",
+    )
+    parser.add_argument(
+        "--failed",
+        type=str,
+        default="retry",
+        choices=["retry", "skip", "only"],
+        help="with --resume, retry previously failed (or skipped) structures, "
+        "skip them, or process only them.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="seconds allowed per structure before it is skipped.",
+    )
+    parser.add_argument(
+        "--max_rss",
+        type=float,
+        default=None,
+        help="resident memory (MB) allowed per worker before the structure is skipped.",
+    )
+    parser.add_argument(
+        "--no_sort",
+        action="store_true",
+        help="dispatch structures in glob order instead of largest (atom count) first.",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        nargs="?",
+        const="",
+        default=None,
+        help="read through the parsed-structure cache (optional cache directory).",
+    )
+    parser.add_argument(
+        "--shard",
+        type=str,
+        default=None,
+        metavar="i/N",
+        help="process only shard i of N (0 <= i < N), each writing its own output.",
+    )
+    parser.add_argument(
+        "--shard_by",
+        type=str,
+        default="hash",
+        choices=["hash", "cost"],
+        help="split shards by a stable hash of the structure name, or balance their estimated cost (no. atoms).",
+    )
+    parser.add_argument(
+        "--aliases",
+        type=str,
+        nargs="?",
+        const="",
+        default=None,
+        help="featurize identical structures once (aliases csv of mosaec.fingerprint, "
+        "updated for new or modified cifs, built beforehand for --shard; "
+        "default: homology_vectors/aliases.csv).",
+    )
+    parser.add_argument(
+        "--reference",
+        action="store_true",
+        help="featurize every site with mofdscribe AtomCenteredPH (no shared neighbourhoods).",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="also featurize with AtomCenteredPH and fail structures whose features differ.",
+    )
+    parser.add_argument(
+        "--events",
+        type=str,
+        default=None,
+        help="append per-structure JSONL events to this file (default: $MOSAEC_EVENTS).",
+    )
     args = parser.parse_args()
     #
-    files = glob.glob(f"{args.search_path}/*.cif", recursive=False)
-    pool = Pool(processes=int(args.num_cpus))
+    archive = None
+    count = count_atoms
+    if os.path.isfile(args.search_path):
+        from mosaec.archive import CifArchive
+        from mosaec.manifest import cif_summary
+
+        archive = CifArchive(args.search_path)
+        count = lambda f: cif_summary(archive.read(f))["natoms"]
+        dest_path = os.path.join(
+            os.path.dirname(os.path.abspath(args.search_path)), "homology_vectors"
+        )
+        files = archive.names()
+    else:
+        dest_path = f"{args.search_path}/homology_vectors"
+        files = glob.glob(f"{args.search_path}/*.cif", recursive=False)
+    aliases = {}
+    if args.aliases is not None:
+        # identical structures (e.g., _full & _partial without bound solvent)
+        # are computed once, shards split the representatives
+        from mosaec.fingerprint import update_aliases, split_aliases
+
+        aliases_csv = args.aliases or f"{dest_path}/aliases.csv"
+        if args.shard is not None and not os.path.exists(aliases_csv):
+            # one fingerprinting pass, not one per shard
+            parser.error(
+                f"{aliases_csv} not found, build it before starting the shards: "
+                f"python -m mosaec.fingerprint {args.search_path} -o {aliases_csv}"
+            )
+        run_bash(f"mkdir -p {os.path.dirname(os.path.abspath(aliases_csv))}")
+        # shards only read it, modified cifs are fingerprinted in memory
+        representative = update_aliases(
+            aliases_csv,
+            files,
+            archive,
+            args.cache,
+            args.num_cpus,
+            write=args.shard is None,
+        )
+        files, aliases = split_aliases(files, representative)
+        print(f"Aliases ... {sum(len(x) for x in aliases.values())} structures")
+    sizes = None
+    if args.shard is not None:
+        # split the full list (before --resume) so shards never change
+        from mosaec.shard import select_shard, shard_name
+
+        cost = None
+        if args.shard_by == "cost":
+            _, sizes = order_by_size(files, count)
+            cost = sizes.get
+        files = select_shard(files, args.shard, cost=cost)
+        dest_path = f"{dest_path}/{shard_name(args.shard)}"
+    run_bash(f"mkdir -p {dest_path}")
     df_path = f"{dest_path}/homology.csv"
-    for results in pool.imap_unordered(gen_descriptors, files):
+    ckpt_path = f"{dest_path}/checkpoint.csv"
+    #
+    if args.resume:
+        checkpoint = read_checkpoint(ckpt_path)
+        files = filter_completed(files, checkpoint, args.failed, archive)
+        drop_stale_rows(df_path, files + [x for f in files for x in aliases.get(f, [])])
+        print(f"Resuming ... {len(files)} structures remaining")
+    else:
+        # fresh run, discard any previous outputs
+        for path in [ckpt_path, df_path] + glob.glob(f"{dest_path}/timings_*.jsonl"):
+            if os.path.exists(path):
+                os.remove(path)
+    if not args.no_sort:
+        files, _ = order_by_size(files, sizes.get if sizes else count)
+    worker = partial(
+        gen_descriptors,
+        dest_path=dest_path,
+        archive=archive,
+        cache=args.cache,
+        reference=args.reference,
+        verify=args.verify,
+    )
+    from mosaec.progress import Progress
+
+    total = len(files) + sum(len(aliases.get(f, [])) for f in files)
+    progress = Progress(total=total, stage="homology", events=args.events)
+    for file, status, output in schedule(
+        worker, files, args.num_cpus, timeout=args.timeout, max_rss=args.max_rss
+    ):
+        members = [
+            (x, os.path.basename(x).replace(".cif", ""))
+            for x in [file] + aliases.get(file, [])
+        ]
+        if status != "ok":
+            # limit exceeded or worker died, record & move on
+            print(f"{file} >> FEATURE CALCULATION Skipped ({status})\n")
+            duration = output["elapsed"]
+            write_timings(
+                dest_path,
+                {
+                    "cif": os.path.basename(file),
+                    "pid": output["pid"],
+                    "start": output["start"],
+                    "total": duration,
+                    "status": status,
+                    "error": status,
+                },
+            )
+            record_members(
+                progress,
+                ckpt_path,
+                members,
+                "skipped",
+                status,
+                duration,
+                status,
+                archive,
+            )
+            continue
+        _, results, error, duration = output
         if results is not None:
+            if len(members) > 1:
+                results = copy_to_aliases(results, dest_path, members)
             if os.path.exists(df_path):
                 results.to_csv(df_path, mode="a", header=False, index=False)
             else:
                 results.to_csv(df_path, index=False)
+            record_members(
+                progress, ckpt_path, members, "done", "ok", duration, "", archive
+            )
+        else:
+            record_members(
+                progress,
+                ckpt_path,
+                members,
+                "failed",
+                "failed",
+                duration,
+                error,
+                archive,
+            )
+    progress.close()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+import os
+import glob
+import shlex
+import queue
+import shutil
+import argparse
+import threading
+import subprocess
+
+import pandas as pd
+
+CODE_PATH = os.path.dirname(os.path.realpath(__file__))
+WORKER_JL = os.path.join(CODE_PATH, "crystalnets_worker.jl")
+
+
+# split cifs into shard directories of symlinks (largest files spread evenly),
+# recreated so a reused work_dir never leaves cifs of an earlier run in them
+def make_shards(cifs, work_dir, shard_size):
+    cifs = sorted(cifs, key=lambda f: (-os.path.getsize(f), os.path.basename(f)))
+    num_shards = max(1, -(-len(cifs) // shard_size))
+    shards = []
+    for n in range(num_shards):
+        shard = os.path.join(work_dir, f"shard_{n:05d}")
+        if os.path.isdir(shard):
+            shutil.rmtree(shard)
+        os.makedirs(shard)
+        shards.append(shard)
+    for i, cif in enumerate(cifs):
+        link = os.path.join(shards[i % num_shards], os.path.basename(cif))
+        os.symlink(os.path.abspath(cif), link)
+    return shards
+
+
+class JuliaWorker:
+    """Warm julia process running crystalnets_worker.jl, fed shards over stdin."""
+
+    def __init__(self, julia, threads=1, launcher=None, timeout=None):
+        cmd = shlex.split(launcher) if launcher else []
+        cmd += [julia, f"--threads={threads}", "--startup-file=no", WORKER_JL]
+        self.cmd = cmd
+        self.timeout = timeout
+        self.proc = None
+
+    def start(self):
+        self.proc = subprocess.Popen(
+            self.cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        # wait until CrystalNets is loaded
+        status = self._read_status()
+        if status is None or status[0] != "READY":
+            raise RuntimeError("julia worker failed to start")
+
+    def _read_status(self):
+        for line in self.proc.stdout:
+            if line.startswith("@@SHARD "):
+                return line[len("@@SHARD ") :].rstrip("\n").split("\t")
+        return None
+
+    def run(self, shard):
+        if self.proc is None or self.proc.poll() is not None:
+            self.start()
+        self.proc.stdin.write(shard + "\n")
+        self.proc.stdin.flush()
+        # a stuck shard is killed after timeout seconds, ending the read below
+        timed_out = threading.Event()
+        timer = None
+        if self.timeout is not None:
+            proc = self.proc
+
+            def expire():
+                timed_out.set()
+                proc.kill()
+
+            timer = threading.Timer(self.timeout, expire)
+            timer.start()
+        try:
+            status = self._read_status()
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if status is None or timed_out.is_set():
+            # worker died (or was killed) mid-shard
+            self.kill()
+            if timed_out.is_set():
+                return False, f"timeout after {self.timeout} s"
+            return False, "julia worker exited"
+        if status[0] == "DONE":
+            return True, ""
+        return False, status[-1]
+
+    # discard the process (reaped, so no zombie), restarted by the next run
+    def kill(self):
+        if self.proc is not None:
+            if self.proc.poll() is None:
+                self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+
+    def close(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.stdin.close()
+            try:
+                self.proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+
+def run_pool(
+    shards, num_workers, julia, threads=1, launcher=None, retries=2, timeout=None
+):
+    tasks = queue.Queue()
+    for shard in shards:
+        tasks.put((shard, 0))
+    failed = {}
+    lock = threading.Lock()
+
+    def serve():
+        worker = JuliaWorker(julia, threads, launcher, timeout)
+        try:
+            while True:
+                try:
+                    shard, attempt = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    ok, err = worker.run(shard)
+                except Exception as e:
+                    ok, err = False, str(e)
+                    worker.kill()
+                if ok:
+                    print(f"{shard} | DONE")
+                elif attempt < retries:
+                    print(f"{shard} | RETRY ({err})")
+                    tasks.put((shard, attempt + 1))
+                else:
+                    print(f"{shard} | ERROR | {err}")
+                    with lock:
+                        failed[shard] = err
+        finally:
+            worker.close()
+
+    threads_ = [threading.Thread(target=serve) for _ in range(num_workers)]
+    for t in threads_:
+        t.start()
+    for t in threads_:
+        t.join()
+    return failed
+
+
+# combine every shard's topology.tsv into one table
+def collect_topologies(shards, failed):
+    rows = []
+    for shard in shards:
+        tsv = os.path.join(shard, "topology.tsv")
+        if shard in failed or not os.path.exists(tsv):
+            for cif in glob.glob(f"{shard}/*.cif"):
+                rows.append(
+                    {
+                        "cif": os.path.basename(cif),
+                        "topology": None,
+                        "error": failed.get(shard, "no output"),
+                    }
+                )
+            continue
+        with open(tsv, "r") as rf:
+            for line in rf:
+                name, _, topology = line.rstrip("\n").partition("\t")
+                rows.append({"cif": name, "topology": topology, "error": None})
+    return pd.DataFrame(rows, columns=["cif", "topology", "error"])
+
+
+if __name__ == "__main__":
+    code_desc = (
+        "Compute CrystalNets topologies over sharded cifs with warm julia workers."
+    )
+    parser = argparse.ArgumentParser(description=code_desc)
+    parser.add_argument(
+        "cif_path", help="path where the structure files (cif) are located."
+    )
+    parser.add_argument("num_workers", type=int, help="no. julia worker processes.")
+    parser.add_argument(
+        "--shard_size", type=int, default=200, help="no. cifs per shard."
+    )
+    parser.add_argument(
+        "--threads", type=int, default=1, help="julia threads per worker."
+    )
+    parser.add_argument("--julia", type=str, default="julia", help="julia executable.")
+    parser.add_argument(
+        "--launcher",
+        type=str,
+        default=None,
+        help="command prefix used to start each worker on another node "
+        "e.g., 'srun --nodes=1 --ntasks=1 --exclusive'.",
+    )
+    parser.add_argument(
+        "--retries", type=int, default=2, help="no. retries for a failed shard."
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="seconds allowed per shard before its worker is killed (and retried).",
+    )
+    parser.add_argument(
+        "--work_dir",
+        type=str,
+        default="crystalnets_shards",
+        help="directory for shards (must be visible to all workers).",
+    )
+    parser.add_argument(
+        "--output_csv", type=str, default="topology.csv", help="consolidated output."
+    )
+    parser.add_argument(
+        "--keep_shards", action="store_true", help="keep shard directories."
+    )
+    args = parser.parse_args()
+    #
+    cifs = glob.glob(f"{args.cif_path}/*.cif", recursive=False)
+    shards = make_shards(cifs, args.work_dir, args.shard_size)
+    print(f"Running {len(cifs)} cifs in {len(shards)} shards ...")
+    failed = run_pool(
+        shards,
+        min(args.num_workers, len(shards)),
+        args.julia,
+        threads=args.threads,
+        launcher=args.launcher,
+        retries=args.retries,
+        timeout=args.timeout,
+    )
+    df = collect_topologies(shards, failed)
+    df.to_csv(args.output_csv, index=False)
+    print(f"Topologies written ... {df['error'].isna().sum()} / {len(cifs)}")
+    if len(failed) > 0:
+        print(f"Failed shards ... {len(failed)}")
+    elif not args.keep_shards:
+        shutil.rmtree(args.work_dir)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+import time
+
+from collections import deque
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+
+
+# cheap atom count estimate by counting rows of the atom_site loop
+def count_atoms(cif):
+    num_atoms = 0
+    loop_tags = None
+    in_data = False
+    is_atoms = False
+    try:
+        with open(cif, "r") as rf:
+            for line in rf:
+                line = line.strip()
+                if line == "" or line[0] == "#":
+                    continue
+                if line.startswith("loop_"):
+                    loop_tags, in_data, is_atoms = [], False, False
+                elif line[0] == "_" and loop_tags is not None and not in_data:
+                    loop_tags.append(line)
+                    is_atoms = is_atoms or line.startswith("_atom_site_fract")
+                elif line[0] == "_" or line.startswith("data_"):
+                    loop_tags, in_data, is_atoms = None, False, False
+                elif loop_tags is not None:
+                    in_data = True
+                    num_atoms += is_atoms
+    except OSError:
+        return 0
+    return num_atoms
+
+
+# order structures largest first so expensive cells never run last
+def order_by_size(files, count=count_atoms):
+    sizes = {f: count(f) for f in files}
+    return sorted(files, key=lambda f: sizes[f], reverse=True), sizes
+
+
+# resident set size (MB) of a process, None if unavailable
+def get_rss(pid):
+    try:
+        with open(f"/proc/{pid}/status", "r") as rf:
+            for line in rf:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        return None
+    return None
+
+
+def _worker_loop(func, conn):
+    while True:
+        item = conn.recv()
+        if item is None:
+            break
+        conn.send(func(item))
+
+
+class _Worker:
+    """Long-lived worker process fed one item at a time over a pipe."""
+
+    def __init__(self, func):
+        self.func = func
+        self.item = None
+        self.start = None
+        self._spawn()
+
+    def _spawn(self):
+        self.conn, child_conn = Pipe()
+        self.proc = Process(target=_worker_loop, args=(self.func, child_conn))
+        self.proc.daemon = True
+        self.proc.start()
+        child_conn.close()
+
+    def submit(self, item):
+        self.item = item
+        self.start = time.time()
+        self.conn.send(item)
+
+    # worker pid, start & elapsed seconds of the current item
+    def skipped(self):
+        return {
+            "pid": self.proc.pid,
+            "start": self.start,
+            "elapsed": time.time() - self.start,
+        }
+
+    def release(self):
+        item, self.item, self.start = self.item, None, None
+        return item
+
+    def recycle(self):
+        # kill the (possibly hung) worker and replace it with a fresh one
+        self.proc.kill()
+        self.proc.join()
+        self.conn.close()
+        self._spawn()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.proc.join(timeout=5)
+        if self.proc.is_alive():
+            self.proc.kill()
+        self.conn.close()
+
+
+def schedule(func, items, num_workers, timeout=None, max_rss=None, poll=1.0):
+    """
+    Run func over items on a pool of recyclable worker processes.
+
+        Parameters:
+            func (callable): picklable function applied to each item
+            items (list): items dispatched in the given order
+            num_workers (int): number of concurrent worker processes
+            timeout (float): seconds allowed per item (None for no limit)
+            max_rss (float): resident memory allowed per worker in MB
+                             (None for no limit)
+            poll (float): seconds between timeout/memory checks
+
+        Yields:
+            (item, status, result): status is one of "ok", "timeout",
+                                    "memory" or "crashed"; result is the
+                                    return value of func, or the worker pid,
+                                    start & elapsed seconds of a skipped item
+    """
+    pending = deque(items)
+    workers = [_Worker(func) for _ in range(min(int(num_workers), len(pending)))]
+    try:
+        while pending or any(w.item is not None for w in workers):
+            for w in workers:
+                if w.item is None and pending:
+                    w.submit(pending.popleft())
+            busy = {w.conn: w for w in workers if w.item is not None}
+            for conn in wait(list(busy), timeout=poll):
+                w = busy[conn]
+                try:
+                    result = conn.recv()
+                except (EOFError, OSError):
+                    # worker died e.g., killed by the OOM killer
+                    skipped = w.skipped()
+                    item = w.release()
+                    w.recycle()
+                    yield item, "crashed", skipped
+                else:
+                    yield w.release(), "ok", result
+            # enforce per-item limits on the remaining busy workers
+            now = time.time()
+            for w in workers:
+                if w.item is None:
+                    continue
+                status = None
+                if timeout is not None and now - w.start > timeout:
+                    status = "timeout"
+                elif max_rss is not None:
+                    rss = get_rss(w.proc.pid)
+                    if rss is not None and rss > max_rss:
+                        status = "memory"
+                if status is not None:
+                    skipped = w.skipped()
+                    item = w.release()
+                    w.recycle()
+                    yield item, status, skipped
+    finally:
+        for w in workers:
+            if w.item is not None:
+                w.proc.kill()
+            w.close()
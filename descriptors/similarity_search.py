@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+CODE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+# descriptor matrix of homology csvs (e.g., every shard) or a directory of
+# per-structure .npy vectors written by gen_pers_homology.py
+def load_descriptors(paths, name_col="cif"):
+    if len(paths) == 1 and os.path.isdir(paths[0]):
+        files = sorted(glob.glob(f"{paths[0]}/*.npy", recursive=False))
+        names = [os.path.basename(f)[: -len(".npy")] for f in files]
+        X = np.stack([np.load(f) for f in files]) if files else np.empty((0, 0))
+        return X, names, None
+    df = pd.concat([pd.read_csv(p) for p in paths], ignore_index=True)
+    df[name_col] = df[name_col].astype(str)
+    df = df.drop_duplicates(subset=name_col, keep="last")
+    features = df.drop(columns=[name_col]).select_dtypes("number")
+    return features.to_numpy(), df[name_col].tolist(), list(features.columns)
+
+
+# k smallest squared distances of q to the rows of X, |x|^2 - 2 x.q + |q|^2
+def nearest(X, sq_norms, q, k):
+    d = sq_norms - 2.0 * (X @ q)
+    d += np.dot(q, q)
+    k = min(k, len(d))
+    if k == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    top = np.argpartition(d, k - 1)[:k]
+    top = top[np.argsort(d[top], kind="stable")]
+    return top, np.sqrt(np.maximum(d[top], 0.0))
+
+
+# k-means centroids of the coarse quantizer (Lloyd iterations on a sample)
+def kmeans(X, num_clusters, iterations=20, sample=50, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(X), min(len(X), num_clusters * sample), replace=False)
+    Xs = np.asarray(X[np.sort(rows)], dtype=np.float32)
+    centroids = Xs[rng.choice(len(Xs), num_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assign = assign_clusters(Xs, centroids)
+        for c in range(num_clusters):
+            members = Xs[assign == c]
+            if len(members) > 0:
+                centroids[c] = members.mean(axis=0)
+    return centroids
+
+
+def assign_clusters(X, centroids, chunk_size=4096):
+    c_norms = np.einsum("ij,ij->i", centroids, centroids)
+    assign = np.empty(len(X), dtype=np.int32)
+    for i in range(0, len(X), chunk_size):
+        d = c_norms - 2.0 * (np.asarray(X[i : i + chunk_size]) @ centroids.T)
+        assign[i : i + chunk_size] = np.argmin(d, axis=1)
+    return assign
+
+
+class DescriptorIndex:
+    """Nearest-neighbour index of standardized descriptor vectors."""
+
+    def __init__(self, vectors, names, mean, scale, labels=None, method="exact"):
+        self.vectors = vectors
+        self.names = list(names)
+        self.rows = {n: i for i, n in enumerate(self.names)}
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.labels = labels
+        self.method = method
+        self.sq_norms = np.einsum("ij,ij->i", vectors, vectors)
+        self.centroids, self.offsets, self.order, self.tree = None, None, None, None
+
+    @classmethod
+    def build(cls, X, names, labels=None, method="exact", num_lists=None, seed=0):
+        """
+        Standardize a descriptor matrix (zero mean, unit variance per feature)
+        and index its rows.
+
+            Parameters:
+                X (numpy array): (n_structures, n_features) descriptors
+                names (list of str): structure names of the rows
+                labels (list of str): feature names (None if unknown)
+                method (str): "exact" (NumPy scan), "balltree" (exact,
+                              scikit-learn) or "ivf" (approximate, inverted
+                              lists of k-means clusters)
+                num_lists (int): no. ivf clusters (default: sqrt(n))
+                seed (int): random seed of the ivf clustering
+
+            Returns:
+                index (DescriptorIndex): the index
+        """
+        X = np.nan_to_num(np.asarray(X, dtype=np.float32))
+        mean = X.mean(axis=0, dtype=np.float64).astype(np.float32)
+        scale = X.std(axis=0, dtype=np.float64).astype(np.float32)
+        scale[scale == 0] = 1.0
+        index = cls((X - mean) / scale, names, mean, scale, labels, method)
+        if method == "ivf":
+            num_lists = num_lists or max(1, int(np.sqrt(len(X))))
+            index.centroids = kmeans(index.vectors, min(num_lists, len(X)), seed=seed)
+            index.set_lists(assign_clusters(index.vectors, index.centroids))
+        elif method == "balltree":
+            from sklearn.neighbors import BallTree
+
+            index.tree = BallTree(index.vectors)
+        return index
+
+    # rows of every cluster stored contiguously, cluster c in order[o[c]:o[c+1]]
+    def set_lists(self, assign):
+        self.order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=len(self.centroids))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(f"{index_dir}/vectors.npy", self.vectors)
+        with open(f"{index_dir}/names.txt", "w") as wf:
+            wf.write("\n".join(self.names))
+        meta = {
+            "method": self.method,
+            "mean": self.mean.tolist(),
+            "scale": self.scale.tolist(),
+            "labels": self.labels,
+        }
+        with open(f"{index_dir}/index.json", "w") as wf:
+            json.dump(meta, wf)
+        if self.centroids is not None:
+            np.savez(
+                f"{index_dir}/ivf.npz",
+                centroids=self.centroids,
+                offsets=self.offsets,
+                order=self.order,
+            )
+        if self.tree is not None:
+            import pickle
+
+            with open(f"{index_dir}/balltree.pkl", "wb") as wf:
+                pickle.dump(self.tree, wf)
+        return index_dir
+
+    @classmethod
+    def load(cls, index_dir):
+        with open(f"{index_dir}/index.json", "r") as rf:
+            meta = json.load(rf)
+        with open(f"{index_dir}/names.txt", "r") as rf:
+            names = rf.read().split("\n")
+        # vectors stay on disk, paged in by the queries
+        vectors = np.load(f"{index_dir}/vectors.npy", mmap_mode="r")
+        index = cls(
+            vectors, names, meta["mean"], meta["scale"], meta["labels"], meta["method"]
+        )
+        if meta["method"] == "ivf":
+            with np.load(f"{index_dir}/ivf.npz") as npz:
+                index.centroids = npz["centroids"]
+                index.offsets, index.order = npz["offsets"], npz["order"]
+        elif meta["method"] == "balltree":
+            import pickle
+
+            with open(f"{index_dir}/balltree.pkl", "rb") as rf:
+                index.tree = pickle.load(rf)
+        return index
+
+    # standardize raw descriptors, aligned on the index features by label
+    def transform(self, feats, labels=None):
+        feats = np.asarray(feats, dtype=np.float32)
+        if labels is not None and self.labels is not None:
+            values = dict(zip(labels, feats))
+            feats = np.array([values.get(x, np.nan) for x in self.labels], np.float32)
+        if len(feats) != len(self.mean):
+            raise ValueError(f"{len(feats)} features, index has {len(self.mean)}")
+        # missing features at the mean
+        return np.nan_to_num((feats - self.mean) / self.scale)
+
+    def query(self, q, k=50, nprobe=8, exclude=None):
+        """
+        Structures nearest to a standardized descriptor vector.
+
+            Parameters:
+                q (numpy array): standardized query vector
+                k (int): no. neighbours
+                nprobe (int): no. ivf clusters searched
+                exclude (str): structure left out of the results (the query)
+
+            Returns:
+                neighbours (list of tuple): (name, distance), nearest first
+        """
+        q = np.asarray(q, dtype=np.float32)
+        kq = k + (exclude is not None)
+        if self.method == "balltree":
+            dist, rows = self.tree.query(q[None, :], k=min(kq, len(self.names)))
+            rows, dist = rows[0], dist[0]
+        elif self.method == "ivf":
+            c_dist = np.einsum("ij,ij->i", self.centroids, self.centroids)
+            c_dist -= 2.0 * (self.centroids @ q)
+            probe = np.argsort(c_dist)[: min(nprobe, len(self.centroids))]
+            rows = np.sort(
+                np.concatenate(
+                    [self.order[self.offsets[c] : self.offsets[c + 1]] for c in probe]
+                )
+            )
+            top, dist = nearest(
+                np.asarray(self.vectors[rows]), self.sq_norms[rows], q, kq
+            )
+            rows = rows[top]
+        else:
+            rows, dist = nearest(self.vectors, self.sq_norms, q, kq)
+        neighbours = [
+            (self.names[r], float(d))
+            for r, d in zip(rows, dist)
+            if self.names[r] != exclude
+        ]
+        return neighbours[:k]
+
+    def query_name(self, name, k=50, nprobe=8):
+        name = os.path.basename(name).rsplit(".cif", 1)[0]
+        if name not in self.rows:
+            raise KeyError(f"{name} not in the index")
+        q = np.asarray(self.vectors[self.rows[name]])
+        return self.query(q, k, nprobe, exclude=name)
+
+    # featurize a new cif as gen_pers_homology.py does & search its neighbours
+    def query_cif(self, cif_path, k=50, nprobe=8):
+        sys.path.insert(0, CODE_PATH)
+        from gen_pers_homology import featurize
+        from pymatgen.core import Structure
+
+        feats, labels = featurize(Structure.from_file(cif_path))
+        return self.query(self.transform(feats, labels), k, nprobe)
+
+
+if __name__ == "__main__":
+    code_desc = "Build or query a nearest-neighbour index of the persistent homology descriptors."
+    parser = argparse.ArgumentParser(description=code_desc)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="standardize & index descriptors.")
+    build.add_argument(
+        "descriptors",
+        nargs="+",
+        help="homology csv(s) (e.g., every shard) or a directory of .npy vectors.",
+    )
+    build.add_argument("-o", "--index_dir", type=str, default="homology_index")
+    build.add_argument(
+        "--method",
+        type=str,
+        default="exact",
+        choices=["exact", "balltree", "ivf"],
+        help="exact NumPy scan, exact ball tree (scikit-learn) or approximate ivf.",
+    )
+    build.add_argument(
+        "--num_lists",
+        type=int,
+        default=None,
+        help="no. ivf clusters (default: sqrt(n)).",
+    )
+    build.add_argument(
+        "--filter",
+        type=str,
+        default=None,
+        help="only index names containing this string e.g., '_full'.",
+    )
+    query = commands.add_parser("query", help="structures most similar to a query.")
+    query.add_argument("index_dir", type=str)
+    query.add_argument(
+        "queries", nargs="+", help="structure names in the index, or new cif files."
+    )
+    query.add_argument("-k", type=int, default=50, help="no. neighbours.")
+    query.add_argument(
+        "--nprobe", type=int, default=8, help="no. ivf clusters searched."
+    )
+    query.add_argument(
+        "--output_csv", type=str, default=None, help="write query,rank,cif,distance."
+    )
+    args = parser.parse_args()
+    #
+    if args.command == "build":
+        stime = time.time()
+        X, names, labels = load_descriptors(args.descriptors)
+        if args.filter is not None:
+            keep = np.array([args.filter in x for x in names], dtype=bool)
+            X, names = X[keep], [x for x, k in zip(names, keep) if k]
+        index = DescriptorIndex.build(X, names, labels, args.method, args.num_lists)
+        index.save(args.index_dir)
+        print(f"Indexed {len(names)} structures ({args.method}) ... {args.index_dir}")
+        print(f"Elapsed ... {time.time() - stime:.1f} s")
+        sys.exit(0)
+
+    index = DescriptorIndex.load(args.index_dir)
+    rows = []
+    for q in args.queries:
+        stime = time.perf_counter()
+        try:
+            if q.endswith(".cif") and os.path.isfile(q):
+                neighbours = index.query_cif(q, args.k, args.nprobe)
+            else:
+                neighbours = index.query_name(q, args.k, args.nprobe)
+        except Exception as e:
+            print(f"{q} | ERROR | {type(e).__name__}: {e}")
+            continue
+        elapsed = (time.perf_counter() - stime) * 1000
+        print(f"{q} ... {len(neighbours)} neighbours in {elapsed:.1f} ms")
+        for rank, (name, dist) in enumerate(neighbours, 1):
+            print(f"{rank:5d}  {dist:10.4f}  {name}")
+            rows.append({"query": q, "rank": rank, "cif": name, "distance": dist})
+    if args.output_csv is not None:
+        pd.DataFrame(rows).to_csv(args.output_csv, index=False)
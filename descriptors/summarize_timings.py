@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+import glob
+import argparse
+
+import numpy as np
+import pandas as pd
+
+STAGES = ["parse", "featurize", "save", "total"]
+
+
+def read_timings(paths):
+    records = []
+    for path in paths:
+        records.append(pd.read_json(path, lines=True))
+    if len(records) == 0:
+        return pd.DataFrame(columns=["cif", "pid", "start", "natoms"] + STAGES)
+    return pd.concat(records, ignore_index=True)
+
+
+def stage_percentiles(df, percentiles=(50, 90, 99)):
+    rows = []
+    for stage in STAGES:
+        if stage not in df.columns:
+            continue
+        vals = df[stage].dropna().to_numpy()
+        if len(vals) == 0:
+            continue
+        row = {"stage": stage, "count": len(vals), "sum_s": vals.sum()}
+        row.update({f"p{p}_s": np.percentile(vals, p) for p in percentiles})
+        row["max_s"] = vals.max()
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+# fit total time ~ natoms**k, binned summary alongside the exponent
+def atom_scaling(df, num_bins=8):
+    if not has_natoms(df):
+        return None, pd.DataFrame()
+    done = df[(df["natoms"] > 0) & (df["total"] > 0)].dropna(subset=["natoms", "total"])
+    if len(done) < 2:
+        return None, pd.DataFrame()
+    log_n = np.log(done["natoms"].to_numpy(dtype=float))
+    log_t = np.log(done["total"].to_numpy(dtype=float))
+    exponent = np.polyfit(log_n, log_t, 1)[0] if np.ptp(log_n) > 0 else None
+    bins = np.unique(
+        np.quantile(done["natoms"], np.linspace(0, 1, num_bins + 1)).astype(int)
+    )
+    if len(bins) < 2:
+        bins = np.array([done["natoms"].min(), done["natoms"].max() + 1])
+    groups = pd.cut(done["natoms"], bins=bins, include_lowest=True)
+    table = done.groupby(groups, observed=True)["total"].agg(
+        ["count", "median", "mean", "max"]
+    )
+    return exponent, table
+
+
+# atom counts are only known for structures that were parsed
+def has_natoms(df):
+    return "natoms" in df.columns and df["natoms"].notna().any()
+
+
+def summarize(df, top=10):
+    wall = (df["start"] + df["total"]).max() - df["start"].min()
+    done = df[df["status"] == "done"] if "status" in df.columns else df
+    print(f"Structures timed ... {len(df)} ({len(done)} completed)")
+    print(f"Workers ... {df['pid'].nunique()}")
+    print(f"Wall time ... {wall:.1f} s")
+    if wall > 0:
+        print(f"Throughput ... {len(done) / wall:.3f} structures/s")
+        if has_natoms(done):
+            print(f"Throughput ... {done['natoms'].sum() / wall:.1f} atoms/s")
+    percentiles = stage_percentiles(done)
+    if len(percentiles) > 0:
+        print("\nPer-stage timings (s)")
+        print(percentiles.to_string(index=False, float_format="%.3f"))
+    # skipped (timeout, memory, crashed) structures included
+    print(f"\nSlowest {top} structures")
+    columns = ["cif", "natoms", "status"] + STAGES
+    slow = df.nlargest(top, "total")[[x for x in columns if x in df.columns]]
+    if has_natoms(slow):
+        slow = slow.astype({"natoms": "Int64"})
+    print(slow.to_string(index=False, float_format="%.3f"))
+    exponent, table = atom_scaling(done)
+    if exponent is not None:
+        print(f"\nScaling ... total time ~ natoms^{exponent:.2f}")
+    if len(table) > 0:
+        print("Total time (s) by atom count")
+        print(table.to_string(float_format="%.3f"))
+    if "status" in df.columns and (df["status"] != "done").any():
+        failed = df[df["status"] != "done"]
+        print(f"\nFailures ... {len(failed)}")
+        print(failed["error"].value_counts().to_string())
+
+
+if __name__ == "__main__":
+    code_desc = "Summarize per-stage timings (jsonl) written by gen_pers_homology.py."
+    parser = argparse.ArgumentParser(description=code_desc)
+    parser.add_argument(
+        "timings_path",
+        help="homology_vectors directory containing the timings_*.jsonl files.",
+    )
+    parser.add_argument(
+        "--top", type=int, default=10, help="no. slowest structures to report."
+    )
+    parser.add_argument(
+        "--output_csv",
+        type=str,
+        default=None,
+        help="optionally write the combined per-structure timings to csv.",
+    )
+    args = parser.parse_args()
+    #
+    paths = sorted(glob.glob(f"{args.timings_path}/timings_*.jsonl"))
+    df = read_timings(paths)
+    if len(df) == 0:
+        print(f"No timings found in {args.timings_path}")
+    else:
+        summarize(df, top=args.top)
+        if args.output_csv is not None:
+            df.to_csv(args.output_csv, index=False)
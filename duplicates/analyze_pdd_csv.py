@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 import os
+import sys
 import glob
 import argparse
 
 import pandas as pd
 
+# shared mosaec package (manifest queries)
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from mosaec.manifest import add_filter_args, get_filters
 
 code_desc = "Analyze csv containing all PDD scores calculated for a given database."
 parser = argparse.ArgumentParser(description=code_desc)
@@ -16,7 +20,7 @@ parser.add_argument(
 parser.add_argument(
     "cif_path",
     type=str,
-    help="path to directory containing all the structures to be considered.",
+    help="path to directory (or manifest .sqlite) containing all the structures to be considered.",
 )
 parser.add_argument(
     "-output_csv",
@@ -30,13 +34,27 @@ parser.add_argument(
     default=0.15,
     help="path to csv containing all structure pairs' precomputed pdd scores.",
 )
+# with a manifest, the same filters used to write the *.lst files
+# (mosaec.manifest formula_lists) so that only compared structures count
+add_filter_args(parser)
 args = parser.parse_args()
+filters = {k: v for k, v in get_filters(args).items() if v is not None}
+is_manifest = args.cif_path.endswith((".sqlite", ".db"))
+if len(filters) > 0 and not is_manifest:
+    parser.error(f"{', '.join(filters)} filter(s) need a manifest (.sqlite) cif_path")
 
 pdd_threshold = args.pdd_threshold
 
 cpath = args.cif_path
-cifs = glob.glob(f"{cpath}/*.cif", recursive=False)
-cifs = [os.path.basename(x) for x in cifs if x[-8:] != "_pdd.cif"]
+if is_manifest:
+    # names from the database manifest, no directory scan
+    from mosaec.manifest import query
+
+    cifs = [row["name"] for row in query(cpath, **filters)]
+else:
+    cifs = glob.glob(f"{cpath}/*.cif", recursive=False)
+    cifs = [os.path.basename(x) for x in cifs]
+cifs = [x for x in cifs if x[-8:] != "_pdd.cif"]
 print(f"Total cifs from db to compare ... {len(cifs)}")
 duplicates = {x: [] for x in cifs}
 
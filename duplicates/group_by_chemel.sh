@@ -1,5 +1,14 @@
 #!/bin/bash
 
+# usage: group_by_chemel.sh [manifest.sqlite [manifest query options]]
+# with a database manifest the formula lists are read from the index instead
+# of grepping every cif in the working directory
+if [ -n "$1" ]
+then
+        echo "Reading empirical formulas from $1 ..."
+        MOSAEC_ROOT=${MOSAEC_ROOT:-$(dirname "$(realpath "$0")")/..}
+        PYTHONPATH="$MOSAEC_ROOT:$PYTHONPATH" python -m mosaec.manifest formula_lists "$@"
+else
 echo "Extracting empirical formulas ..."
 
 for i in *.cif
@@ -20,6 +29,7 @@ do
         grep "$i" all_formulae.txt | awk '{print$1}' > $ii.lst
         ((n++))
 done
+fi
 
 echo "Checking for empirical formula multiples ..."
 
@@ -1,22 +1,153 @@
 #!/bin/bash
 
-for i in $(wc -l *.lst | awk '$1 > 1 {print$2}' | grep -v total )
+# usage: pdd_matrix_elform.sh [archive.cifpack or cif directory]
+# with a packed cif archive (or directory) the structures of each *.lst are
+# read from it instead of being concatenated into *_pdd.cif files, and set
+# MOSAEC_CACHE to reuse the shared parsed-structure cache
+# set SHARD=i/N to run only shard i of N of the formula groups on this node,
+# balanced by no. pairwise comparisons (merge with mosaec/shard.py)
+# set MOSAEC_EVENTS=events.jsonl to record per-group timings & failures,
+# summarized at the end (or live with python -m mosaec.progress watch)
+ARCHIVE=$1
+export MOSAEC_ROOT=${MOSAEC_ROOT:-$(dirname "$(realpath "$0")")/..}
+
+LST_FILES=$(wc -l *.lst | awk '$1 > 1 {print$2}' | grep -v total )
+if [ -n "$SHARD" ]
+then
+        LST_FILES=$(PYTHONPATH="$MOSAEC_ROOT:$PYTHONPATH" python -m mosaec.shard select $SHARD --cost lst_pairs $LST_FILES)
+fi
+
+NUM_LST=$(echo $LST_FILES | wc -w)
+n=0
+for i in $LST_FILES
 do
-        echo "running $i comparisons ..."
-        for ii in $(cat $i)
-        do
-                cat $ii  >> ${i%.lst}_pdd.cif
-        done
+        ((n++))
+        echo "[$n/$NUM_LST] running $i comparisons ..."
+        if [ -z "$ARCHIVE" ]
+        then
+                for ii in $(cat $i)
+                do
+                        cat $ii  >> ${i%.lst}_pdd.cif
+                done
+        fi
 
-        cat > pdd_matrix_compare.py << EOF
+        cat > pdd_matrix_compare.py << 'EOF'
+import os
+import sys
+import time
+import tempfile
 from sys import argv
 import amd
+import numpy as np
 import pandas as pd
 
 structure_list = argv[1]
 struc_base = structure_list.split('.cif')[0]
+stime = time.time()
+sys.path.append(
+    os.environ.get(
+        'MOSAEC_ROOT',
+        os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'),
+    )
+)
+
+
+# JSONL event of this formula group if MOSAEC_EVENTS is set (mosaec/progress.py)
+def record_event(status, error=None, **info):
+    if not os.environ.get('MOSAEC_EVENTS'):
+        return
+    from mosaec.progress import write_event
+
+    item = os.path.basename(argv[-1])
+    write_event(item, status, time.time() - stime, error, 'pdd', **info)
+
+
+# python pdd_matrix_compare.py SOURCE FORMULA.lst
+# reads the listed structures from a packed cif archive (or cif directory),
+# through the shared parsed-structure cache if MOSAEC_CACHE is set
+tmp_cif = None
+if len(argv) > 2:
+    from mosaec.archive import CifArchive, is_archive
+
+    with open(argv[2], 'r') as rf:
+        names = [x.strip() for x in rf.read().split('\n') if x.strip() != '']
+    struc_base = argv[2].rsplit('.lst', 1)[0] + '_pdd'
+    if is_archive(structure_list):
+        archive = CifArchive(structure_list)
+        texts = [archive.read(name) for name in names]
+    else:
+        texts = []
+        for name in names:
+            with open(os.path.join(structure_list, name), 'r') as rf:
+                texts.append(rf.read())
+    if os.environ.get('MOSAEC_CACHE'):
+        from mosaec.cache import load_arrays
 
-pdd_df = amd.compare(structure_list, by='PDD', k=100)
+        structure_list = []
+        for name, text in zip(names, texts):
+            arrays = load_arrays(text=text)
+            if arrays is None:
+                # not cached (e.g., disordered sites), read as amd.compare would
+                with tempfile.NamedTemporaryFile(
+                    'w', suffix='.cif', delete=False
+                ) as tf:
+                    tf.write(text)
+                try:
+                    structure_list.extend(amd.CifReader(tf.name))
+                finally:
+                    os.remove(tf.name)
+                continue
+            cell = arrays['lattice']
+            motif = np.mod(arrays['frac_coords'], 1) @ cell
+            # named after the data block, as amd.CifReader names them
+            structure_list.append(
+                amd.PeriodicSet(
+                    motif, cell, name=str(arrays['name']), types=arrays['numbers']
+                )
+            )
+    else:
+        with tempfile.NamedTemporaryFile('w', suffix='.cif', delete=False) as tf:
+            for text in texts:
+                tf.write(text + '\n')
+        tmp_cif = tf.name
+        structure_list = tmp_cif
+
+
+# exact duplicates (same canonical fingerprint, see mosaec/fingerprint.py)
+# are compared once through their representative, their score is 0
+def collapse_duplicates(structures):
+    from mosaec.fingerprint import fingerprint
+
+    reps, rep_of, first = [], [], {}
+    for s in structures:
+        fp = fingerprint(s.cell, s.types, s.motif @ np.linalg.inv(s.cell))
+        if fp not in first:
+            first[fp] = len(reps)
+            reps.append(s)
+        rep_of.append(first[fp])
+    return reps, rep_of
+
+
+try:
+    if isinstance(structure_list, str):
+        # same reader settings as amd.compare
+        structure_list = list(amd.CifReader(structure_list))
+    reps, rep_of = collapse_duplicates(structure_list)
+    if len(reps) > 1:
+        rep_dist = amd.compare(reps, by='PDD', k=100).to_numpy()
+    else:
+        rep_dist = np.zeros((1, 1))
+except Exception as e:
+    record_event('failed', e)
+    raise
+finally:
+    if tmp_cif is not None:
+        os.remove(tmp_cif)
+
+structure_names = [s.name for s in structure_list]
+pdd_df = pd.DataFrame(
+    rep_dist[np.ix_(rep_of, rep_of)], index=structure_names, columns=structure_names
+)
 
 col_list = []
 for col in pdd_df.columns:
@@ -27,11 +158,29 @@ for col in pdd_df.columns:
 
 
 pdd_df.to_csv(f'{struc_base}.csv')
+num = len(pdd_df)
+record_event(
+    'ok',
+    structures=num,
+    pairs=num * (num - 1) // 2,
+    duplicates=num - len(reps),
+    compared=len(reps) * (len(reps) - 1) // 2,
+)
 
 EOF
         ## load necessary environment with amd package installed
         . ~/.venvs/XXXX/bin/activate
         echo "Running PDD for all ${i%.lst} structures ..."
-        python pdd_matrix_compare.py ${i%.lst}_pdd.cif > ${i%.lst}_pdd.pyout
+        if [ -z "$ARCHIVE" ]
+        then
+                python pdd_matrix_compare.py ${i%.lst}_pdd.cif > ${i%.lst}_pdd.pyout
+        else
+                python pdd_matrix_compare.py $ARCHIVE $i > ${i%.lst}_pdd.pyout
+        fi
 
 done
+
+if [ -n "$MOSAEC_EVENTS" ]
+then
+        PYTHONPATH="$MOSAEC_ROOT:$PYTHONPATH" python -m mosaec.progress summary "$MOSAEC_EVENTS" --stage pdd
+fi
@@ -0,0 +1 @@
+"""Shared helpers used by the MOSAEC-DB construction and analysis scripts."""
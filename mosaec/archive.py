@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+import os
+import gzip
+import json
+import mmap
+import zlib
+import struct
+import argparse
+
+from multiprocessing import Pool
+
+MAGIC = b"CIFPACK1"
+FOOTER = struct.Struct("<QQ8s")
+CODECS = ["none", "gzip", "zstd"]
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("the zstd codec requires the zstandard package")
+    return zstandard
+
+
+def compress(data, codec="gzip", level=None):
+    if codec == "none":
+        return data
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=level or 6, mtime=0)
+    if codec == "zstd":
+        return _zstd().ZstdCompressor(level=level or 3).compress(data)
+    raise ValueError(f"unknown codec {codec}")
+
+
+def decompress(data, codec="gzip"):
+    if codec == "none":
+        return bytes(data)
+    if codec == "gzip":
+        return zlib.decompress(data, 31)
+    if codec == "zstd":
+        return _zstd().ZstdDecompressor().decompress(data)
+    raise ValueError(f"unknown codec {codec}")
+
+
+# cif files below a directory (or listed in a .txt file), paths relative to it
+def find_cifs(source):
+    if source.endswith(".txt"):
+        root = os.path.dirname(os.path.abspath(source))
+        with open(source, "r") as rf:
+            paths = [x.strip() for x in rf.read().split("\n") if x.strip() != ""]
+        return root, paths
+    paths = []
+    for dir_path, _, files in os.walk(source):
+        paths += [
+            os.path.relpath(os.path.join(dir_path, f), source)
+            for f in files
+            if f.endswith(".cif")
+        ]
+    return source, sorted(paths)
+
+
+def _pack_job(job):
+    full_path, codec, level = job
+    with open(full_path, "rb") as rf:
+        data = rf.read()
+    return compress(data, codec, level), len(data)
+
+
+def pack(source, archive, codec="gzip", level=None, num_cpus=1):
+    """
+    Pack cifs into a single archive of (optionally compressed) records
+    followed by an offset index.
+
+        Parameters:
+            source (str): database directory, or .txt file of cif paths
+            archive (str): path of the archive to write (.cifpack)
+            codec (str): per-record compression, one of "none", "gzip" or "zstd"
+            level (int): compression level (default: codec default)
+            num_cpus (int): no. processes compressing records
+
+        Returns:
+            num_records (int): no. cifs packed
+    """
+    if codec not in CODECS:
+        raise ValueError(f"unknown codec {codec}")
+    root, paths = find_cifs(source)
+    names = [os.path.basename(p) for p in paths]
+    if len(set(names)) != len(names):
+        raise ValueError(f"{source} | cif names are not unique")
+    jobs = [(os.path.join(root, p), codec, level) for p in paths]
+    records = []
+    tmp_archive = f"{archive}.tmp"
+    with open(tmp_archive, "wb") as wf:
+        wf.write(MAGIC)
+        pool = Pool(int(num_cpus)) if int(num_cpus) > 1 else None
+        try:
+            packed = (
+                pool.imap(_pack_job, jobs, chunksize=64)
+                if pool
+                else map(_pack_job, jobs)
+            )
+            for name, path, (data, raw_size) in zip(names, paths, packed):
+                records.append([name, path, wf.tell(), len(data), raw_size])
+                wf.write(data)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        index = zlib.compress(json.dumps({"codec": codec, "records": records}).encode())
+        index_offset = wf.tell()
+        wf.write(index)
+        wf.write(FOOTER.pack(index_offset, len(index), MAGIC))
+    os.replace(tmp_archive, archive)
+    return len(records)
+
+
+def is_archive(path):
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as rf:
+        return rf.read(len(MAGIC)) == MAGIC
+
+
+class CifArchive:
+    """Memory-mapped reader of a packed cif archive, O(1) fetch by cif name."""
+
+    def __init__(self, archive):
+        self.archive = archive
+        self._mm = None
+        self._pid = None
+        with open(archive, "rb") as rf:
+            rf.seek(-FOOTER.size, os.SEEK_END)
+            index_offset, index_size, magic = FOOTER.unpack(rf.read(FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{archive} | not a cif archive")
+            rf.seek(index_offset)
+            index = json.loads(zlib.decompress(rf.read(index_size)))
+        self.codec = index["codec"]
+        self.records = {r[0]: tuple(r[1:]) for r in index["records"]}
+
+    @property
+    def mm(self):
+        # one mapping per process, safe to use after fork
+        if self._mm is None or self._pid != os.getpid():
+            with open(self.archive, "rb") as rf:
+                self._mm = mmap.mmap(rf.fileno(), 0, access=mmap.ACCESS_READ)
+            self._pid = os.getpid()
+        return self._mm
+
+    def names(self):
+        return list(self.records)
+
+    def path(self, name):
+        return self.records[name][0]
+
+    def read_bytes(self, name):
+        _, offset, size, _ = self.records[name]
+        return decompress(self.mm[offset : offset + size], self.codec)
+
+    def read(self, name):
+        return self.read_bytes(name).decode()
+
+    # sequential (name, text) in archive order
+    def __iter__(self):
+        for name in sorted(self.records, key=lambda n: self.records[n][1]):
+            yield name, self.read(name)
+
+    def __contains__(self, name):
+        return name in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update({"_mm": None, "_pid": None})
+        return state
+
+    def close(self):
+        if self._mm is not None and self._pid == os.getpid():
+            self._mm.close()
+        self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# cif text of one structure, for scripts checking a single structure
+def read_archive_cif(archive, name):
+    with CifArchive(archive) as arc:
+        return arc.read(name)
+
+
+# write archive records back out as individual cif files
+def extract(archive, dest_dir, names=None):
+    if not isinstance(archive, CifArchive):
+        archive = CifArchive(archive)
+    names = archive.names() if names is None else names
+    os.makedirs(dest_dir, exist_ok=True)
+    written = []
+    for name in names:
+        dst = os.path.join(dest_dir, name)
+        with open(dst, "wb") as wf:
+            wf.write(archive.read_bytes(name))
+        written.append(dst)
+    return written
+
+
+if __name__ == "__main__":
+    code_desc = (
+        "Pack MOSAEC-DB cifs into a single indexed archive, or list/extract one."
+    )
+    parser = argparse.ArgumentParser(description=code_desc)
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack_ = commands.add_parser("pack", help="pack a database directory.")
+    pack_.add_argument("source", type=str, help="database directory or .txt of cifs.")
+    pack_.add_argument("archive", type=str, help="archive to write (.cifpack).")
+    pack_.add_argument("--codec", type=str, default="gzip", choices=CODECS)
+    pack_.add_argument("--level", type=int, default=None, help="compression level.")
+    pack_.add_argument(
+        "--num_cpus", type=int, default=1, help="no. processes compressing cifs."
+    )
+    list_ = commands.add_parser("list", help="print the cif names of an archive.")
+    list_.add_argument("archive", type=str)
+    extract_ = commands.add_parser("extract", help="write archive cifs to a directory.")
+    extract_.add_argument("archive", type=str)
+    extract_.add_argument("dest_dir", type=str)
+    extract_.add_argument(
+        "--names", type=str, default=None, help="subset file (.txt) of cif names."
+    )
+    args = parser.parse_args()
+    #
+    if args.command == "pack":
+        num = pack(args.source, args.archive, args.codec, args.level, args.num_cpus)
+        print(f"Packed {num} cifs ... {args.archive}")
+    elif args.command == "list":
+        for name in CifArchive(args.archive).names():
+            print(name)
+    else:
+        names = None
+        if args.names is not None:
+            with open(args.names, "r") as rf:
+                names = [x.strip() for x in rf.read().split("\n") if x.strip() != ""]
+        written = extract(args.archive, args.dest_dir, names)
+        print(f"Extracted {len(written)} cifs ... {args.dest_dir}")
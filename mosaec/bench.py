@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import glob
+import argparse
+import platform
+import resource
+import itertools
+import contextlib
+import subprocess
+import multiprocessing as mp
+
+import numpy as np
+
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# elements of the synthetic frameworks, one metal per formula group
+METALS = ["Zn", "Cu", "Co", "Ni", "Mn", "Cd", "Zr", "Mg"]
+LINKER = {"C": 0.4, "H": 0.3, "O": 0.2, "N": 0.1}
+# P2_1/c operations of the asymmetric-unit cifs used by the P1 conversion
+P21C_OPS = ["x,y,z", "-x,1/2+y,1/2-z", "-x,-y,-z", "x,1/2-y,1/2+z"]
+STAGES = ["group", "pdd", "analyze", "p1", "pac"]
+
+
+# element counts of a formula group, ~1 metal per 12 atoms
+def random_composition(rng, num_atoms):
+    metal = str(rng.choice(METALS))
+    num_metal = max(1, num_atoms // 12)
+    rest = num_atoms - num_metal
+    counts = {el: int(rest * frac) for el, frac in LINKER.items()}
+    counts["C"] += rest - sum(counts.values())
+    counts[metal] = num_metal
+    return {el: n for el, n in counts.items() if n > 0}
+
+
+# Hill order formula as written by the CSD e.g., 'C8 H4 O5 Zn2'
+def formula_sum(counts):
+    order = [el for el in ("C", "H") if el in counts]
+    order += sorted(el for el in counts if el not in ("C", "H"))
+    return " ".join(f"{el}{counts[el] if counts[el] > 1 else ''}" for el in order)
+
+
+def random_cell(rng, num_atoms):
+    edge = (12.0 * num_atoms) ** (1 / 3)
+    lengths = edge * rng.uniform(0.85, 1.15, 3)
+    angles = rng.uniform(80, 100, 3)
+    return np.concatenate([lengths, angles])
+
+
+def cif_text(name, cell, symbols, frac, ops=("x,y,z",), formula=None):
+    lines = [f"data_{name}"]
+    if formula is not None:
+        lines.append(f"_chemical_formula_sum  '{formula}'")
+    for tag, value in zip(
+        [
+            "length_a",
+            "length_b",
+            "length_c",
+            "angle_alpha",
+            "angle_beta",
+            "angle_gamma",
+        ],
+        cell,
+    ):
+        lines.append(f"_cell_{tag}  {value:.6f}")
+    lines += [
+        f"_symmetry_space_group_name_H-M  '{'P 1' if len(ops) == 1 else 'P 21/c'}'",
+        "loop_",
+        "_symmetry_equiv_pos_site_id",
+        "_symmetry_equiv_pos_as_xyz",
+    ]
+    lines += [f"{k + 1} {op}" for k, op in enumerate(ops)]
+    lines += [
+        "loop_",
+        "_atom_site_label",
+        "_atom_site_type_symbol",
+        "_atom_site_fract_x",
+        "_atom_site_fract_y",
+        "_atom_site_fract_z",
+        "_atom_site_occupancy",
+    ]
+    counter = {}
+    for symbol, xyz in zip(symbols, frac):
+        counter[symbol] = counter.get(symbol, 0) + 1
+        lines.append(
+            f"{symbol}{counter[symbol]} {symbol} "
+            + "{:.6f} {:.6f} {:.6f} 1".format(*xyz)
+        )
+    return "\n".join(lines) + "\n"
+
+
+# stored sites of a P1 cif in the charge json format read by write_pac_cif.py
+def charge_entry(rng, symbols, frac):
+    frac = np.round(frac, 6)
+    rand_key = rng.random(3)
+    sums = (frac * rand_key).sum(axis=1)
+    entry = {"rand_key": rand_key.tolist()}
+    counter = {}
+    for symbol, xyz, frac_sum in zip(symbols, frac, sums):
+        counter[symbol] = counter.get(symbol, 0) + 1
+        entry.setdefault(symbol, []).append(
+            {
+                "x": float(xyz[0]),
+                "sum_rand": float(frac_sum),
+                "label": f"{symbol}{counter[symbol]}",
+                "charge": round(float(rng.normal(0, 0.3)), 6),
+            }
+        )
+    return entry
+
+
+def generate(dest, num, max_group=8, dup_fraction=0.1, atoms=(50, 200), seed=0):
+    """
+    Write a synthetic database of P1 structures in formula groups, with
+    planted near-duplicates, a matching charge json and PDD-like scores.
+
+        Parameters:
+            dest (str): output directory
+            num (int): no. structures
+            max_group (int): largest formula group (sizes drawn from 1 to max)
+            dup_fraction (float): fraction of group members which are
+                                  perturbed copies of an earlier member
+            atoms (tuple of int): min & max no. atoms per structure
+            seed (int): random seed, identical seeds give identical databases
+
+        Returns:
+            summary (dict): no. structures, groups & planted duplicates
+    """
+    rng = np.random.default_rng(seed)
+    cif_dir = os.path.join(dest, "cifs")
+    asym_dir = os.path.join(dest, "asym")
+    os.makedirs(cif_dir, exist_ok=True)
+    os.makedirs(asym_dir, exist_ok=True)
+    charges = {}
+    duplicates = []
+    groups = []
+    k = 0
+    while k < num:
+        size = min(int(rng.integers(1, max_group + 1)), num - k)
+        counts = random_composition(rng, int(rng.integers(atoms[0], atoms[1] + 1)))
+        symbols = [el for el, n in counts.items() for _ in range(n)]
+        formula = formula_sum(counts)
+        members = []
+        for _ in range(size):
+            name = f"BENCH{k:07d}_full"
+            if len(members) > 0 and rng.random() < dup_fraction:
+                parent = members[int(rng.integers(len(members)))]
+                cell = parent[1] * (1 + rng.normal(0, 0.002, 6))
+                frac = np.clip(
+                    parent[2] + rng.normal(0, 0.002, parent[2].shape), 0.01, 0.99
+                )
+                duplicates.append((parent[0], name))
+            else:
+                cell = random_cell(rng, len(symbols))
+                frac = rng.uniform(0.01, 0.99, (len(symbols), 3))
+            members.append((name, cell, frac))
+            with open(os.path.join(cif_dir, f"{name}.cif"), "w") as wf:
+                wf.write(cif_text(name, cell, symbols, frac, formula=formula))
+            charges[f"{name}.cif"] = charge_entry(rng, symbols, frac)
+            # asymmetric unit (every 4th site & a metal on the inversion
+            # centre) for the P1 conversion
+            asym_symbols = [symbols[-1]] + symbols[::4]
+            asym_frac = np.vstack([np.zeros((1, 3)), frac[::4] / 2])
+            with open(os.path.join(asym_dir, f"{name}.cif"), "w") as wf:
+                wf.write(cif_text(name, cell, asym_symbols, asym_frac, P21C_OPS))
+            k += 1
+        groups.append([m[0] for m in members])
+    with open(os.path.join(dest, "charges.json"), "w") as wf:
+        json.dump(charges, wf)
+    with open(os.path.join(dest, "duplicates.txt"), "w") as wf:
+        wf.writelines(f"{a}.cif,{b}.cif\n" for a, b in duplicates)
+    # stand-in for the PDD scores when amd is not installed, planted
+    # duplicates score below the analyze_pdd_csv.py threshold
+    planted = set(duplicates)
+    with open(os.path.join(dest, "pdd_scores_synthetic.txt"), "w") as wf:
+        wf.write("s1,s2,pdd_score\n")
+        for names in groups:
+            for a, b in itertools.combinations(names, 2):
+                score = 0.01 if (a, b) in planted else rng.uniform(0.2, 2.0)
+                wf.write(f"{a}.cif,{b}.cif,{score:.6f}\n")
+    summary = {"structures": num, "groups": len(groups), "duplicates": len(duplicates)}
+    with open(os.path.join(dest, "bench_db.json"), "w") as wf:
+        json.dump(dict(summary, seed=seed, max_group=max_group, atoms=list(atoms)), wf)
+    return summary
+
+
+# group_by_chemel.sh equivalent, formula lists from a manifest of the cifs
+def stage_group(db_dir, work_dir, num_cpus):
+    from mosaec.manifest import build_manifest, write_formula_lists
+
+    manifest = os.path.join(work_dir, "manifest.sqlite")
+    # full build, not an incremental refresh of an earlier run
+    if os.path.exists(manifest):
+        os.remove(manifest)
+    build_manifest(os.path.join(db_dir, "cifs"), manifest, num_cpus=num_cpus)
+    groups = write_formula_lists(manifest, work_dir)
+    return sum(len(names) for names in groups.values()), f"{len(groups)} groups"
+
+
+# pairwise PDD of every formula group, as pdd_matrix_elform.sh
+def stage_pdd(db_dir, work_dir, num_cpus):
+    import importlib.util
+
+    if importlib.util.find_spec("amd") is None:
+        raise ImportError("amd is not installed")
+    from mosaec.shard import merge_scores
+
+    script = os.path.join(REPO_ROOT, "duplicates", "pdd_matrix_compare.py")
+    env = dict(os.environ, MOSAEC_ROOT=REPO_ROOT)
+    lsts = glob.glob(os.path.join(work_dir, "*.lst"))
+    if len(lsts) == 0:
+        raise FileNotFoundError("no formula lists, run the group stage first")
+    pyouts = []
+    for lst in lsts:
+        with open(lst, "r") as rf:
+            if len([x for x in rf.read().split("\n") if x.strip() != ""]) < 2:
+                continue
+        pyout = lst.rsplit(".lst", 1)[0] + "_pdd.pyout"
+        with open(pyout, "w") as wf:
+            subprocess.run(
+                [sys.executable, script, os.path.join(db_dir, "cifs"), lst],
+                stdout=wf,
+                cwd=work_dir,
+                env=env,
+                check=True,
+            )
+        pyouts.append(pyout)
+    num, missing = merge_scores(pyouts, os.path.join(work_dir, "pdd_scores.txt"), lsts)
+    return num, f"{len(missing)} incomplete groups"
+
+
+def stage_analyze(db_dir, work_dir, num_cpus):
+    scores = os.path.join(work_dir, "pdd_scores.txt")
+    note = None
+    if not os.path.exists(scores):
+        scores = os.path.join(db_dir, "pdd_scores_synthetic.txt")
+        note = "synthetic scores"
+    with open(scores, "r") as rf:
+        num = len([x for x in rf.read().split("\n") if x.strip() != ""]) - 1
+    subprocess.run(
+        [
+            sys.executable,
+            os.path.join(REPO_ROOT, "duplicates", "analyze_pdd_csv.py"),
+            scores,
+            os.path.join(db_dir, "cifs"),
+            "-output_csv",
+            os.path.join(work_dir, "duplicate_pdd.csv"),
+        ],
+        stdout=sys.stdout,
+        check=True,
+    )
+    return num, note
+
+
+# P1 conversion of the asymmetric units (convert_to_p1 & remove_duplicate_atoms)
+def stage_p1(db_dir, work_dir, num_cpus):
+    sys.path.append(os.path.join(REPO_ROOT, "zenodo"))
+    from clean_csd_mofs import cif_to_pymatgen
+
+    num_sites = 0
+    cifs = sorted(glob.glob(os.path.join(db_dir, "asym", "*.cif")))
+    for cif in cifs:
+        with open(cif, "r") as rf:
+            num_sites += len(cif_to_pymatgen(rf.read()))
+    return len(cifs), f"{num_sites} P1 sites"
+
+
+def stage_pac(db_dir, work_dir, num_cpus):
+    sys.path.append(os.path.join(REPO_ROOT, "zenodo"))
+    from write_pac_cif import assign_partial_atomic_charges
+
+    out_dir = os.path.join(work_dir, "pac")
+    os.makedirs(out_dir, exist_ok=True)
+    charges = os.path.join(db_dir, "charges.json")
+    num = assign_partial_atomic_charges(
+        os.path.join(db_dir, "cifs"), [("REPEAT", charges, out_dir)], num_cpus
+    )
+    return num, None
+
+
+STAGE_FUNCS = {
+    "group": stage_group,
+    "pdd": stage_pdd,
+    "analyze": stage_analyze,
+    "p1": stage_p1,
+    "pac": stage_pac,
+}
+
+
+# peak resident memory (MB) of this process & its finished children
+def peak_rss():
+    rss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return rss / 1024
+
+
+def _stage_child(func, args, log_path, queue):
+    result = {"status": "ok", "items": 0, "note": None}
+    log = open(log_path, "w")
+    with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        start = time.perf_counter()
+        try:
+            result["items"], result["note"] = func(*args)
+        except ImportError as e:
+            result.update(status="skipped", note=str(e))
+        except Exception as e:
+            result.update(status="failed", note=f"{type(e).__name__}: {e}")
+        result["seconds"] = time.perf_counter() - start
+    log.close()
+    result["peak_rss_mb"] = peak_rss()
+    queue.put(result)
+
+
+def run_stage(stage, db_dir, work_dir, num_cpus=1):
+    """
+    Time one stage in a fresh process, so that its peak memory is measured
+    on its own.
+
+        Parameters:
+            stage (str): one of STAGES
+            db_dir (str): synthetic database made by generate
+            work_dir (str): directory of the stage outputs
+            num_cpus (int): no. processes for stages which use a pool
+
+        Returns:
+            result (dict): status (ok, skipped or failed), items, seconds,
+                           items_per_s, peak_rss_mb & note
+    """
+    ctx = mp.get_context("fork")
+    queue = ctx.Queue()
+    log_path = os.path.join(work_dir, f"{stage}.log")
+    args = (db_dir, work_dir, num_cpus)
+    proc = ctx.Process(
+        target=_stage_child, args=(STAGE_FUNCS[stage], args, log_path, queue)
+    )
+    proc.start()
+    result = queue.get()
+    proc.join()
+    seconds = result["seconds"]
+    result["items_per_s"] = result["items"] / seconds if seconds > 0 else None
+    return dict(stage=stage, **result)
+
+
+def environment():
+    from importlib import metadata
+
+    env = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    for package in ["numpy", "pandas", "pymatgen", "amd"]:
+        try:
+            env[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            env[package] = None
+    try:
+        env["commit"] = subprocess.run(
+            ["git", "-C", REPO_ROOT, "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        env["commit"] = None
+    return env
+
+
+def run(sizes, work_dir, stages=STAGES, num_cpus=1, seed=0, **db_args):
+    """
+    Generate a synthetic database for every size and time each stage of the
+    workflow on it.
+
+        Parameters:
+            sizes (list of int): no. structures of each benchmark database
+            work_dir (str): directory of the databases & stage outputs
+            stages (list of str): stages to time, in workflow order
+            num_cpus (int): no. processes for stages which use a pool
+            seed (int): random seed of the databases
+            db_args: max_group, dup_fraction & atoms passed to generate
+
+        Returns:
+            results (dict): environment & one record per size and stage
+    """
+    results = {"environment": environment(), "num_cpus": num_cpus, "results": []}
+    for num in sizes:
+        db_dir = os.path.join(work_dir, f"n{num}")
+        stage_dir = os.path.join(db_dir, "work")
+        os.makedirs(stage_dir, exist_ok=True)
+        start = time.perf_counter()
+        summary = generate(db_dir, num, seed=seed, **db_args)
+        print(f"Generated {num} structures ... {time.perf_counter() - start:.1f} s")
+        for stage in stages:
+            result = run_stage(stage, db_dir, stage_dir, num_cpus)
+            results["results"].append(dict(n=num, database=summary, **result))
+            rate = result["items_per_s"]
+            print(
+                f"{num} | {stage} | {result['status']} | {result['seconds']:.2f} s"
+                f" | {rate or 0:.1f} items/s | {result['peak_rss_mb']:.0f} MB"
+                + (f" | {result['note']}" if result["note"] else "")
+            )
+    return results
+
+
+# relative change of throughput & peak memory against a baseline result file
+def compare(baseline, current):
+    with open(baseline, "r") as rf:
+        old = {(r["n"], r["stage"]): r for r in json.load(rf)["results"]}
+    with open(current, "r") as rf:
+        new = {(r["n"], r["stage"]): r for r in json.load(rf)["results"]}
+    rows = []
+    for key in sorted(set(old) & set(new)):
+        a, b = old[key], new[key]
+        if a["status"] != "ok" or b["status"] != "ok" or not a["items_per_s"]:
+            continue
+        rows.append(
+            {
+                "n": key[0],
+                "stage": key[1],
+                "speedup": b["items_per_s"] / a["items_per_s"],
+                "memory": b["peak_rss_mb"] / a["peak_rss_mb"],
+            }
+        )
+    return rows
+
+
+if __name__ == "__main__":
+    code_desc = "Benchmark the MOSAEC-DB workflow on synthetic databases."
+    parser = argparse.ArgumentParser(description=code_desc)
+    commands = parser.add_subparsers(dest="command", required=True)
+    db_parser = argparse.ArgumentParser(add_help=False)
+    db_parser.add_argument(
+        "--max_group", type=int, default=8, help="largest formula group."
+    )
+    db_parser.add_argument(
+        "--dup_fraction",
+        type=float,
+        default=0.1,
+        help="fraction of structures planted as near-duplicates.",
+    )
+    db_parser.add_argument(
+        "--atoms",
+        type=int,
+        nargs=2,
+        default=[50, 200],
+        metavar=("MIN", "MAX"),
+        help="no. atoms per structure.",
+    )
+    db_parser.add_argument("--seed", type=int, default=0, help="random seed.")
+    generate_ = commands.add_parser(
+        "generate", parents=[db_parser], help="write one synthetic database."
+    )
+    generate_.add_argument("dest", type=str, help="output directory.")
+    generate_.add_argument("num", type=int, help="no. structures.")
+    run_ = commands.add_parser(
+        "run", parents=[db_parser], help="time every stage at several sizes."
+    )
+    run_.add_argument(
+        "--sizes", type=int, nargs="+", default=[100, 1000], help="no. structures."
+    )
+    run_.add_argument(
+        "--stages", nargs="+", default=STAGES, choices=STAGES, help="stages to time."
+    )
+    run_.add_argument(
+        "--work_dir", type=str, default="mosaec_bench", help="benchmark directory."
+    )
+    run_.add_argument(
+        "--num_cpus", type=int, default=1, help="no. processes for pooled stages."
+    )
+    run_.add_argument(
+        "-o", "--output", type=str, default="bench.json", help="results (.json)."
+    )
+    compare_ = commands.add_parser(
+        "compare", help="throughput & memory change against a baseline."
+    )
+    compare_.add_argument("baseline", type=str, help="earlier results (.json).")
+    compare_.add_argument("current", type=str, help="new results (.json).")
+    args = parser.parse_args()
+    #
+    if args.command == "generate":
+        summary = generate(
+            args.dest,
+            args.num,
+            args.max_group,
+            args.dup_fraction,
+            tuple(args.atoms),
+            args.seed,
+        )
+        print(json.dumps(summary))
+    elif args.command == "run":
+        results = run(
+            args.sizes,
+            args.work_dir,
+            args.stages,
+            args.num_cpus,
+            args.seed,
+            max_group=args.max_group,
+            dup_fraction=args.dup_fraction,
+            atoms=tuple(args.atoms),
+        )
+        with open(args.output, "w") as wf:
+            json.dump(results, wf, indent=2)
+        print(f"Results ... {args.output}")
+    else:
+        for row in compare(args.baseline, args.current):
+            print(
+                f"{row['n']} | {row['stage']} | speedup {row['speedup']:.2f}x"
+                f" | memory {row['memory']:.2f}x"
+            )
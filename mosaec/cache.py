@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+import os
+import re
+import glob
+import shutil
+import hashlib
+import argparse
+import warnings
+
+import numpy as np
+
+from multiprocessing import Pool
+
+# default cache location, overridden by the MOSAEC_CACHE environment variable
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "mosaec", "structures")
+
+
+def cache_dir_or_default(cache_dir=None):
+    return cache_dir or os.environ.get("MOSAEC_CACHE") or DEFAULT_CACHE
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def entry_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], f"{key}.npz")
+
+
+# parse cif text the way the tools do (pymatgen, conventional cell as written)
+def parse_cif(text):
+    from pymatgen.io.cif import CifParser
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return CifParser.from_str(text).get_structures(primitive=False)[0]
+
+
+# name of the first data block, e.g. ABCDEF from data_ABCDEF (as amd names sets)
+def block_name(text):
+    match = re.search(r"^\s*data_(\S*)", text, re.MULTILINE)
+    return match.group(1) if match else ""
+
+
+def to_arrays(struct):
+    return {
+        "lattice": np.asarray(struct.lattice.matrix, dtype=np.float64),
+        "numbers": np.array([site.specie.Z for site in struct], dtype=np.int16),
+        "frac_coords": np.asarray(struct.frac_coords, dtype=np.float64),
+        "labels": np.array([site.label for site in struct], dtype=str),
+    }
+
+
+def to_structure(arrays):
+    from pymatgen.core import Lattice, Structure
+
+    return Structure(
+        Lattice(arrays["lattice"]),
+        [int(z) for z in arrays["numbers"]],
+        arrays["frac_coords"],
+        labels=[str(x) for x in arrays["labels"]],
+    )
+
+
+class StructureCache:
+    """Parsed structures stored as binary arrays, keyed by cif content hash."""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir_or_default(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_arrays(self, data):
+        """
+        Arrays of a cif, parsing it only if its content was never cached. An
+        edited file has a new hash, so stale entries are never returned.
+
+            Parameters:
+                data (bytes): cif file contents
+
+            Returns:
+                arrays (dict): lattice (3, 3), numbers (n,), frac_coords (n, 3),
+                               labels (n,) & name (data block); None if the
+                               structure cannot be cached (e.g., disordered
+                               sites)
+        """
+        key = content_hash(data)
+        path = entry_path(self.cache_dir, key)
+        try:
+            with np.load(path) as npz:
+                arrays = {k: npz[k] for k in npz.files}
+            # entries written before the block name was stored are re-parsed
+            if "name" in arrays:
+                return arrays
+        except (OSError, ValueError, KeyError):
+            pass
+        text = data.decode()
+        struct = parse_cif(text)
+        if not struct.is_ordered:
+            return None
+        arrays = to_arrays(struct)
+        arrays["name"] = np.array(block_name(text))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # unique temporary name, concurrent writers of one entry are harmless
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as wf:
+            np.savez(wf, **arrays)
+        os.replace(tmp_path, path)
+        return arrays
+
+    def get_structure(self, data):
+        arrays = self.get_arrays(data)
+        if arrays is None:
+            return parse_cif(data.decode())
+        return to_structure(arrays)
+
+    def keys(self):
+        return [
+            os.path.basename(p)[: -len(".npz")]
+            for p in glob.glob(os.path.join(self.cache_dir, "??", "*.npz"))
+        ]
+
+    # drop entries whose hash is not in keep (e.g., manifest sha256 column)
+    def prune(self, keep):
+        keep = set(keep)
+        num_removed = 0
+        for key in self.keys():
+            if key not in keep:
+                os.remove(entry_path(self.cache_dir, key))
+                num_removed += 1
+        return num_removed
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+
+def load_structure(path=None, text=None, cache_dir=None):
+    """
+    Read a pymatgen Structure from a cif file (or cif text) through the
+    parsed-structure cache.
+
+        Parameters:
+            path (str): cif file
+            text (str): cif text, used instead of reading path
+            cache_dir (str): cache directory (default: $MOSAEC_CACHE or
+                             ~/.cache/mosaec/structures)
+
+        Returns:
+            struct (Pymatgen Structure object): the parsed structure
+    """
+    if text is not None:
+        data = text.encode()
+    else:
+        with open(path, "rb") as rf:
+            data = rf.read()
+    return StructureCache(cache_dir).get_structure(data)
+
+
+def load_arrays(path=None, text=None, cache_dir=None):
+    if text is not None:
+        data = text.encode()
+    else:
+        with open(path, "rb") as rf:
+            data = rf.read()
+    return StructureCache(cache_dir).get_arrays(data)
+
+
+def _warm_job(job):
+    source, name, cache_dir = job
+    try:
+        if isinstance(source, str):
+            with open(os.path.join(source, name), "rb") as rf:
+                data = rf.read()
+        else:
+            data = source.read_bytes(name)
+        StructureCache(cache_dir).get_arrays(data)
+    except Exception as e:
+        return f"{name} | ERROR | {type(e).__name__}: {e}"
+    return None
+
+
+# parse every cif of a directory or packed archive into the cache
+def warm(source, cache_dir=None, num_cpus=1):
+    from mosaec.archive import CifArchive, is_archive
+
+    cache_dir = cache_dir_or_default(cache_dir)
+    if is_archive(source):
+        source = CifArchive(source)
+        names = source.names()
+    else:
+        names = [
+            os.path.relpath(p, source)
+            for p in glob.glob(f"{source}/**/*.cif", recursive=True)
+        ]
+    jobs = [(source, name, cache_dir) for name in names]
+    if int(num_cpus) > 1:
+        with Pool(int(num_cpus)) as pool:
+            errors = list(pool.imap_unordered(_warm_job, jobs, chunksize=16))
+    else:
+        errors = [_warm_job(job) for job in jobs]
+    errors = [e for e in errors if e is not None]
+    for error in errors:
+        print(error)
+    return len(names) - len(errors)
+
+
+if __name__ == "__main__":
+    code_desc = (
+        "Fill, prune or clear the parsed-structure cache shared by the MOSAEC-DB tools."
+    )
+    parser = argparse.ArgumentParser(description=code_desc)
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=None,
+        help="cache directory (default: $MOSAEC_CACHE or ~/.cache/mosaec/structures).",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    warm_ = commands.add_parser("warm", help="parse a directory or archive of cifs.")
+    warm_.add_argument("source", type=str, help="cif directory or packed archive.")
+    warm_.add_argument(
+        "--num_cpus", type=int, default=1, help="no. processes parsing cifs."
+    )
+    prune_ = commands.add_parser(
+        "prune", help="remove entries of structures no longer in a manifest."
+    )
+    prune_.add_argument("manifest", type=str, help="database manifest (.sqlite).")
+    commands.add_parser("clear", help="remove every cache entry.")
+    args = parser.parse_args()
+    #
+    if args.command == "warm":
+        num = warm(args.source, args.cache, args.num_cpus)
+        print(f"Cached structures ... {num}")
+    elif args.command == "prune":
+        from mosaec.manifest import open_manifest
+
+        conn = open_manifest(args.manifest)
+        keep = [row[0] for row in conn.execute("SELECT sha256 FROM structures")]
+        conn.close()
+        print(f"Removed entries ... {StructureCache(args.cache).prune(keep)}")
+    else:
+        StructureCache(args.cache).clear()
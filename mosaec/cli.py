@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+import io
+import os
+import ast
+import re
+import sys
+import time
+import runpy
+import argparse
+import contextlib
+import subprocess
+
+# scripts stay where they are in the repository (install with pip install -e .)
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# command > tool > script, the first tool of a command is its default
+COMMANDS = {
+    "validate": {
+        "overlap": "structure_validation/chk_overlap.py",
+        "hypervalent": "structure_validation/chk_hypervalent.py",
+    },
+    "dedup": {
+        "group": "duplicates/group_by_chemel.sh",
+        "pdd": "duplicates/pdd_matrix_elform.sh",
+        "compare": "duplicates/pdd_matrix_compare.py",
+        "analyze": "duplicates/analyze_pdd_csv.py",
+        "multiples": "duplicates/multiple_chemform.py",
+    },
+    "descriptors": {
+        "homology": "descriptors/gen_pers_homology.py",
+        "topology": "descriptors/run_crystalnets_pool.py",
+        "timings": "descriptors/summarize_timings.py",
+        "search": "descriptors/similarity_search.py",
+    },
+    "subset": {
+        "get": "zenodo/get_subset.py",
+        "fps": "zenodo/farthest_point_sampling.py",
+    },
+    "pac": {
+        "write": "zenodo/write_pac_cif.py",
+        "store": "zenodo/pac_store.py",
+        "unchanged": "zenodo/get_unchanged_mofs.py",
+    },
+}
+# default import-time budget (s) of a tool, before it does any work
+IMPORT_BUDGET = 1.0
+
+
+def script_path(command, tool):
+    return os.path.join(REPO_ROOT, COMMANDS[command][tool])
+
+
+def run_script(path, args):
+    """
+    Run a repository script as if called from the command line, in this
+    process for python scripts so that only the modules it imports are
+    loaded (and loaded once, when run for several files).
+
+        Parameters:
+            path (str): script path
+            args (list of str): command line arguments of the script
+
+        Returns:
+            code (int): exit status of the script
+    """
+    if path.endswith(".sh"):
+        env = dict(os.environ, MOSAEC_ROOT=REPO_ROOT)
+        return subprocess.call(["bash", path] + list(args), env=env)
+    script_dir = os.path.dirname(path)
+    if script_dir not in sys.path:
+        # script-local imports e.g., from scheduler import schedule
+        sys.path.insert(0, script_dir)
+    argv = sys.argv
+    sys.argv = [path] + list(args)
+    try:
+        runpy.run_path(path, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    finally:
+        sys.argv = argv
+    return 0
+
+
+# run a validator over many structures in one process, imports paid once
+def validate(tool, filenames, options, aliases=None, events=None):
+    path = script_path("validate", tool)
+    aliases = aliases or {}
+    code = 0
+    for filename in filenames:
+        if filename not in aliases:
+            code = max(code, run_script(path, [filename] + options))
+            continue
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            status = run_script(path, [filename] + options)
+        sys.stdout.write(out.getvalue())
+        for alias in aliases[filename]:
+            # identical structure, same result under its own name
+            sys.stdout.write(out.getvalue().replace(filename, alias))
+        alias_events(events, filename, aliases[filename])
+        code = max(code, status)
+    return code
+
+
+# copies of the event just written for a structure, for its aliases
+def alias_events(events, filename, aliases):
+    from mosaec.progress import events_path_or_env, last_event, write_event
+
+    events = events_path_or_env(events)
+    event = last_event(events)
+    if event is None or event["item"] != filename:
+        return
+    fields = ("time", "item", "stage", "duration", "status", "error", "message")
+    info = {k: v for k, v in event.items() if k not in fields}
+    info["alias_of"] = filename
+    for alias in aliases:
+        error = event.get("message")
+        write_event(alias, event["status"], 0.0, error, event["stage"], events, **info)
+
+
+def validate_aliases(filenames, aliases_csv="", archive=None, cache=None):
+    """
+    Group the structures to check by canonical fingerprint (see
+    mosaec/fingerprint.py), so each unique structure is checked once.
+
+        Parameters:
+            filenames (list of str): cif paths, or names in archive
+            aliases_csv (str): alias mapping, updated for new or modified
+                               structures ("" to keep it in memory)
+            archive (str): packed cif archive holding the structures
+            cache (str): structure cache directory ("" for the default)
+
+        Returns:
+            reps (list of str): structures to check
+            aliases (dict): representative > identical structures
+    """
+    from mosaec.shard import item_name
+    from mosaec.fingerprint import (
+        fingerprint_files,
+        group_aliases,
+        split_aliases,
+        update_aliases,
+    )
+
+    if archive is not None:
+        from mosaec.archive import CifArchive
+
+        archive = CifArchive(archive)
+    if aliases_csv:
+        representative = update_aliases(aliases_csv, filenames, archive, cache)
+    else:
+        fingerprints = fingerprint_files(filenames, archive, cache)
+        representative = group_aliases(
+            {item_name(x): fp for x, fp in fingerprints.items()}
+        )
+    return split_aliases(filenames, representative)
+
+
+# top-level import statements of a script, run without any of its work
+def import_statements(path):
+    with open(path, "r") as rf:
+        tree = ast.parse(rf.read(), path)
+    body = [n for n in tree.body if isinstance(n, (ast.Import, ast.ImportFrom))]
+    return ast.unparse(ast.Module(body=body, type_ignores=[]))
+
+
+def import_time(path, python=sys.executable):
+    """
+    Time the imports of a script: its top-level import statements run in a
+    fresh interpreter, so scripts without argparse or a __main__ guard are
+    timed without running them.
+
+        Parameters:
+            path (str): script path
+            python (str): interpreter
+
+        Returns:
+            total (float): seconds spent importing modules
+            packages (list of tuple): (seconds, top-level package), slowest first
+            error (str): last line of the error if the script failed (e.g.,
+                         ModuleNotFoundError), None otherwise
+    """
+    # script-local & mosaec imports resolve as when the script is run
+    code = (
+        f"import sys; sys.path[:0] = [{os.path.dirname(path)!r}, {REPO_ROOT!r}]\n"
+        + import_statements(path)
+    )
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(path),
+    )
+    packages, error = [], None
+    for line in proc.stderr.split("\n"):
+        if re.match(r"\w+(Error|Exception)\b", line):
+            error = line.strip()
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)", line)
+        # top-level imports only, nested ones are included in their parent
+        if match and match.group(2) == "":
+            packages.append((int(match.group(1)) / 1e6, match.group(3)))
+    total = sum(seconds for seconds, _ in packages)
+    if proc.returncode != 0 and error is None:
+        error = f"exit status {proc.returncode}"
+    return total, sorted(packages, reverse=True), error
+
+
+def import_report(budget=IMPORT_BUDGET, top=3):
+    over = 0
+    rows = [("cli", os.path.realpath(__file__))]
+    rows += [
+        (f"{command} {tool}", script_path(command, tool))
+        for command, tools in COMMANDS.items()
+        for tool in tools
+        if not COMMANDS[command][tool].endswith(".sh")
+    ]
+    for name, path in rows:
+        total, packages, error = import_time(path)
+        if error is not None:
+            # stopped at a failing import, its time is not the real cost
+            over += 1
+            print(f"{name:22s} {'':>8s}  FAILED  {error}")
+            continue
+        flag = "OVER" if total > budget else "ok"
+        over += flag == "OVER"
+        heaviest = ", ".join(f"{pkg} {seconds:.2f}" for seconds, pkg in packages[:top])
+        print(f"{name:22s} {total:6.2f} s  {flag:4s}  {heaviest}")
+    print(f"Import budget ... {budget:.2f} s, {over} over or failed")
+    return over
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    code_desc = "MOSAEC-DB construction & analysis tools."
+    parser = argparse.ArgumentParser(
+        prog="mosaec",
+        description=code_desc,
+        epilog="tools: "
+        + "; ".join(f"{c} {{{','.join(t)}}}" for c, t in COMMANDS.items())
+        + ". Arguments after the tool are passed to its script "
+        "(e.g., mosaec pac write --help).",
+    )
+    parser.add_argument(
+        "command", choices=list(COMMANDS) + ["imports"], help="tool group."
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=IMPORT_BUDGET,
+        help="import-time budget (s) per tool, for the imports report.",
+    )
+    if len(argv) == 0 or argv[0] in ("-h", "--help"):
+        parser.print_help()
+        return 0
+    command, rest = argv[0], argv[1:]
+    if command == "imports":
+        args = parser.parse_args(argv)
+        stime = time.time()
+        over = import_report(args.budget)
+        print(f"Elapsed ... {time.time() - stime:.1f} s")
+        return 1 if over > 0 else 0
+    if command not in COMMANDS:
+        parser.parse_args(argv)
+    tools = COMMANDS[command]
+    if len(rest) > 0 and rest[0] in tools:
+        tool, rest = rest[0], rest[1:]
+    else:
+        tool = next(iter(tools))
+    if command == "validate" and not any(x in ("-h", "--help") for x in rest):
+        vparser = argparse.ArgumentParser(
+            prog=f"mosaec validate {tool}",
+            description="Check one or more structures in a single process.",
+        )
+        vparser.add_argument("filenames", nargs="+", help="structure files (cif).")
+        for option in ("--manifest", "--archive", "--events"):
+            vparser.add_argument(option, type=str, default=None)
+        vparser.add_argument("--cache", type=str, nargs="?", const="", default=None)
+        vparser.add_argument(
+            "--aliases",
+            type=str,
+            nargs="?",
+            const="",
+            default=None,
+            help="check identical structures once (alias mapping csv, optional).",
+        )
+        args = vparser.parse_args(rest)
+        filenames, aliases = args.filenames, None
+        if args.aliases is not None and args.manifest is not None:
+            # locate the structures once, the validators then read paths
+            from mosaec.manifest import resolve_names
+
+            filenames, missing = resolve_names(args.manifest, filenames)
+            for name in missing:
+                print(f"{name} | ERROR | not in {args.manifest}")
+            args.manifest = None
+        options = []
+        for option in ("manifest", "archive", "events"):
+            if getattr(args, option) is not None:
+                options += [f"--{option}", getattr(args, option)]
+        if args.cache is not None:
+            options += ["--cache"] + ([args.cache] if args.cache else [])
+        if args.aliases is not None:
+            filenames, aliases = validate_aliases(
+                filenames, args.aliases, args.archive, args.cache
+            )
+        return validate(tool, filenames, options, aliases, args.events)
+    return run_script(script_path(command, tool), rest)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+import os
+import glob
+import hashlib
+import argparse
+
+import numpy as np
+
+from multiprocessing import Pool
+
+# resolution of the canonical form: fractional coordinates (decimals), cell
+# lengths (A) & angles (degrees)
+FRAC_DECIMALS = 3
+LENGTH_DECIMALS = 2
+ANGLE_DECIMALS = 1
+# aliases.csv columns, the content hash tells which rows are out of date
+ALIAS_COLUMNS = ["cif", "sha256", "fingerprint", "representative"]
+
+
+def canonical_form(lattice, numbers, frac_coords):
+    """
+    Canonical form of a periodic structure: Niggli-reduced cell, origin at a
+    site of the rarest element (the one giving the smallest form), sites
+    wrapped into the cell, coordinates rounded & sorted by element then
+    position. Identical structures written differently (site order, labels,
+    unit cell setting, origin, floating point noise) share the same form.
+
+        Parameters:
+            lattice (numpy array): (3, 3) lattice matrix (rows)
+            numbers (numpy array): (n,) atomic numbers
+            frac_coords (numpy array): (n, 3) fractional coordinates
+
+        Returns:
+            cell (numpy array): rounded reduced cell parameters (int64)
+            sites (numpy array): (n, 4) sorted atomic number & rounded
+                                 fractional coordinates (int64)
+    """
+    from pymatgen.core import Lattice
+
+    lattice = np.asarray(lattice, dtype=np.float64)
+    reduced = Lattice(lattice).get_niggli_reduced_lattice()
+    cart = np.asarray(frac_coords, dtype=np.float64) @ lattice
+    frac = np.linalg.solve(reduced.matrix.T, cart.T).T
+    numbers = np.asarray(numbers, dtype=np.int64)
+    scale = 10**FRAC_DECIMALS
+    sites = None
+    if len(numbers) > 0:
+        # rarest element, lowest atomic number on ties
+        elements, counts = np.unique(numbers, return_counts=True)
+        rarest = elements[np.argmin(counts)]
+        for origin in frac[numbers == rarest]:
+            q = np.rint(((frac - origin) % 1.0) * scale).astype(np.int64) % scale
+            candidate = np.column_stack([numbers, q])
+            candidate = candidate[np.lexsort(candidate.T[::-1])]
+            if sites is None or tuple(candidate.ravel()) < tuple(sites.ravel()):
+                sites = candidate
+    else:
+        sites = np.zeros((0, 4), dtype=np.int64)
+    cell = np.concatenate(
+        [
+            np.rint(np.array(reduced.abc) * 10**LENGTH_DECIMALS),
+            np.rint(np.array(reduced.angles) * 10**ANGLE_DECIMALS),
+        ]
+    ).astype(np.int64)
+    return cell, sites
+
+
+def fingerprint(lattice, numbers, frac_coords):
+    cell, sites = canonical_form(lattice, numbers, frac_coords)
+    sha = hashlib.sha256(cell.tobytes())
+    sha.update(sites.tobytes())
+    return sha.hexdigest()
+
+
+def structure_fingerprint(struct):
+    numbers = [site.specie.Z for site in struct]
+    return fingerprint(struct.lattice.matrix, numbers, struct.frac_coords)
+
+
+def cif_fingerprint(path=None, text=None, cache=None):
+    """
+    Canonical fingerprint of a cif file (or cif text), parsed through the
+    structure cache when one is given.
+
+        Parameters:
+            path (str): cif file
+            text (str): cif text, used instead of reading path
+            cache (str): structure cache directory ("" for the default)
+
+        Returns:
+            fingerprint (str): sha256 of the canonical form
+    """
+    from mosaec.cache import load_arrays, parse_cif
+
+    arrays = None
+    if cache is not None:
+        arrays = load_arrays(path, text, cache)
+    if arrays is None:
+        if text is None:
+            with open(path, "r") as rf:
+                text = rf.read()
+        return structure_fingerprint(parse_cif(text))
+    return fingerprint(arrays["lattice"], arrays["numbers"], arrays["frac_coords"])
+
+
+def read_item(item, archive=None):
+    if archive is not None:
+        return archive.read_bytes(item)
+    with open(item, "rb") as rf:
+        return rf.read()
+
+
+# (item, content hash, fingerprint, error); fingerprint skipped if hash_only
+def _fingerprint_job(job):
+    from mosaec.cache import content_hash
+
+    item, archive, cache, hash_only = job
+    try:
+        data = read_item(item, archive)
+        sha = content_hash(data)
+        if hash_only:
+            return item, sha, None, None
+        path = item if archive is None else None
+        return item, sha, cif_fingerprint(path, data.decode(), cache), None
+    except Exception as e:
+        return item, None, None, f"{item} | ERROR | {type(e).__name__}: {e}"
+
+
+def _map_jobs(items, archive, cache, num_cpus, hash_only=False):
+    jobs = [(item, archive, cache, hash_only) for item in items]
+    if int(num_cpus) > 1:
+        with Pool(int(num_cpus)) as pool:
+            results = list(pool.imap_unordered(_fingerprint_job, jobs, chunksize=16))
+    else:
+        results = [_fingerprint_job(job) for job in jobs]
+    records = {}
+    for item, sha, fp, error in results:
+        if error is not None:
+            print(error)
+        records[item] = (sha, fp)
+    return records
+
+
+def fingerprint_records(items, archive=None, cache=None, num_cpus=1):
+    """
+    Content hashes & fingerprints of many structures.
+
+        Parameters:
+            items (list of str): cif paths, or names in archive
+            archive (CifArchive): packed cif archive holding the structures
+            cache (str): structure cache directory ("" for the default)
+            num_cpus (int): no. processes
+
+        Returns:
+            records (dict): item > (sha256 of the cif, fingerprint), None
+                            where the cif could not be read or parsed
+    """
+    return _map_jobs(items, archive, cache, num_cpus)
+
+
+def fingerprint_files(items, archive=None, cache=None, num_cpus=1):
+    records = fingerprint_records(items, archive, cache, num_cpus)
+    return {item: fp for item, (_, fp) in records.items()}
+
+
+def group_aliases(fingerprints):
+    """
+    Representative of every structure: the first name (sorted, so _full
+    before _partial) among the structures sharing its fingerprint.
+
+        Parameters:
+            fingerprints (dict): name > fingerprint (None: its own group)
+
+        Returns:
+            representative (dict): name > representative name
+    """
+    first = {}
+    representative = {}
+    for name in sorted(fingerprints):
+        fp = fingerprints[name]
+        if fp is None:
+            representative[name] = name
+        else:
+            representative[name] = first.setdefault(fp, name)
+    return representative
+
+
+# records: name > (content hash, fingerprint)
+def write_aliases(csv_path, records):
+    representative = group_aliases({name: fp for name, (_, fp) in records.items()})
+    # written whole then renamed, readers never see a partial file
+    tmp_path = f"{csv_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as wf:
+        wf.write(",".join(ALIAS_COLUMNS) + "\n")
+        for name in sorted(records):
+            sha, fp = records[name]
+            wf.write(f"{name},{sha or ''},{fp or ''},{representative[name]}\n")
+    os.replace(tmp_path, csv_path)
+    return representative
+
+
+# name > (content hash, fingerprint) of an aliases.csv, {} for an older
+# file without content hashes (every row then recomputed)
+def read_alias_records(csv_path):
+    records = {}
+    with open(csv_path, "r") as rf:
+        if next(rf, "").strip().split(",") != ALIAS_COLUMNS:
+            return records
+        for line in rf:
+            if line.strip() != "":
+                name, sha, fp, _ = line.strip().split(",")
+                records[name] = (sha or None, fp or None)
+    return records
+
+
+def read_aliases(csv_path):
+    representative = {}
+    with open(csv_path, "r") as rf:
+        next(rf)
+        for line in rf:
+            if line.strip() != "":
+                row = line.strip().split(",")
+                representative[row[0]] = row[-1]
+    return representative
+
+
+def update_aliases(csv_path, items, archive=None, cache=None, num_cpus=1, write=True):
+    """
+    Aliases of the items from aliases.csv, fingerprinting again only the
+    structures that are new or whose cif changed (content hash) since it
+    was written.
+
+        Parameters:
+            csv_path (str): alias mapping, read if it exists
+            items (list of str): cif paths, or names in archive
+            archive (CifArchive): packed cif archive holding the structures
+            cache (str): structure cache directory ("" for the default)
+            num_cpus (int): no. processes
+            write (bool): rewrite csv_path when rows were added, updated or
+                          dropped (structures no longer in items)
+
+        Returns:
+            representative (dict): name > representative name
+    """
+    from mosaec.shard import item_name
+
+    stored = {}
+    if os.path.exists(csv_path):
+        stored = read_alias_records(csv_path)
+    hashes = _map_jobs(items, archive, cache, num_cpus, hash_only=True)
+    records, stale = {}, []
+    for item in items:
+        name, sha = item_name(item), hashes[item][0]
+        if sha is None:
+            # unreadable, its own group
+            records[name] = (None, None)
+        elif stored.get(name, (None,))[0] == sha:
+            records[name] = stored[name]
+        else:
+            stale.append(item)
+    if len(stale) > 0:
+        print(f"Fingerprinting ... {len(stale)} new or modified structures")
+        fresh = fingerprint_records(stale, archive, cache, num_cpus)
+        for item, record in fresh.items():
+            records[item_name(item)] = record
+    if write and (len(stale) > 0 or set(records) != set(stored)):
+        return write_aliases(csv_path, records)
+    return group_aliases({name: fp for name, (_, fp) in records.items()})
+
+
+# items to compute (the representative, or the first item of its group
+# present) & the items aliased to each one
+def split_aliases(items, representative):
+    from mosaec.shard import item_name
+
+    names = {item_name(x) for x in items}
+    chosen = {}
+    for item in items:
+        name = item_name(item)
+        rep = representative.get(name, name)
+        if rep not in chosen and (rep == name or rep not in names):
+            chosen[rep] = item
+    reps, aliases = [], {}
+    for item in items:
+        name = item_name(item)
+        rep = chosen[representative.get(name, name)]
+        if rep == item:
+            reps.append(item)
+        else:
+            aliases.setdefault(rep, []).append(item)
+    return reps, aliases
+
+
+if __name__ == "__main__":
+    code_desc = (
+        "Find structures identical to another (aliases) by canonical fingerprint."
+    )
+    parser = argparse.ArgumentParser(description=code_desc)
+    parser.add_argument("source", type=str, help="cif directory or packed archive.")
+    parser.add_argument(
+        "-o", "--output", type=str, default="aliases.csv", help="alias mapping csv."
+    )
+    parser.add_argument("--num_cpus", type=int, default=1, help="no. processes.")
+    parser.add_argument(
+        "--cache",
+        type=str,
+        nargs="?",
+        const="",
+        default=None,
+        help="read through the parsed-structure cache (optional cache directory).",
+    )
+    args = parser.parse_args()
+    #
+    from mosaec.archive import CifArchive, is_archive
+
+    archive = None
+    if is_archive(args.source):
+        archive = CifArchive(args.source)
+        items = archive.names()
+    else:
+        items = glob.glob(f"{args.source}/*.cif", recursive=False)
+    representative = update_aliases(
+        args.output, items, archive, args.cache, args.num_cpus
+    )
+    num_aliases = sum(name != rep for name, rep in representative.items())
+    print(f"Structures ... {len(representative)}")
+    print(f"Aliases ... {num_aliases} ({len(representative) - num_aliases} unique)")
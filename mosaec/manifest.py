@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+import os
+import re
+import sqlite3
+import hashlib
+import argparse
+
+from collections import Counter, defaultdict
+from multiprocessing import Pool
+
+from mosaec.archive import CifArchive, is_archive
+
+CELL_TAGS = [
+    "_cell_length_a",
+    "_cell_length_b",
+    "_cell_length_c",
+    "_cell_angle_alpha",
+    "_cell_angle_beta",
+    "_cell_angle_gamma",
+]
+COLUMNS = [
+    "path",
+    "name",
+    "removal",
+    "charge_state",
+    "formula",
+    "natoms",
+    "a",
+    "b",
+    "c",
+    "alpha",
+    "beta",
+    "gamma",
+    "sha256",
+    "offset",
+    "size",
+    "mtime",
+]
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS structures ("
+    "path TEXT PRIMARY KEY, name TEXT, removal TEXT, charge_state TEXT, "
+    "formula TEXT, natoms INTEGER, a REAL, b REAL, c REAL, alpha REAL, "
+    "beta REAL, gamma REAL, sha256 TEXT, offset INTEGER, size INTEGER, "
+    "mtime REAL)",
+    "CREATE INDEX IF NOT EXISTS structures_name ON structures (name)",
+    "CREATE INDEX IF NOT EXISTS structures_formula ON structures (formula)",
+    "CREATE TABLE IF NOT EXISTS subsets ("
+    "subset TEXT, name TEXT, PRIMARY KEY (subset, name))",
+]
+
+
+def _to_float(value):
+    try:
+        return float(re.sub(r"\(\d+\)$", "", value))
+    except (TypeError, ValueError):
+        return None
+
+
+def cif_summary(text):
+    """
+    Read the formula, atom count and cell parameters of a (P1) cif without a
+    full parse.
+
+        Parameters:
+            text (str): cif text
+
+        Returns:
+            summary (dict): formula (compact e.g., C8H4O5Zn2), natoms and the
+                            six cell parameters
+    """
+    tags = {}
+    symbols = []
+    natoms = 0
+    loop_tags = None
+    in_data = False
+    for line in text.split("\n"):
+        line = line.strip()
+        if line == "" or line[0] == "#":
+            continue
+        if line.startswith("loop_"):
+            loop_tags, in_data = [], False
+        elif line[0] == "_" and loop_tags is not None and not in_data:
+            loop_tags.append(line.split()[0])
+        elif line[0] == "_" or line.startswith("data_"):
+            loop_tags, in_data = None, False
+            tag, _, value = line.partition(" ")
+            tags[tag] = value.strip().strip("'\"")
+        elif loop_tags is not None:
+            in_data = True
+            if "_atom_site_fract_x" in loop_tags:
+                natoms += 1
+                col = "_atom_site_type_symbol"
+                if col not in loop_tags:
+                    col = "_atom_site_label"
+                values = line.split()
+                if len(values) == len(loop_tags):
+                    symbol = values[loop_tags.index(col)]
+                    symbols.append(re.match(r"[A-Za-z]*", symbol).group(0))
+
+    formula = tags.get("_chemical_formula_sum")
+    if formula is None:
+        counts = Counter(symbols)
+        formula = "".join(
+            f"{el}{n if n > 1 else ''}" for el, n in sorted(counts.items())
+        )
+    summary = {"formula": formula.replace(" ", ""), "natoms": natoms}
+    for tag in CELL_TAGS:
+        summary[tag.split("_")[-1]] = _to_float(tags.get(tag))
+    return summary
+
+
+# full/partial & neutral/charged from the file name and database directories
+def classify(path):
+    name = os.path.basename(path)
+    parts = path.replace("\\", "/").split("/")
+    if "_partial" in name or "partial" in parts:
+        removal = "partial"
+    elif "_full" in name or "full" in parts:
+        removal = "full"
+    else:
+        removal = None
+    if "neutral" in parts:
+        charge_state = "neutral"
+    elif "charged" in parts:
+        charge_state = "charged"
+    else:
+        charge_state = None
+    return removal, charge_state
+
+
+# index one cif, job is (database directory or CifArchive, relative path)
+def index_file(job):
+    root, path = job
+    name = os.path.basename(path)
+    try:
+        if isinstance(root, CifArchive):
+            full_path = f"{root.archive}:{name}"
+            data = root.read_bytes(name)
+            _, offset, size, _ = root.records[name]
+            mtime = os.stat(root.archive).st_mtime
+        else:
+            full_path = os.path.join(root, path)
+            with open(full_path, "rb") as rf:
+                data = rf.read()
+            offset, size = 0, len(data)
+            mtime = os.stat(full_path).st_mtime
+        summary = cif_summary(data.decode(errors="replace"))
+    except Exception as e:
+        print(f"{full_path} | ERROR | {type(e).__name__}: {e}")
+        return None
+    removal, charge_state = classify(path)
+    return {
+        "path": path,
+        "name": name,
+        "removal": removal,
+        "charge_state": charge_state,
+        **summary,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "offset": offset,
+        "size": size,
+        "mtime": mtime,
+    }
+
+
+def open_manifest(manifest):
+    conn = sqlite3.connect(manifest)
+    conn.row_factory = sqlite3.Row
+    for statement in SCHEMA:
+        conn.execute(statement)
+    return conn
+
+
+def manifest_root(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'root'").fetchone()
+    return None if row is None else row[0]
+
+
+# absolute path of a manifest entry (archive entries stay relative)
+def _full_path(root, path):
+    if root is None or not os.path.isdir(root):
+        return path
+    return os.path.join(root, path)
+
+
+# scan a database directory (or archive) for cifs, paths relative to it
+def scan_database(db_path):
+    found = {}
+    if is_archive(db_path):
+        mtime = os.stat(db_path).st_mtime
+        for path, _, size, _ in CifArchive(db_path).records.values():
+            found[path] = (size, mtime)
+        return found
+    for dir_path, _, files in os.walk(db_path):
+        for f in files:
+            if f.endswith(".cif"):
+                full_path = os.path.join(dir_path, f)
+                stat = os.stat(full_path)
+                found[os.path.relpath(full_path, db_path)] = (
+                    stat.st_size,
+                    stat.st_mtime,
+                )
+    return found
+
+
+def build_manifest(db_path, manifest, subsets=None, num_cpus=1):
+    """
+    Index every cif of a database directory in one pass. Files already in the
+    manifest are only re-read if their size or modification time changed, and
+    entries of deleted files are dropped.
+
+        Parameters:
+            db_path (str): database directory e.g., database/, or a packed
+                           cif archive (offset/size then locate each record)
+            manifest (str): path of the SQLite manifest to create/refresh
+            subsets (list of str): subset files (.txt) to record membership of
+            num_cpus (int): no. processes reading cifs
+
+        Returns:
+            counts (dict): no. structures added, updated, removed & unchanged
+    """
+    db_path = os.path.abspath(db_path)
+    conn = open_manifest(manifest)
+    known = {
+        row["path"]: (row["size"], row["mtime"])
+        for row in conn.execute("SELECT path, size, mtime FROM structures")
+    }
+    if manifest_root(conn) != db_path:
+        # paths are relative, but re-check everything under a new root
+        known = {path: None for path in known}
+    found = scan_database(db_path)
+
+    removed = [path for path in known if path not in found]
+    todo = [path for path, stat in found.items() if known.get(path) != stat]
+    conn.executemany("DELETE FROM structures WHERE path = ?", [(p,) for p in removed])
+
+    root = CifArchive(db_path) if is_archive(db_path) else db_path
+    jobs = [(root, path) for path in todo]
+    if int(num_cpus) > 1:
+        with Pool(int(num_cpus)) as pool:
+            rows = list(pool.imap_unordered(index_file, jobs, chunksize=64))
+    else:
+        rows = [index_file(job) for job in jobs]
+    rows = [row for row in rows if row is not None]
+    conn.executemany(
+        f"INSERT OR REPLACE INTO structures VALUES ({', '.join('?' * len(COLUMNS))})",
+        [tuple(row[col] for col in COLUMNS) for row in rows],
+    )
+    conn.execute("INSERT OR REPLACE INTO meta VALUES ('root', ?)", (db_path,))
+    conn.commit()
+    for txt_file in subsets or []:
+        add_subset(conn, txt_file)
+    conn.close()
+
+    num_updated = sum(path in known for path in todo)
+    return {
+        "added": len(todo) - num_updated,
+        "updated": num_updated,
+        "removed": len(removed),
+        "unchanged": len(found) - len(todo),
+    }
+
+
+# record subset membership from a subset file (one cif name per line)
+def add_subset(conn, txt_file, subset=None):
+    if subset is None:
+        subset = os.path.basename(txt_file).rsplit(".txt", 1)[0]
+    with open(txt_file, "r") as rf:
+        names = [x.strip() for x in rf.read().split("\n") if x.strip() != ""]
+    conn.execute("DELETE FROM subsets WHERE subset = ?", (subset,))
+    conn.executemany(
+        "INSERT OR IGNORE INTO subsets VALUES (?, ?)", [(subset, n) for n in names]
+    )
+    conn.commit()
+    return len(names)
+
+
+def query(
+    manifest,
+    removal=None,
+    charge_state=None,
+    formula=None,
+    subset=None,
+    min_atoms=None,
+    max_atoms=None,
+):
+    """
+    Select structures from a manifest.
+
+        Parameters:
+            manifest (str): path of the SQLite manifest
+            removal (str): "full" or "partial"
+            charge_state (str): "neutral" or "charged"
+            formula (str): compact formula e.g., C8H4O5Zn2
+            subset (str): subset name e.g., diverse-neutral-phom-20k
+            min_atoms, max_atoms (int): bounds on the no. atoms
+
+        Returns:
+            rows (list of dict): manifest rows, "path" made absolute (left
+                                 relative for an archive, see offset/size)
+    """
+    where = []
+    params = []
+    for col, value in [
+        ("removal", removal),
+        ("charge_state", charge_state),
+        ("formula", formula),
+    ]:
+        if value is not None:
+            where.append(f"{col} = ?")
+            params.append(value)
+    if min_atoms is not None:
+        where.append("natoms >= ?")
+        params.append(min_atoms)
+    if max_atoms is not None:
+        where.append("natoms <= ?")
+        params.append(max_atoms)
+    if subset is not None:
+        where.append("name IN (SELECT name FROM subsets WHERE subset = ?)")
+        params.append(subset)
+    sql = "SELECT * FROM structures"
+    if len(where) > 0:
+        sql += " WHERE " + " AND ".join(where)
+    conn = open_manifest(manifest)
+    root = manifest_root(conn)
+    rows = [dict(row) for row in conn.execute(sql + " ORDER BY name", params)]
+    conn.close()
+    for row in rows:
+        row["path"] = _full_path(root, row["path"])
+    return rows
+
+
+# cif names -> absolute paths, plus the names not in the manifest
+def resolve_names(manifest, names):
+    conn = open_manifest(manifest)
+    root = manifest_root(conn)
+    paths = {}
+    for row in conn.execute("SELECT name, path FROM structures"):
+        paths.setdefault(row["name"], _full_path(root, row["path"]))
+    conn.close()
+    found = [paths[n] for n in names if n in paths]
+    missing = [n for n in names if n not in paths]
+    return found, missing
+
+
+# absolute path of a single cif name
+def resolve_path(manifest, name):
+    found, _ = resolve_names(manifest, [name])
+    if len(found) == 0:
+        raise FileNotFoundError(f"{name} not in {manifest}")
+    return found[0]
+
+
+# structure names grouped by formula, largest groups first
+def formula_groups(manifest, **filters):
+    groups = defaultdict(list)
+    for row in query(manifest, **filters):
+        groups[row["formula"]].append(row["name"])
+    return dict(sorted(groups.items(), key=lambda kv: (-len(kv[1]), kv[0])))
+
+
+# write the formula lists made by duplicates/group_by_chemel.sh
+def write_formula_lists(manifest, out_dir=".", **filters):
+    groups = formula_groups(manifest, **filters)
+    with open(os.path.join(out_dir, "all_formulae.txt"), "w") as wf:
+        for formula, names in groups.items():
+            wf.writelines(f"{name} {formula}\n" for name in names)
+    with open(os.path.join(out_dir, "numX_chemform.txt"), "w") as wf:
+        wf.writelines(f"{len(names)} {formula}\n" for formula, names in groups.items())
+    with open(os.path.join(out_dir, "unique_empform.txt"), "w") as wf:
+        wf.writelines(f"{formula}\n" for formula in groups)
+    for formula, names in groups.items():
+        with open(os.path.join(out_dir, f"{formula}.lst"), "w") as wf:
+            wf.writelines(f"{name}\n" for name in names)
+    return groups
+
+
+def add_filter_args(parser):
+    parser.add_argument("--removal", choices=["full", "partial"], default=None)
+    parser.add_argument("--charge_state", choices=["neutral", "charged"], default=None)
+    parser.add_argument("--formula", type=str, default=None)
+    parser.add_argument("--subset", type=str, default=None)
+    parser.add_argument("--min_atoms", type=int, default=None)
+    parser.add_argument("--max_atoms", type=int, default=None)
+
+
+def get_filters(args):
+    return {
+        k: getattr(args, k)
+        for k in [
+            "removal",
+            "charge_state",
+            "formula",
+            "subset",
+            "min_atoms",
+            "max_atoms",
+        ]
+    }
+
+
+if __name__ == "__main__":
+    code_desc = "Build, refresh or query the MOSAEC-DB structure manifest."
+    parser = argparse.ArgumentParser(description=code_desc)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="index (or refresh) a database.")
+    build.add_argument("db_path", type=str, help="database directory.")
+    build.add_argument("manifest", type=str, help="SQLite manifest to write.")
+    build.add_argument(
+        "--subsets",
+        nargs="+",
+        default=[],
+        help="subset files (.txt) to record membership of.",
+    )
+    build.add_argument(
+        "--num_cpus", type=int, default=1, help="no. processes reading cifs."
+    )
+    find = commands.add_parser("query", help="print the paths of structures.")
+    find.add_argument("manifest", type=str, help="SQLite manifest.")
+    add_filter_args(find)
+    lists = commands.add_parser(
+        "formula_lists", help="write the *.lst formula groups for the PDD workflow."
+    )
+    lists.add_argument("manifest", type=str, help="SQLite manifest.")
+    lists.add_argument("--out_dir", type=str, default=".")
+    add_filter_args(lists)
+    args = parser.parse_args()
+    #
+    if args.command == "build":
+        counts = build_manifest(
+            args.db_path, args.manifest, args.subsets, args.num_cpus
+        )
+        print(", ".join(f"{k} {v}" for k, v in counts.items()))
+    elif args.command == "query":
+        for row in query(args.manifest, **get_filters(args)):
+            print(row["path"])
+    else:
+        groups = write_formula_lists(args.manifest, args.out_dir, **get_filters(args))
+        print(f"Formula groups written ... {len(groups)}")
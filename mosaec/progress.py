@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import heapq
+import argparse
+import contextlib
+
+from collections import Counter
+
+# JSONL event file used when a tool is not given one explicitly
+EVENTS_ENV = "MOSAEC_EVENTS"
+
+
+def events_path_or_env(events=None):
+    return events or os.environ.get(EVENTS_ENV) or None
+
+
+# exception class of an error, from the exception itself or from an error
+# string such as "ValueError: ..." or "convert | ValueError: ..."
+def error_class(error):
+    if error is None:
+        return None
+    if isinstance(error, BaseException):
+        return type(error).__name__
+    head = str(error).split(":", 1)[0].split("|")[-1].strip()
+    return head if head != "" else "Error"
+
+
+def make_event(item, status="ok", duration=None, error=None, stage=None, **info):
+    event = {
+        "time": round(time.time(), 3),
+        "item": str(item),
+        "stage": stage,
+        "duration": None if duration is None else round(duration, 4),
+        "status": status,
+        "error": error_class(error),
+    }
+    if error is not None:
+        event["message"] = str(error)
+    event.update(info)
+    return event
+
+
+# single event of a tool run once per structure (e.g., from a shell loop),
+# appended only if an event file is given or $MOSAEC_EVENTS is set
+def write_event(
+    item, status="ok", duration=None, error=None, stage=None, events=None, **info
+):
+    events = events_path_or_env(events)
+    if events is None:
+        return None
+    event = make_event(item, status, duration, error, stage, **info)
+    with open(events, "a") as af:
+        af.write(json.dumps(event) + "\n")
+    return event
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}"
+
+
+class Progress:
+    """Per-item events, live throughput/ETA & a final summary of a batch run."""
+
+    def __init__(self, total=None, stage=None, events=None, stream=None, top=10):
+        """
+        Track a batch run. Events are appended as JSON lines to events (or
+        $MOSAEC_EVENTS), and the progress line is written to stream (stderr
+        by default, updated in place on a terminal & once a minute in logs).
+
+            Parameters:
+                total (int): no. items expected (None if unknown, no ETA)
+                stage (str): default stage name of the events e.g., "pac"
+                events (str): JSONL event file (default: $MOSAEC_EVENTS),
+                              False for no events
+                stream (file): progress & summary output
+                top (int): no. slowest items kept for the summary
+        """
+        self.total = total
+        self.stage = stage
+        self.events = None if events is False else events_path_or_env(events)
+        self._events = open(self.events, "a") if self.events else None
+        self.stream = stream if stream is not None else sys.stderr
+        self.live = self.stream.isatty()
+        self.interval = 0.5 if self.live else 60.0
+        self.top = top
+        self.start = time.time()
+        self._last = 0.0
+        self.done = 0
+        self.status = Counter()
+        self.errors = Counter()
+        self._slowest = []
+
+    def record(self, item, status="ok", duration=None, error=None, stage=None, **info):
+        """
+        Record one finished item.
+
+            Parameters:
+                item (str): structure (e.g., cif path or refcode)
+                status (str): "ok" or the kind of failure e.g., "failed",
+                              "skipped", "timeout"
+                duration (float): seconds spent on the item
+                error (Exception or str): error raised, if any
+                stage (str): stage of the event (default: the run's stage)
+                info: extra fields written with the event e.g., result="bad"
+        """
+        event = make_event(item, status, duration, error, stage or self.stage, **info)
+        if self._events is not None:
+            self._events.write(json.dumps(event) + "\n")
+            self._events.flush()
+        self.done += 1
+        self.status[status] += 1
+        if status != "ok":
+            self.errors[event["error"] or status] += 1
+        if duration is not None:
+            entry = (duration, str(item))
+            if len(self._slowest) < self.top:
+                heapq.heappush(self._slowest, entry)
+            else:
+                heapq.heappushpop(self._slowest, entry)
+        self.update()
+
+    @contextlib.contextmanager
+    def track(self, item, stage=None, **info):
+        # time the block, recording a failure (& re-raising) on an exception
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record(item, "failed", time.perf_counter() - start, e, stage, **info)
+            raise
+        self.record(item, "ok", time.perf_counter() - start, None, stage, **info)
+
+    def rate(self):
+        elapsed = time.time() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        rate = self.rate()
+        if self.total is None or rate == 0:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+    def line(self):
+        total = f"/{self.total}" if self.total is not None else ""
+        failed = self.done - self.status["ok"]
+        return (
+            f"{self.stage or 'items'} {self.done}{total} | {self.rate():.2f} items/s"
+            f" | ETA {format_seconds(self.eta())} | failed {failed}"
+        )
+
+    def update(self, force=False):
+        now = time.time()
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        if self.live:
+            self.stream.write(f"\r{self.line()}\033[K")
+        else:
+            self.stream.write(f"{self.line()}\n")
+        self.stream.flush()
+
+    def summary(self):
+        elapsed = time.time() - self.start
+        return {
+            "items": self.done,
+            "seconds": elapsed,
+            "items_per_s": self.done / elapsed if elapsed > 0 else None,
+            "status": dict(self.status),
+            "errors": dict(self.errors.most_common()),
+            "slowest": [
+                [item, duration]
+                for duration, item in sorted(self._slowest, reverse=True)
+            ],
+        }
+
+    def close(self):
+        self.update(force=True)
+        if self.live:
+            self.stream.write("\n")
+        summary = self.summary()
+        self.stream.write(format_summary(summary))
+        self.stream.flush()
+        if self._events is not None:
+            self._events.close()
+            self._events = None
+        return summary
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def format_summary(summary):
+    lines = [
+        f"Completed ... {summary['items']} items in "
+        f"{format_seconds(summary['seconds'])} "
+        f"({summary['items_per_s'] or 0:.2f} items/s)",
+        "Status ... "
+        + " | ".join(f"{k} {v}" for k, v in sorted(summary["status"].items())),
+    ]
+    if summary["errors"]:
+        lines.append(
+            "Failures ... "
+            + " | ".join(f"{k} {v}" for k, v in summary["errors"].items())
+        )
+    if summary["slowest"]:
+        lines.append("Slowest ...")
+        lines += [
+            f"  {duration:10.2f} s  {item}" for item, duration in summary["slowest"]
+        ]
+    return "\n".join(lines) + "\n"
+
+
+# last event of a file (e.g., the one just written by a tool), None if empty
+def last_event(path):
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path, "rb") as rf:
+        rf.seek(0, os.SEEK_END)
+        rf.seek(max(0, rf.tell() - (1 << 16)))
+        lines = rf.read().rstrip(b"\n").split(b"\n")
+    return json.loads(lines[-1]) if lines[-1].strip() != b"" else None
+
+
+def read_events(paths):
+    for path in paths:
+        with open(path, "r") as rf:
+            for line in rf:
+                if line.strip() != "":
+                    yield json.loads(line)
+
+
+def summarize(paths, top=10, stage=None):
+    """
+    Summary of one or more event files e.g., from runs driven by a shell
+    loop or from every shard of a sharded run.
+
+        Parameters:
+            paths (list of str): JSONL event files
+            top (int): no. slowest items listed
+            stage (str): only events of this stage
+
+        Returns:
+            summary (dict): items, seconds (first to last event),
+                            items_per_s, status & error counts, slowest items
+    """
+    progress = Progress(events=False, stream=open(os.devnull, "w"), top=top)
+    first, last = None, None
+    for event in read_events(paths):
+        if stage is not None and event.get("stage") != stage:
+            continue
+        progress.record(
+            event["item"], event["status"], event.get("duration"), event.get("error")
+        )
+        first = event["time"] - (event.get("duration") or 0) if first is None else first
+        last = event["time"]
+    summary = progress.summary()
+    progress.stream.close()
+    summary["seconds"] = (last - first) if first is not None else 0.0
+    if summary["seconds"] > 0:
+        summary["items_per_s"] = summary["items"] / summary["seconds"]
+    return summary
+
+
+# follow an event file written by another process, showing the progress line
+def watch(path, total=None, poll=1.0):
+    progress = Progress(total=total, events=False, stream=sys.stderr)
+    progress.live, progress.interval = True, 0.0
+    while not os.path.exists(path):
+        time.sleep(poll)
+    partial = ""
+    with open(path, "r") as rf:
+        while total is None or progress.done < total:
+            line = rf.readline()
+            if not line.endswith("\n"):
+                # end of file, or a line still being written
+                partial += line
+                progress.update(force=True)
+                time.sleep(poll)
+                continue
+            event = json.loads(partial + line)
+            partial = ""
+            if progress.done == 0:
+                progress.start = event["time"] - (event.get("duration") or 0)
+                progress.stage = event.get("stage")
+            progress.record(
+                event["item"],
+                event["status"],
+                event.get("duration"),
+                event.get("error"),
+            )
+    progress.close()
+
+
+if __name__ == "__main__":
+    code_desc = "Summarize or follow the JSONL events written by the MOSAEC-DB tools."
+    parser = argparse.ArgumentParser(description=code_desc)
+    commands = parser.add_subparsers(dest="command", required=True)
+    summary_ = commands.add_parser(
+        "summary", help="throughput, failure breakdown & slowest items."
+    )
+    summary_.add_argument("events", nargs="+", help="JSONL event files.")
+    summary_.add_argument("--top", type=int, default=10, help="no. slowest items.")
+    summary_.add_argument("--stage", type=str, default=None, help="only this stage.")
+    summary_.add_argument(
+        "--json", action="store_true", help="print the summary as json."
+    )
+    watch_ = commands.add_parser("watch", help="live progress of a running tool.")
+    watch_.add_argument("events", type=str, help="JSONL event file.")
+    watch_.add_argument(
+        "--total", type=int, default=None, help="no. items expected (for the ETA)."
+    )
+    args = parser.parse_args()
+    #
+    if args.command == "summary":
+        summary = summarize(args.events, args.top, args.stage)
+        if args.json:
+            print(json.dumps(summary, indent=2))
+        else:
+            sys.stdout.write(format_summary(summary))
+    else:
+        try:
+            watch(args.events, args.total)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+import os
+import sys
+import glob
+import heapq
+import hashlib
+import argparse
+
+import pandas as pd
+
+
+def parse_shard(shard):
+    """
+    Parse a shard specification "i/N" (i from 0 to N - 1).
+
+        Parameters:
+            shard (str or tuple): "i/N" or (i, N)
+
+        Returns:
+            index, num_shards (int, int): this shard & the total no. shards
+    """
+    if isinstance(shard, str):
+        index, _, num_shards = shard.partition("/")
+        index, num_shards = int(index), int(num_shards)
+    else:
+        index, num_shards = shard
+    if num_shards < 1 or not 0 <= index < num_shards:
+        raise ValueError(f"invalid shard {shard}, expected i/N with 0 <= i < N")
+    return index, num_shards
+
+
+def shard_name(shard):
+    index, num_shards = parse_shard(shard)
+    return f"shard_{index}_of_{num_shards}"
+
+
+# structure name without directory or .cif extension
+def item_name(item):
+    return os.path.basename(str(item)).rsplit(".cif", 1)[0]
+
+
+# hash of a name, identical on every node & python process (unlike hash())
+def stable_hash(name):
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "big")
+
+
+# greedy longest-first assignment, each item to the least loaded shard
+def assign_by_cost(names, costs, num_shards):
+    order = sorted(range(len(names)), key=lambda k: (-costs[k], names[k]))
+    loads = [(0, s) for s in range(num_shards)]
+    assignment = {}
+    for k in order:
+        load, s = heapq.heappop(loads)
+        assignment[names[k]] = s
+        heapq.heappush(loads, (load + costs[k], s))
+    return assignment
+
+
+def select_shard(items, shard, key=item_name, cost=None):
+    """
+    Select the items belonging to one shard. Every node computes the same
+    split independently, so no coordinator is needed.
+
+        Parameters:
+            items (list): structures (paths, names or refcodes)
+            shard (str or tuple): "i/N"
+            key (function): stable name of an item
+            cost (function): estimated cost of an item (e.g., no. atoms) to
+                             balance shards; None splits by name hash
+
+        Returns:
+            selected (list): the items of shard i, in their input order
+    """
+    index, num_shards = parse_shard(shard)
+    names = [key(x) for x in items]
+    if cost is None:
+        return [x for x, n in zip(items, names) if stable_hash(n) % num_shards == index]
+    costs = [cost(x) for x in items]
+    assignment = assign_by_cost(names, costs, num_shards)
+    return [x for x, n in zip(items, names) if assignment[n] == index]
+
+
+# names of every structure expected in a merged output
+def read_expected(source):
+    if source.endswith((".sqlite", ".db")):
+        from mosaec.manifest import query
+
+        names = [row["name"] for row in query(source)]
+    elif os.path.isdir(source):
+        names = glob.glob(f"{source}/*.cif", recursive=False)
+    elif source.endswith(".txt") or source.endswith(".gcd"):
+        with open(source, "r") as rf:
+            names = [x.strip() for x in rf.read().split("\n") if x.strip() != ""]
+    else:
+        from mosaec.archive import CifArchive
+
+        names = CifArchive(source).names()
+    return {item_name(n) for n in names}
+
+
+def merge_csv(inputs, output, key="cif", expected=None):
+    """
+    Combine the csv outputs of every shard, keeping the last row of any
+    structure written twice.
+
+        Parameters:
+            inputs (list of str): shard csv files
+            output (str): merged csv
+            key (str): structure name column
+            expected (set): structure names that must be present
+
+        Returns:
+            num_rows (int): no. rows written
+            missing (list): expected structures absent from every shard
+    """
+    frames = [pd.read_csv(f, dtype={key: str}) for f in inputs]
+    df = pd.concat(frames, ignore_index=True)
+    df = df.drop_duplicates(subset=key, keep="last")
+    df.to_csv(output, index=False)
+    missing = []
+    if expected is not None:
+        present = {item_name(x) for x in df[key]}
+        missing = sorted(expected - present)
+    return len(df), missing
+
+
+# combine PDD *_pdd.pyout files into the s1,s2,pdd_score file read by
+# analyze_pdd_csv.py, checking every formula group (.lst) has all its pairs
+def merge_scores(inputs, output, groups=None):
+    by_group = {os.path.basename(f).rsplit("_pdd.pyout", 1)[0]: f for f in inputs}
+    missing = []
+    num_scores = 0
+    with open(output, "w") as wf:
+        wf.write("s1,s2,pdd_score\n")
+        for group in sorted(by_group):
+            with open(by_group[group], "r") as rf:
+                lines = [x.split() for x in rf.read().split("\n") if x.strip() != ""]
+            for s1, s2, score in (x[:3] for x in lines if len(x) >= 3):
+                wf.write(f"{s1}.cif,{s2}.cif,{score}\n")
+                num_scores += 1
+            by_group[group] = len(lines)
+    for lst in groups or []:
+        with open(lst, "r") as rf:
+            n = len([x for x in rf.read().split("\n") if x.strip() != ""])
+        group = os.path.basename(lst).rsplit(".lst", 1)[0]
+        if n > 1 and by_group.get(group, 0) < n * (n - 1) // 2:
+            missing.append(group)
+    return num_scores, missing
+
+
+# structures without an output file (e.g., NAME_REPEAT.cif) in a directory
+def verify_files(out_dir, expected, suffix=".cif"):
+    present = {
+        os.path.basename(f)[: -len(suffix)]
+        for f in glob.glob(f"{out_dir}/*{suffix}", recursive=False)
+    }
+    return sorted(n for n in expected if n not in present)
+
+
+if __name__ == "__main__":
+    code_desc = "Select shard items or merge & verify the outputs of sharded runs."
+    parser = argparse.ArgumentParser(description=code_desc)
+    commands = parser.add_subparsers(dest="command", required=True)
+    select = commands.add_parser(
+        "select", help="print the items (e.g., *.lst groups) of one shard."
+    )
+    select.add_argument("shard", type=str, help="i/N")
+    select.add_argument("items", nargs="+")
+    select.add_argument(
+        "--cost",
+        type=str,
+        default=None,
+        choices=["size", "lst_pairs"],
+        help="balance by file size or no. pairs of a .lst group (default: hash).",
+    )
+    merge = commands.add_parser("merge", help="combine shard outputs.")
+    merge.add_argument("kind", choices=["csv", "scores", "files"])
+    merge.add_argument("output", type=str, help="merged file (or output directory).")
+    merge.add_argument("inputs", nargs="*", help="shard outputs to combine.")
+    merge.add_argument(
+        "--expected",
+        type=str,
+        default=None,
+        help="structures that must be present: cif directory, .txt/.gcd list, "
+        "packed archive or manifest.",
+    )
+    merge.add_argument("--key", type=str, default="cif", help="csv name column.")
+    merge.add_argument(
+        "--groups", nargs="*", default=None, help="formula groups (*.lst) of scores."
+    )
+    merge.add_argument(
+        "--suffix", type=str, default=".cif", help="output file suffix for files."
+    )
+    args = parser.parse_args()
+    #
+    if args.command == "select":
+        cost = None
+        if args.cost == "size":
+            cost = os.path.getsize
+        elif args.cost == "lst_pairs":
+
+            def cost(lst):
+                with open(lst, "r") as rf:
+                    n = len([x for x in rf.read().split("\n") if x.strip() != ""])
+                return n * (n - 1) // 2
+
+        for item in select_shard(args.items, args.shard, key=str, cost=cost):
+            print(item)
+        sys.exit(0)
+
+    expected = read_expected(args.expected) if args.expected else None
+    if args.kind == "csv":
+        num, missing = merge_csv(args.inputs, args.output, args.key, expected)
+        print(f"Merged rows ... {num}")
+    elif args.kind == "scores":
+        num, missing = merge_scores(args.inputs, args.output, args.groups)
+        print(f"Merged scores ... {num}")
+    else:
+        missing = verify_files(args.output, expected or set(), args.suffix)
+    if len(missing) > 0:
+        print(f"Incomplete ... {len(missing)} missing")
+        for name in missing:
+            print(f"{name} | ERROR | missing")
+        sys.exit(1)
+    print("Complete")
@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
+import os
 import re
+import sys
+import time
 import argparse
 import warnings
 
@@ -11,12 +14,16 @@ from pymatgen.analysis.graphs import StructureGraph
 # from pymatgen.analysis.graphs import MoleculeGraph
 import pymatgen.analysis.local_env as env
 
-from pymatgen.io.babel import BabelMolAdaptor
-
 # from pymatgen.io.cif import CifWriter
 
-import openbabel
-from openbabel import pybel as pb
+# shared mosaec package (manifest, archive & structure cache)
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from mosaec.archive import read_archive_cif
+from mosaec.manifest import resolve_path
+from mosaec.progress import write_event
+
+# stage name of the JSONL events (see mosaec/progress.py)
+STAGE = "hypervalent"
 
 
 def read_cif(file_path):
@@ -40,6 +47,10 @@ def get_graph(struct_):
 
 def get_smiles(mol):
     """This function returns a SMILES string from a pymatgen molecular graph"""
+    # openbabel is only needed here, not imported by checks without molecules
+    from openbabel import pybel as pb
+    from pymatgen.io.babel import BabelMolAdaptor
+
     babel_mol = BabelMolAdaptor(mol)
     pybel_mol = pb.Molecule(babel_mol.openbabel_mol)
     return pybel_mol.write("can").split()[0]
@@ -115,9 +126,16 @@ def check_atoms(graph_, struct_):
     return bad_atom_list
 
 
-def main(filename):
+def main(filename, cif_text=None, cache=None):
+
+    if cache is not None:
+        from mosaec.cache import load_structure
 
-    struct = read_cif(filename)
+        struct = load_structure(filename, cif_text, cache)
+    elif cif_text is not None:
+        struct = Structure.from_str(cif_text, fmt="cif", sort=False)
+    else:
+        struct = read_cif(filename)
     # atom_dict = struct.as_dict()
     metals = get_metal_indices(struct)
     graph = get_graph(struct)
@@ -129,6 +147,7 @@ def main(filename):
         print(f" {filename} | BAD STRUCTURE")
     elif len(bad_atoms) == 0:
         print(f" {filename} | GOOD STRUCTURE")
+    return bad_atoms
 
 
 if __name__ == "__main__":
@@ -137,11 +156,55 @@ if __name__ == "__main__":
     parser.add_argument(
         "filename",
         type=str,
-        required=True,
-        help="path to structure file (cif)",
+        help="path to structure file (cif), or its name when using --manifest",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="database manifest (.sqlite) used to locate the structure by name.",
+    )
+    parser.add_argument(
+        "--archive",
+        type=str,
+        default=None,
+        help="packed cif archive (.cifpack) holding the structure (by name).",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        nargs="?",
+        const="",
+        default=None,
+        help="read through the parsed-structure cache (optional cache directory).",
+    )
+    parser.add_argument(
+        "--events",
+        type=str,
+        default=None,
+        help="append a JSONL event for the structure to this file (default: $MOSAEC_EVENTS).",
     )
     args = parser.parse_args()
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
         input_cif = args.filename
-        main(input_cif)
+        cif_text = None
+        if args.archive is not None:
+            cif_text = read_archive_cif(args.archive, input_cif)
+        elif args.manifest is not None:
+            input_cif = resolve_path(args.manifest, input_cif)
+        stime = time.time()
+        try:
+            bad_atoms = main(input_cif, cif_text, args.cache)
+        except Exception as e:
+            write_event(input_cif, "failed", time.time() - stime, e, STAGE, args.events)
+            raise
+        write_event(
+            input_cif,
+            "ok",
+            time.time() - stime,
+            stage=STAGE,
+            events=args.events,
+            result="bad" if len(bad_atoms) > 0 else "good",
+            bad_atoms=len(bad_atoms),
+        )
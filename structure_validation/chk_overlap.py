@@ -1,8 +1,20 @@
 #!/usr/bin/env python3
+import os
+import sys
+import time
 import argparse
 
 from pymatgen.io.cif import CifParser
 
+# shared mosaec package (manifest, archive & structure cache)
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from mosaec.archive import read_archive_cif
+from mosaec.manifest import resolve_path
+from mosaec.progress import write_event
+
+# stage name of the JSONL events (see mosaec/progress.py)
+STAGE = "overlap"
+
 # Covalent radii revisited -- DOI:10.1039/B801115J
 COVALENT_RADII = {
     "H": 0.31,
@@ -116,15 +128,55 @@ if __name__ == "__main__":
     parser.add_argument(
         "filename",
         type=str,
-        required=True,
-        help="path to structure file (cif)",
+        help="path to structure file (cif), or its name when using --manifest",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="database manifest (.sqlite) used to locate the structure by name.",
+    )
+    parser.add_argument(
+        "--archive",
+        type=str,
+        default=None,
+        help="packed cif archive (.cifpack) holding the structure (by name).",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        nargs="?",
+        const="",
+        default=None,
+        help="read through the parsed-structure cache (optional cache directory).",
+    )
+    parser.add_argument(
+        "--events",
+        type=str,
+        default=None,
+        help="append a JSONL event for the structure to this file (default: $MOSAEC_EVENTS).",
     )
     args = parser.parse_args()
 
+    stime = time.time()
+    filename = args.filename
+    num_atoms = 0
     try:
-        filename = args.filename
-        parser = CifParser(filename)
-        structure = parser.get_structures(primitive=False)[0]
+        cif_text = None
+        if args.archive is not None:
+            cif_text = read_archive_cif(args.archive, filename)
+        elif args.manifest is not None:
+            filename = resolve_path(args.manifest, filename)
+        if args.cache is not None:
+            from mosaec.cache import load_structure
+
+            structure = load_structure(filename, cif_text, args.cache)
+        else:
+            if cif_text is not None:
+                parser = CifParser.from_str(cif_text)
+            else:
+                parser = CifParser(filename)
+            structure = parser.get_structures(primitive=False)[0]
 
         num_atoms = len(structure.frac_coords)
 
@@ -143,10 +195,21 @@ if __name__ == "__main__":
                     )
                     if distance < criteria * sum_radii:
                         num_problem += 1
-    except:
+    except Exception as e:
         print("CTEST   %s    Error  %i" % (filename, num_atoms))
+        write_event(filename, "failed", time.time() - stime, e, STAGE, args.events)
         exit(1)
     if num_problem == 0:
         print("CTEST   %s   Good  %i" % (filename, num_atoms))
     elif num_problem > 0:
         print("CTEST   %s   Bad   %i   %i" % (filename, num_atoms, num_problem))
+    write_event(
+        filename,
+        "ok",
+        time.time() - stime,
+        stage=STAGE,
+        events=args.events,
+        result="good" if num_problem == 0 else "bad",
+        natoms=num_atoms,
+        overlaps=num_problem,
+    )
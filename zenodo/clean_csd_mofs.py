@@ -1,111 +1,202 @@
-from ccdc import io
-from ccdc.io import CrystalWriter
-from pymatgen.symmetry.groups import sg_symbol_from_int_number, SpaceGroup
 from pymatgen.core import Structure, Lattice
 from pymatgen.core.operations import SymmOp
 from pymatgen.io.cif import CifWriter
 import argparse
 import os
-import uuid
+import re
+import sys
 import numpy as np
-import shutil
+
+from multiprocessing import Pool
 
 script_path, script_name = os.path.split(os.path.realpath(__file__))
-temp_cif_path = "/tmp/temp-{}.cif".format(uuid.uuid4().hex)
 
 
-def get_block(cif_lines, keyword, start):
-    """
-    Separate a cif into blocks based on "loop_" sections.
+# whitespace separated values, quoted strings, comments & text fields
+CIF_TOKEN = re.compile(r"""'(.*?)'(?=\s|$)|"(.*?)"(?=\s|$)|(#.*)|(\S+)""")
 
-        Parameters:
-            cif_lines (list of str): list of lines in cif file
-            keyword (str): keyword identifying block (e.g., "atom" for atoms
-                       "symmetry" for symmetry operations, "geom" for geometry
-                       (bonding) information, etc.)
-            start (int): the line number of beginning of block (line after "loop_")
+# tags identifying the loops needed for the P1 conversion
+SYMOP_TAGS = ("_symmetry_equiv_pos_as_xyz", "_space_group_symop_operation_xyz")
+CELL_TAGS = (
+    "_cell_length_a",
+    "_cell_length_b",
+    "_cell_length_c",
+    "_cell_angle_alpha",
+    "_cell_angle_beta",
+    "_cell_angle_gamma",
+)
 
-        Returns:
-            block (list of str): list of lines in the "block" from the cif
+
+def tokenize_cif(text):
     """
+    Split the text of a cif into its tokens in a single pass.
 
-    for num, line in enumerate(cif_lines[start:]):
-        if (
-            line[0] == "_"
-            and not line.strip("\n").split("_", maxsplit=1)[1].startswith(keyword)
-            or "loop_" in line
-        ):
-            end = num + start
-            break
-    try:
-        block = cif_lines[start:end]
-    except UnboundLocalError:
-        block = cif_lines[start:]
-    # Remove any "loop_" lines
-    block = [val for val in block if val != "loop_\n"]
+        Parameters:
+            text (str): contents of the cif
 
-    return block
+        Yields:
+            token (str): tag, "loop_", "data_" or value (quotes removed)
+    """
+    lines = iter(text.splitlines())
+    for line in lines:
+        if line.startswith(";"):
+            # multi-line text field, ends at the next line starting with ";"
+            field = [line[1:]]
+            for line in lines:
+                if line.startswith(";"):
+                    break
+                field.append(line)
+            yield "\n".join(field)
+            continue
+        for match in CIF_TOKEN.finditer(line):
+            single, double, comment, bare = match.groups()
+            if comment is not None:
+                break
+            value = bare if bare is not None else single
+            yield value if value is not None else double
+
+
+def parse_cif(text):
+    """
+    Collect all tags and loop tables of a cif in a single pass.
 
+        Parameters:
+            text (str): contents of the cif
 
-def get_dict(lst, good_atoms, label_key):
+        Returns:
+            tags (dict): single valued tags and their values
+            loops (list of dict): each loop_ as a dict of tag : list of values
+    """
+    tags = {}
+    loops = []
+    loop_tags = None
+    loop_vals = None
+    pending = None
+    for token in tokenize_cif(text):
+        lower = token.lower()
+        if pending is not None:
+            tags[pending] = token
+            pending = None
+        elif lower == "loop_":
+            loop_tags, loop_vals = [], []
+            loops.append((loop_tags, loop_vals))
+        elif token.startswith("_"):
+            if loop_tags is not None and len(loop_vals) == 0:
+                loop_tags.append(token)
+            else:
+                loop_tags = None
+                pending = token
+        elif lower.startswith("data_"):
+            loop_tags = None
+        elif loop_tags is not None:
+            loop_vals.append(token)
+
+    tables = []
+    for loop_tags, loop_vals in loops:
+        n = len(loop_tags)
+        tables.append({tag: loop_vals[i::n] for i, tag in enumerate(loop_tags)})
+    return tags, tables
+
+
+# numeric value with any standard uncertainty e.g., "1.234(5)" removed
+def strip_uncertainty(values):
+    return np.array([v.split("(", 1)[0] for v in np.atleast_1d(values)], dtype=float)
+
+
+def get_p1_inputs(text, atoms=None):
     """
-    Get a dictionary of structural attributes of a cif containing only certain
-    atoms. For example, to get a dictionary of atoms and their coordinates for only
-    a certain list of atoms. This works given a list of lines from a "block" in a cif
-    (identified by the "loop_" sections)
+    Extract the symmetry operations, asymmetric unit sites and cell parameters
+    needed for the P1 conversion from the text of a CSD cif.
 
         Parameters:
-            lst (list of str): List of lines to consider for dictionary
-            good_atoms (list of str): Atom labels to consider for dictionary
-            label_key (str): the header which will be used as the keys of the dict
-                             (e.g., for atom labels use _atom_site_label)
+            text (str): contents of the cif
+            atoms (list of str): atom labels to keep (default: all sites)
 
         Returns:
-            dict (dict): Dictionary of specified keys and attributes (properties)
-                         (properties are the remaining headers in the "loop_" section)
+            sym_ops (list of str): symmetry operations e.g., "-x,1/2+y,-z"
+            species (numpy array of str): element of each kept site
+            coords (numpy array): (n_atoms, 4) fractional coordinates with a
+                                  trailing 1 for the affine symmetry operations
+            cell (numpy array): a, b, c, alpha, beta, gamma
     """
+    tags, tables = parse_cif(text)
+    sym_table = next(t for t in tables if any(tag in t for tag in SYMOP_TAGS))
+    sym_ops = next(sym_table[tag] for tag in SYMOP_TAGS if tag in sym_table)
+    # Get rid of any whitespace within the symmetry operations
+    sym_ops = ["".join(op.split()) for op in sym_ops]
+    # Found some cases with anisotropic info in an atom_site loop, use the
+    # loop holding the fractional coordinates
+    site_table = next(t for t in tables if "_atom_site_fract_x" in t)
+    labels = np.array(site_table["_atom_site_label"])
+    keep = np.ones(len(labels), dtype=bool)
+    if atoms is not None:
+        keep = np.isin(labels, list(atoms))
+    # Need to have 4th dimension (value of 1) for matrix multiplication
+    # when applying the symmetry operations. The extra dimension
+    # is removed later by the covert_to_p1 function
+    coords = np.ones((keep.sum(), 4))
+    for i, axis in enumerate("xyz"):
+        coords[:, i] = strip_uncertainty(site_table[f"_atom_site_fract_{axis}"])[keep]
+    species = np.array(site_table["_atom_site_type_symbol"])[keep]
+    cell = strip_uncertainty([tags[tag] for tag in CELL_TAGS])
+
+    return sym_ops, species, coords, cell
+
+
+# CSD reader opened once per process and reused by every conversion
+# (the ccdc API is imported on first use, the P1 conversion of cif text
+# e.g., cif_to_pymatgen does not need it)
+_csd_reader = None
 
-    dict = {}
-    for num, line in enumerate(lst):
-        if line[0] == "_":
-            dict[line.strip().strip("\n")] = []
-    for num, line in enumerate(lst):
-        if line[0] != "_":
-            line = line.strip().replace("(", "").replace(")", "").split()
-            if line[list(dict.keys()).index(label_key)] in good_atoms:
-                for n, prop in enumerate(dict.keys()):
-                    dict[prop].append(line[n])
 
-    return dict
+def get_csd_reader():
+    global _csd_reader
+    if _csd_reader is None:
+        from ccdc import io
 
+        _csd_reader = io.EntryReader("CSD")
+    return _csd_reader
 
-def get_asymmetric_unit(ref, is_cif=False):
+
+def read_crystal(ref, is_cif=False, reader=None):
     """
-    Retrieve a cif from the CSD and return the
-    asymmetric unit molecule atoms. Also, write the crystal to a
-    temporary cif to get atomic coordinates of the crystal
-    (no way to do this with CSD). If is_cif is True, do not
-    retrieve the structure from CSD, just read the specified cif.
+    Retrieve a crystal from the CSD (or from a cif if is_cif is True).
 
         Parameters:
             ref (str): the CSD refcode for the structure (or cif filename if
                        is_cif is equal to True)
+            reader (ccdc EntryReader): reader used to retrieve refcodes
+                                       (default: the CSD)
+        Returns:
+            cryst (ccdc Crystal object): the crystal
+    """
+    if is_cif:
+        from ccdc import io
+
+        return io.CrystalReader(ref)[0]
+    if reader is None:
+        reader = get_csd_reader()
+    return reader.entry(ref).crystal
+
+
+def get_asymmetric_unit(cryst):
+    """
+    Return the asymmetric unit molecule atoms of a crystal, along with the
+    crystal written as cif text to get atomic coordinates of the crystal
+    (no way to do this with CSD).
+
+        Parameters:
+            cryst (ccdc Crystal object): the crystal
         Returns:
             atoms (list of str): the atom labels of the asymmetric unit molecule
+            cif (str): the centred crystal in cif format
 
     """
-    if is_cif:
-        cryst = io.CrystalReader(ref)[0]
-    else:
-        csd_reader = io.EntryReader("CSD")
-        cryst = csd_reader.entry(ref).crystal
     cryst.centre_molecule()
     mol = cryst.asymmetric_unit_molecule
     atoms = [str(atom).replace("Atom(", "").strip(")") for atom in mol.atoms]
-    with CrystalWriter(temp_cif_path) as mol_writer:
-        mol_writer.write(cryst)
 
-    return atoms
+    return atoms, cryst.to_string("cif")
 
 
 def convert_to_p1(ops, asym_unit_atoms, asym_unit_coords):
@@ -120,31 +211,31 @@ def convert_to_p1(ops, asym_unit_atoms, asym_unit_coords):
                                     atoms in asymmetric unit
 
         Returns:
-            new_species (list of str): species in the full unit cell
+            new_species (numpy array of str): species in the full unit cell
             new_coords (numpy array): array of fractional coordinates
                                         of atoms in full unit cell
 
     """
 
-    op_matrices = []
-    unit_cell_atoms = []
-    unit_cell_coords = []
     # Need to apply symmetry operations specified in cif manually,
     # space group isn't good enough
     a = np.zeros((4, 4), dtype=np.float32)
     # Need to instantiate SymmOp class with some 4x4 affine matrix to
     # use from_xyz_string function
     sym_op_obj = SymmOp(a)
-    for op in ops:
-        op_matrices.append(sym_op_obj.from_xyz_string(op).affine_matrix)
-
-    for num, atom in enumerate(asym_unit_atoms):
-        for op in op_matrices:
-            unit_cell_coords.append(op @ asym_unit_coords[num])
-            unit_cell_atoms.append(atom)
-
-    unit_cell_coords = np.asarray(unit_cell_coords)
-    unit_cell_coords = unit_cell_coords[:, :-1]
+    op_matrices = np.array(
+        [sym_op_obj.from_xyz_string(op).affine_matrix for op in ops]
+    ).reshape(-1, 4, 4)
+    asym_unit_coords = np.asarray(asym_unit_coords, dtype=float).reshape(-1, 4)
+
+    # apply every operation to every atom at once: (n_ops, 4, 4) x (n_atoms, 4)
+    # gives (n_ops, n_atoms, 3) with the homogeneous coordinate dropped, then
+    # order atom-major (all images of atom 0, then atom 1, ...) as before
+    unit_cell_coords = asym_unit_coords @ op_matrices[:, :3, :].transpose(0, 2, 1)
+    unit_cell_coords = unit_cell_coords.transpose(1, 0, 2).reshape(-1, 3)
+    unit_cell_atoms = np.repeat(
+        np.asarray(asym_unit_atoms, dtype=str), len(op_matrices)
+    )
 
     return unit_cell_atoms, unit_cell_coords
 
@@ -161,125 +252,49 @@ def remove_duplicate_atoms(pm_struct):
                                                    removed
     """
 
-    coords_check = []
-    bad_indices = []
+    frac = np.array(pm_struct.frac_coords, dtype=float)
+    rounded = np.round(frac, 2)
 
-    for atom in pm_struct:
-        if any(np.round(atom.frac_coords, 2) == 1):
-            for x in range(3):
-                if round(atom.frac_coords[x], 2) == 1:
-                    atom.frac_coords[x] = 0
+    # sites on the upper cell boundary are equivalent to those at 0
+    wrap = rounded == 1
+    frac[wrap] = 0
+    rounded[wrap] = 0
+    for num in np.flatnonzero(wrap.any(axis=1)):
+        pm_struct[int(num)].frac_coords = frac[num]
 
-    for num, atom in enumerate(pm_struct):
-        for coord in coords_check:
-            if all(np.round(coord, 2) == np.round(atom.frac_coords, 2)):
-                bad_indices.append(num)
+    # quantized coordinates as hashable keys, a site is a duplicate when an
+    # earlier site has the same key (+ 0.0 folds -0.0 onto 0.0)
+    seen = set()
+    bad_indices = []
+    for num, key in enumerate(map(tuple, (rounded + 0.0).tolist())):
+        if key in seen:
+            bad_indices.append(num)
         else:
-            coords_check.append(atom.frac_coords)
+            seen.add(key)
 
     pm_struct.remove_sites(bad_indices)
 
     return pm_struct
 
 
-def csd_to_pymatgen(path, atoms):
+def cif_to_pymatgen(cif, atoms=None):
     """
-    Manually parse a CSD cif to generate a pymatgen structure which contains
-    only a list of atoms specified (in this case, the asymmetric unit). This
-    function returns a Pymatgen structure which is in P1 symmetry by applying
-    the symmetry operations found in the cif.
+    Manually parse the text of a CSD cif to generate a pymatgen structure
+    which contains only a list of atoms specified (in this case, the
+    asymmetric unit). This function returns a Pymatgen structure which is in
+    P1 symmetry by applying the symmetry operations found in the cif.
 
         Parameters:
-            path (str): path to the cif file
+            cif (str): contents of the cif file
             atoms (list): list of the atoms in the asymmetric unit
 
         Returns:
             struct (Pymatgen Structure object): Structure in P1 symmetry
     """
-    with open(path) as f:
-        cif = f.readlines()
-        f.close()
-
-    blocks = {"symmetry": None, "atom_site": None, "geom": None}
-
-    for num, line in enumerate(cif):
-        if "loop_" in line:
-            for block in blocks.keys():
-                test_header = cif[num + 1].strip().split("_", maxsplit=1)[1]
-                # Found some cases with anisotropic info with same prefix
-                # ignore these for now...
-                if test_header.startswith(block):
-                    if block == "atom_site" and test_header.startswith(
-                        "atom_site_aniso"
-                    ):
-                        pass
-                    else:
-                        blocks[block] = get_block(cif, block, num + 1)
-        elif "_symmetry_space_group_name_H-M" in line:
-            space_group_name_HM = line.strip().split()[-1]
-        elif "_symmetry_Int_Tables_number" in line:
-            int_tables_num = line.strip().split()[-1]
-        elif "_space_group_name_Hall" in line:
-            space_group_name_hall = line.strip().split()[-1]
-        elif "cell_length_a" in line:
-            cell_length_a = float(
-                line.strip().replace("(", "").replace(")", "").split()[-1]
-            )
-        elif "cell_length_b" in line:
-            cell_length_b = float(
-                line.strip().replace("(", "").replace(")", "").split()[-1]
-            )
-        elif "cell_length_c" in line:
-            cell_length_c = float(
-                line.strip().replace("(", "").replace(")", "").split()[-1]
-            )
-        elif "cell_angle_alpha" in line:
-            cell_angle_alpha = float(
-                line.strip().replace("(", "").replace(")", "").split()[-1]
-            )
-        elif "cell_angle_beta" in line:
-            cell_angle_beta = float(
-                line.strip().replace("(", "").replace(")", "").split()[-1]
-            )
-        elif "cell_angle_gamma" in line:
-            cell_angle_gamma = float(
-                line.strip().replace("(", "").replace(")", "").split()[-1]
-            )
-    num_cols = 0
-    atom_dict = {}
-    coords = []
-
-    atom_dict = get_dict(blocks["atom_site"], atoms, "_atom_site_label")
-    # Need to have 4th dimension (value of 1) for matrix multiplication
-    # when applying the symmetry operations. The extra dimension
-    # is removed later by the covert_to_p1 function
-    for x, y, z in zip(
-        atom_dict["_atom_site_fract_x"],
-        atom_dict["_atom_site_fract_y"],
-        atom_dict["_atom_site_fract_z"],
-    ):
-        coords.append([float(x), float(y), float(z), 1])
-
-    species = atom_dict["_atom_site_type_symbol"]
-    sg = SpaceGroup.from_int_number(int(int_tables_num))
-    # Get only the operations (not headers) from the Symmetry block
-    sym_ops = [val for val in blocks["symmetry"] if val[0] != "_"]
-    # Get rid of any numbering "e.g., 1 x,y,z" from the symmetry operations
-    for i in range(len(sym_ops)):
-        sym_ops[i] = ",".join(
-            [val.split()[-1] for val in sym_ops[i].strip().split(",")]
-        )
-
+    sym_ops, species, coords, cell = get_p1_inputs(cif, atoms)
     species, coords = convert_to_p1(sym_ops, species, coords)
 
-    lattice = Lattice.from_parameters(
-        a=cell_length_a,
-        b=cell_length_b,
-        c=cell_length_c,
-        alpha=cell_angle_alpha,
-        beta=cell_angle_beta,
-        gamma=cell_angle_gamma,
-    )
+    lattice = Lattice.from_parameters(*cell)
     struct = Structure(
         lattice=lattice, species=species, coords=coords, to_unit_cell=True
     )
@@ -290,7 +305,81 @@ def csd_to_pymatgen(path, atoms):
     return struct
 
 
-def main(write_path, read_path=None, tmp_path=None, input_is_cif=False):
+def csd_to_pymatgen(path, atoms):
+    """
+    Read a CSD cif from disk and convert it with cif_to_pymatgen.
+
+        Parameters:
+            path (str): path to the cif file
+            atoms (list): list of the atoms in the asymmetric unit
+
+        Returns:
+            struct (Pymatgen Structure object): Structure in P1 symmetry
+    """
+    with open(path) as f:
+        cif = f.read()
+
+    return cif_to_pymatgen(cif, atoms)
+
+
+def to_p1(source, source_type="refcode", reader=None):
+    """
+    Convert a structure to P1 symmetry entirely in memory. Every call keeps
+    its own state, so conversions can run concurrently.
+
+        Parameters:
+            source (str or ccdc Crystal object): refcode, cif path, cif text
+                                                 or crystal to convert
+            source_type (str): one of "refcode", "cif_path", "cif_text" or
+                               "crystal"
+            reader (ccdc EntryReader): reader used to retrieve refcodes
+                                       (default: the CSD)
+
+        Returns:
+            struct (Pymatgen Structure object): Structure in P1 symmetry
+    """
+    if source_type == "crystal":
+        cryst = source
+    elif source_type == "cif_text":
+        from ccdc.crystal import Crystal
+
+        cryst = Crystal.from_string(source, "cif")
+    elif source_type in ("refcode", "cif_path"):
+        cryst = read_crystal(source, source_type == "cif_path", reader)
+    else:
+        raise ValueError(f"unknown source type {source_type}")
+    atoms, cif = get_asymmetric_unit(cryst)
+
+    return cif_to_pymatgen(cif, atoms)
+
+
+def _convert_job(job):
+    source, write_path, source_type = job
+    try:
+        CifWriter(to_p1(source, source_type)).write_file(write_path)
+    except Exception as e:
+        return write_path, f"{type(e).__name__}: {e}"
+    return write_path, None
+
+
+def convert_batch(jobs, num_cpus=1):
+    """
+    Convert many structures to P1 symmetry over a process pool.
+
+        Parameters:
+            jobs (list of tuple): (source, write_path, source_type) for each
+                                  structure, see to_p1
+            num_cpus (int): no. worker processes
+
+        Yields:
+            (write_path, error): error is None if the conversion succeeded
+    """
+    with Pool(processes=int(num_cpus)) as pool:
+        for result in pool.imap_unordered(_convert_job, jobs):
+            yield result
+
+
+def clean_structure(write_path, read_path=None, tmp_path=None, input_is_cif=False):
     """
     Get the asymmetric unit of a CSD structure and convert it to a Pymatgen
     Structure object in P1 symmetry. Then, write the cif to a specified path.
@@ -298,7 +387,7 @@ def main(write_path, read_path=None, tmp_path=None, input_is_cif=False):
         Parameters:
             read_path (str): Path to read the cif from (used if inp_is_cif)
             write_path (str): Path to write the cif
-            tmp_path (str): Path to write the temporary cif for debugging
+            tmp_path (str): Path to write the original CSD cif for debugging
 
         Returns:
             mof_p1 (Pymatgen Structure object): MOF in P1 symmetry
@@ -309,11 +398,12 @@ def main(write_path, read_path=None, tmp_path=None, input_is_cif=False):
         ref = f"{ref}.cif"
     else:
         ref = write_path.split("/")[-1].rsplit("_P1.cif", 1)[0]
-    asymmetric_unit_atoms = get_asymmetric_unit(ref, input_is_cif)
+    cryst = read_crystal(ref, input_is_cif)
+    asymmetric_unit_atoms, cif = get_asymmetric_unit(cryst)
     if tmp_path is not None:
-        shutil.copyfile(temp_cif_path, tmp_path)
-    mof_p1 = csd_to_pymatgen(temp_cif_path, asymmetric_unit_atoms)
-    os.remove(temp_cif_path)
+        with open(tmp_path, "w") as wf:
+            wf.write(cif)
+    mof_p1 = cif_to_pymatgen(cif, asymmetric_unit_atoms)
     CifWriter(mof_p1).write_file(write_path)
 
     return mof_p1
@@ -347,24 +437,54 @@ if __name__ == "__main__":
         action="store_true",
         help="If this flag is present, " + " the input is a cif file.",
     )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="If this flag is present, "
+        + " the refcode argument is a file listing one refcode (or cif) per line.",
+    )
+    parser.add_argument(
+        "--num_cpus",
+        type=int,
+        default=1,
+        help="no. cpus available for multiprocessing (with --batch).",
+    )
 
     args = parser.parse_args()
-    refcode = args.refcode
     write_dir = args.write_dir
     inp_is_cif = args.inp_is_cif
+    if args.batch:
+        with open(args.refcode, "r") as rf:
+            refcodes = [x.strip() for x in rf.read().split("\n") if x.strip() != ""]
+        jobs = []
+        for refcode in refcodes:
+            refcode = refcode.split(".cif")[0]
+            write_path = "{}/{}_P1.cif".format(write_dir, refcode)
+            if inp_is_cif:
+                source = "{}/{}.cif".format(args.read_dir, refcode)
+                jobs.append((source, write_path, "cif_path"))
+            else:
+                jobs.append((refcode, write_path, "refcode"))
+        failures = 0
+        for write_path, error in convert_batch(jobs, args.num_cpus):
+            if error is not None:
+                failures += 1
+                print(write_path, " | failed to convert to P1 |", error)
+        print(f"Converted ... {len(jobs) - failures} / {len(jobs)}")
+        sys.exit(1 if failures else 0)
+    refcode = args.refcode
     if inp_is_cif:
         refcode = refcode.split(".cif")[0]
         read_path = "{}/{}".format(args.read_dir, refcode)
+    else:
+        read_path = None
     final_cif_path = "{}/{}_P1.cif".format(write_dir, refcode)
     if args.d:
-        main(
+        clean_structure(
             final_cif_path,
+            read_path=read_path,
             tmp_path="{}/{}_original.cif".format(write_dir, refcode),
             input_is_cif=inp_is_cif,
         )
     else:
-        if inp_is_cif:
-            main(final_cif_path, read_path=read_path, input_is_cif=inp_is_cif)
-        else:
-            main(final_cif_path, input_is_cif=inp_is_cif)
-
+        clean_structure(final_cif_path, read_path=read_path, input_is_cif=inp_is_cif)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+import os
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+
+# read descriptor matrix (csv with a "cif" column, or .npy + names .txt)
+def load_descriptors(path, names_path=None, name_col="cif"):
+    if path.endswith(".npy"):
+        if names_path is None:
+            raise ValueError(f"{path} needs a names .txt matching its rows")
+        X = np.load(path, mmap_mode="r")
+        with open(names_path, "r") as rf:
+            names = [x for x in rf.read().split("\n") if x != ""]
+    else:
+        df = pd.read_csv(path)
+        names = df[name_col].astype(str).tolist()
+        X = df.drop(columns=[name_col]).select_dtypes("number").to_numpy()
+    if len(names) != len(X):
+        raise ValueError(f"{len(names)} names for {len(X)} descriptor rows")
+    return np.asarray(X), names
+
+
+# zero mean, unit variance per feature; constant features are left at zero
+def standardize(X, chunk_size=None):
+    X = np.asarray(X, dtype=np.float32)
+    if len(X) == 0:
+        return X.copy()
+    mean = X.mean(axis=0, dtype=np.float64).astype(np.float32)
+    std = X.std(axis=0, dtype=np.float64).astype(np.float32)
+    std[std == 0] = 1.0
+    out = np.empty_like(X)
+    step = max(1, chunk_size or len(X))
+    for i in range(0, len(X), step):
+        out[i : i + step] = (X[i : i + step] - mean) / std
+    return out
+
+
+def farthest_point_sampling(X, num_points, start=None, chunk_size=None):
+    """
+    Greedy farthest point sampling with incremental min-distance updates.
+
+        Parameters:
+            X (numpy array): (n_samples, n_features) descriptor matrix
+            num_points (int): number of points to select
+            start (int): index of the first point (default: point farthest
+                         from the descriptor centroid)
+            chunk_size (int): rows processed per block to bound memory use
+
+        Returns:
+            selected (numpy array): indices of the selected points, in the
+                                    order they were sampled
+    """
+    X = np.asarray(X, dtype=np.float32)
+    n = len(X)
+    num_points = min(int(num_points), n)
+    if num_points <= 0:
+        return np.empty(0, dtype=np.int64)
+    step = max(1, chunk_size or n)
+    # squared norms, reused by every |x - c|^2 = |x|^2 - 2 x.c + |c|^2 update
+    sq_norms = np.empty(n, dtype=np.float32)
+    for i in range(0, n, step):
+        chunk = X[i : i + step]
+        sq_norms[i : i + step] = np.einsum("ij,ij->i", chunk, chunk)
+
+    def sq_dist_to(c):
+        d = np.empty(n, dtype=np.float32)
+        c_norm = np.dot(c, c)
+        for i in range(0, n, step):
+            d[i : i + step] = sq_norms[i : i + step] - 2.0 * (X[i : i + step] @ c)
+        d += c_norm
+        np.maximum(d, 0.0, out=d)
+        return d
+
+    if start is None:
+        centroid = X.mean(axis=0, dtype=np.float64).astype(np.float32)
+        start = int(np.argmax(sq_dist_to(centroid)))
+    selected = np.empty(num_points, dtype=np.int64)
+    selected[0] = start
+    min_dist = sq_dist_to(X[start])
+    min_dist[start] = -1.0
+    for k in range(1, num_points):
+        nxt = int(np.argmax(min_dist))
+        selected[k] = nxt
+        np.minimum(min_dist, sq_dist_to(X[nxt]), out=min_dist)
+        min_dist[nxt] = -1.0
+    return selected
+
+
+# write subset in the format read by get_subset.py (one cif name per line)
+def write_subset(names, txt_file):
+    names = [x if x.endswith(".cif") else f"{x}.cif" for x in names]
+    with open(txt_file, "w") as wf:
+        wf.write("\n".join(names))
+    return txt_file
+
+
+if __name__ == "__main__":
+    code_desc = "Sample a diverse MOSAEC-DB subset (.txt) by farthest point sampling of descriptors."
+    parser = argparse.ArgumentParser(description=code_desc)
+    parser.add_argument(
+        "descriptors",
+        type=str,
+        help="descriptor csv (with a 'cif' name column) or .npy matrix.",
+    )
+    parser.add_argument("num_points", type=int, help="no. structures to sample.")
+    parser.add_argument(
+        "output_txt",
+        type=str,
+        help="subset file to write e.g., diverse-neutral-phom-20k.txt.",
+    )
+    parser.add_argument(
+        "--names",
+        type=str,
+        default=None,
+        help="cif names (.txt, one per line) matching the rows of a .npy matrix.",
+    )
+    parser.add_argument(
+        "--filter",
+        type=str,
+        default=None,
+        help="only sample names containing this string e.g., '_full'.",
+    )
+    parser.add_argument(
+        "--no_standardize",
+        action="store_true",
+        help="use raw descriptor values instead of per-feature standardization.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="random seed for the first point (default: farthest from centroid).",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=None,
+        help="rows per block for distance updates (bounds memory use).",
+    )
+    args = parser.parse_args()
+    if args.descriptors.endswith(".npy") and args.names is None:
+        parser.error("--names is required for a .npy descriptor matrix")
+    #
+    X, names = load_descriptors(args.descriptors, args.names)
+    if args.filter is not None:
+        keep = np.array([args.filter in x for x in names])
+        X = X[keep]
+        names = [x for x, k in zip(names, keep) if k]
+    if len(X) == 0:
+        sys.exit(
+            f"No structures to sample in {args.descriptors} (--filter {args.filter})"
+        )
+    X = np.nan_to_num(np.asarray(X, dtype=np.float32))
+    if not args.no_standardize:
+        X = standardize(X, args.chunk_size)
+    start = None
+    if args.seed is not None:
+        start = int(np.random.default_rng(args.seed).integers(len(X)))
+    print(f"Sampling {args.num_points} of {len(X)} structures ...")
+    selected = farthest_point_sampling(
+        X, args.num_points, start=start, chunk_size=args.chunk_size
+    )
+    write_subset([names[i] for i in selected], args.output_txt)
+    print(f"Subset written ... {os.path.basename(args.output_txt)}")
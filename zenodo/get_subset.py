@@ -1,15 +1,44 @@
 #!/usr/bin/env python3
 import os
+import io
+import sys
 import shutil
+import tarfile
+import zipfile
 import argparse
 
+from concurrent.futures import ThreadPoolExecutor
+
 CODE_PATH = os.path.dirname(os.path.realpath(__file__))
 print(CODE_PATH)
 DB_PATH = CODE_PATH.replace("scripts", "")
 print(DB_PATH)
+# shared mosaec package (manifest queries)
+sys.path.append(os.path.dirname(CODE_PATH))
+
+
+# scan a directory once for the cif names it holds
+def scan_cifs(dir_path):
+    try:
+        with os.scandir(dir_path) as it:
+            return {e.name for e in it if e.name.endswith(".cif")}
+    except FileNotFoundError:
+        return set()
+
+
+def resolve_cifs(txt_file, dest_dir, manifest=None, source=None):
+    if manifest is not None or source is not None:
+        with open(txt_file, "r") as rf:
+            cifs = [x.strip() for x in rf.read().split("\n") if x.strip() != ""]
+    if source is not None:
+        # cif names within a packed archive
+        found = [x for x in cifs if x in source]
+        return found, [x for x in cifs if x not in source]
+    if manifest is not None:
+        from mosaec.manifest import resolve_names
 
+        return resolve_names(manifest, cifs)
 
-def subset(txt_file, dest_dir):
     # define cif paths
     if "-neutral-" in dest_dir:
         fpath = os.path.join(DB_PATH, "database/full/neutral")
@@ -19,19 +48,113 @@ def subset(txt_file, dest_dir):
         ppath = os.path.join(DB_PATH, "database/partial/charged")
 
     with open(txt_file, "r") as rf:
-        cifs = rf.read().split("\n")
+        cifs = [x.strip() for x in rf.read().split("\n") if x.strip() != ""]
 
-    # separate cifs by origin directory
-    fcifs = [os.path.join(fpath, x) for x in cifs if "_full" in x]
-    pcifs = [os.path.join(ppath, x) for x in cifs if "_partial" in x]
+    # separate cifs by origin directory & check they exist
+    available = {fpath: scan_cifs(fpath), ppath: scan_cifs(ppath)}
+    found = []
+    missing = []
+    for cif in cifs:
+        if "_full" in cif:
+            src = fpath
+        elif "_partial" in cif:
+            src = ppath
+        else:
+            missing.append(cif)
+            continue
+        if cif in available[src]:
+            found.append(os.path.join(src, cif))
+        else:
+            missing.append(cif)
+    return found, missing
 
-    # move files
-    print(f"Copying {len(fcifs + pcifs)} .cif files ... ")
-    for cif in fcifs + pcifs:
-        shutil.copy(cif, dest_dir)
+
+def _link_or_copy(cif, dest_dir, mode):
+    dst = os.path.join(dest_dir, os.path.basename(cif))
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == "symlink":
+        os.symlink(os.path.abspath(cif), dst)
+    elif mode == "hardlink":
+        try:
+            os.link(cif, dst)
+        except OSError:
+            # e.g., across filesystems
+            shutil.copy(cif, dst)
+    else:
+        shutil.copy(cif, dst)
+    return dst
+
+
+def materialize(cifs, dest_dir, mode="copy", workers=1):
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            list(ex.map(lambda c: _link_or_copy(c, dest_dir, mode), cifs))
+    else:
+        for cif in cifs:
+            _link_or_copy(cif, dest_dir, mode)
     return 0
 
 
+# stream subset cifs into a single tar(.gz/.xz) or zip archive, read from
+# files or from the records of a packed archive (source)
+def write_archive(cifs, archive, arc_dir, source=None):
+    if archive.endswith(".zip"):
+        with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for cif in cifs:
+                arcname = f"{arc_dir}/{os.path.basename(cif)}"
+                if source is not None:
+                    zf.writestr(arcname, source.read_bytes(cif))
+                else:
+                    zf.write(cif, arcname=arcname)
+    else:
+        if archive.endswith((".tar.gz", ".tgz")):
+            tar_mode = "w:gz"
+        elif archive.endswith(".tar.xz"):
+            tar_mode = "w:xz"
+        else:
+            tar_mode = "w"
+        with tarfile.open(archive, tar_mode) as tf:
+            for cif in cifs:
+                arcname = f"{arc_dir}/{os.path.basename(cif)}"
+                if source is not None:
+                    data = source.read_bytes(cif)
+                    info = tarfile.TarInfo(arcname)
+                    info.size = len(data)
+                    tf.addfile(info, io.BytesIO(data))
+                else:
+                    tf.add(cif, arcname=arcname)
+    return archive
+
+
+def subset(
+    txt_file, dest_dir, mode="copy", workers=1, archive=None, manifest=None, source=None
+):
+    if source is not None:
+        from mosaec.archive import CifArchive
+
+        source = CifArchive(source)
+    cifs, missing = resolve_cifs(txt_file, dest_dir, manifest, source)
+    if len(missing) > 0:
+        print(f"Missing {len(missing)} .cif files from the database ... ")
+        for cif in missing:
+            print(f"{cif} | ERROR | not found")
+
+    # move files
+    if archive is not None:
+        print(f"Archiving {len(cifs)} .cif files ... {archive}")
+        write_archive(cifs, archive, os.path.basename(dest_dir), source)
+    elif source is not None:
+        from mosaec.archive import extract
+
+        print(f"Extracting {len(cifs)} .cif files ... ")
+        extract(source, dest_dir, cifs)
+    else:
+        print(f"Copying {len(cifs)} .cif files ({mode}) ... ")
+        materialize(cifs, dest_dir, mode=mode, workers=workers)
+    return 0 if len(missing) == 0 else 1
+
+
 if __name__ == "__main__":
     code_desc = "Retrieve MOSAEC-DB cifs from a specific subset (.txt)."
     parser = argparse.ArgumentParser(description=code_desc)
@@ -40,10 +163,52 @@ if __name__ == "__main__":
         type=str,
         help="path to .txt file with MOSAEC-DB cif names.",
     )
+    parser.add_argument(
+        "--mode",
+        type=str,
+        default="copy",
+        choices=["copy", "hardlink", "symlink"],
+        help="how the subset files are placed in the subset directory.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="no. threads used to copy/link files in parallel.",
+    )
+    parser.add_argument(
+        "--archive",
+        type=str,
+        default=None,
+        help="write the subset to a single .tar/.tar.gz/.tar.xz/.zip file instead.",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="database manifest (.sqlite) used to locate the cifs instead of scanning.",
+    )
+    parser.add_argument(
+        "--source",
+        type=str,
+        default=None,
+        help="packed cif archive (.cifpack) to read the cifs from instead of the database directories.",
+    )
     args = parser.parse_args()
     # create subset dir
     subset_dir = os.path.basename(args.subset)[:-4]
-    print("Making subset directory ... ", subset_dir)
-    os.makedirs(subset_dir, exist_ok=True)
+    if args.archive is None:
+        print("Making subset directory ... ", subset_dir)
+        os.makedirs(subset_dir, exist_ok=True)
     # find & move files
-    subset(args.subset, subset_dir)
+    sys.exit(
+        subset(
+            args.subset,
+            subset_dir,
+            args.mode,
+            args.workers,
+            args.archive,
+            args.manifest,
+            args.source,
+        )
+    )
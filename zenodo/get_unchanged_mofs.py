@@ -1,15 +1,21 @@
 #!/usr/bin/env python3
 import os
-import shutil
+import sys
+import time
 import argparse
+import threading
 
-from ccdc import io
-from ccdc.io import EntryReader
+from functools import partial
+from multiprocessing import Process, Queue
 
-from clean_csd_mofs import clean_structure
-from write_pac_cif import assign_partial_atomic_charge
+from pymatgen.io.cif import CifWriter
+
+from clean_csd_mofs import get_csd_reader, to_p1
+from write_pac_cif import open_schemes, write_pac_cifs
 
 CODE_PATH = os.path.dirname(os.path.realpath(__file__))
+# shared mosaec package (progress, shard selection)
+sys.path.append(os.path.dirname(CODE_PATH))
 
 
 # text editing to remove disordered/partially occupied sites
@@ -37,46 +43,140 @@ def filter_disorder(cif):
     return "\n".join(filtered_lines)
 
 
-# get cifs from csd
-def print_cifs(gcd_file, write_path, rm_disordered_sites):
+def read_refcodes(gcd_file):
     with open(gcd_file, "r") as rf:
-        refcode_list = [_ for _ in rf.read().split("\n") if _ != ""]
+        return [_ for _ in rf.read().split("\n") if _ != ""]
 
-    reader = EntryReader("CSD")
-    for refcode in refcode_list:
-        try:
-            entry = reader.entry(refcode)
-            mol = entry.disordered_molecule
-            cif_str = mol.to_string("cif")
-            if rm_disordered_sites:
-                cif_str = filter_disorder(cif_str)
-            cif_path = os.path.join(write_path, f"{entry.identifier}.cif")
-            with open(cif_path, "w") as wf:
-                wf.write(cif_str)
-        except Exception as e:
-            print(refcode, " | failed to print cif")
-            continue
-    return refcode_list
+
+class CSDReader:
+    """Disordered cif text of CSD entries, reader opened once per process."""
+
+    def get_cif(self, refcode):
+        entry = get_csd_reader().entry(refcode)
+        return entry.disordered_molecule.to_string("cif")
+
+
+class DirectoryReader:
+    """Stand-in for the CSD reading <refcode>.cif files from a directory."""
+
+    def __init__(self, cif_dir):
+        self.cif_dir = cif_dir
+
+    def get_cif(self, refcode):
+        with open(os.path.join(self.cif_dir, f"{refcode}.cif"), "r") as rf:
+            return rf.read()
+
+
+# pipeline jobs are (refcode, f_end, data, error); failed jobs pass straight through
+def fetch_stage(job, reader, rm_disordered_sites=False):
+    refcode, f_end, _, _ = job
+    try:
+        cif_str = reader.get_cif(refcode)
+        if rm_disordered_sites:
+            cif_str = filter_disorder(cif_str)
+    except Exception as e:
+        print(refcode, " | failed to print cif")
+        return refcode, f_end, None, f"fetch | {type(e).__name__}: {e}"
+    return refcode, f_end, cif_str, None
+
+
+def convert_stage(job, out_dir):
+    refcode, f_end, cif_str, error = job
+    if error is not None:
+        return job
+    try:
+        p1_text = str(CifWriter(to_p1(cif_str, "cif_text")))
+        write_path = os.path.join(out_dir, f"{refcode}{f_end}")
+        with open(write_path, "w") as wf:
+            wf.write(p1_text)
+    except Exception as e:
+        print(refcode, " | failed to convert2P1 cif")
+        print(e)
+        return refcode, f_end, None, f"convert | {type(e).__name__}: {e}"
+    return refcode, f_end, (write_path, p1_text), None
 
 
-# convert cifs to P1 symmetry
-def convert2P1(refs, out_dir, rename=None):
-    for ref in refs:
+def charge_stage(job, schemes):
+    refcode, f_end, data, error = job
+    if error is not None:
+        return job
+    write_path, p1_text = data
+    errors = []
+    try:
+        num = write_pac_cifs(write_path, schemes, cif_text=p1_text, errors=errors)
+    except Exception as e:
+        print(f"{write_path} | ERROR | {type(e).__name__}: {e}")
+        return refcode, f_end, None, f"charge | {type(e).__name__}: {e}"
+    if num == 0:
+        # no scheme written e.g., charges not stored or sites not matched
+        return refcode, f_end, None, f"charge | {'; '.join(errors)}"
+    # written, with the schemes that could not be (if any)
+    return refcode, f_end, (write_path, errors), None
+
+
+# queued items are (job, seconds spent on it by the earlier stages)
+def _stage_worker(func, in_queue, out_queue):
+    while True:
+        item = in_queue.get()
+        if item is None:
+            return
+        job, seconds = item
+        stime = time.time()
         try:
-            clean_structure(
-                f"{out_dir}/{ref}_P1.cif",
-                read_path=f"tmp_cifs/{ref}",
-                input_is_cif=True,
-            )
-            if rename:
-                p1_name = ref + "_P1.cif"
-                mdb_name = p1_name.replace("_P1.cif", rename)
-                shutil.move(f"{out_dir}/{p1_name} ", f"{out_dir}/{mdb_name}")
+            job = func(job)
         except Exception as e:
-            print(ref, " | failed to convert2P1 cif")
-            print(e)
-            continue
-    return 0
+            job = job[:2] + (None, f"{type(e).__name__}: {e}")
+        out_queue.put((job, seconds + time.time() - stime))
+
+
+def run_pipeline(jobs, stages, queue_size=16):
+    """
+    Stream jobs through stages of worker processes connected by bounded
+    queues, so every stage runs concurrently and memory use stays flat.
+
+        Parameters:
+            jobs (iterable): input items for the first stage
+            stages (list of tuple): (function, no. workers) for every stage,
+                                    each function maps one job to the next
+            queue_size (int): max. no. jobs waiting between two stages
+
+        Returns:
+            results (generator): (job, seconds) for every job (in completion
+                                 order), the job returned by the last stage &
+                                 the time spent on it over all stages
+    """
+    queues = [Queue(maxsize=queue_size) for _ in stages] + [Queue()]
+    workers = []
+    for i, (func, num_workers) in enumerate(stages):
+        workers.append(
+            [
+                Process(target=_stage_worker, args=(func, queues[i], queues[i + 1]))
+                for _ in range(max(1, int(num_workers)))
+            ]
+        )
+    for stage_workers in workers:
+        for w in stage_workers:
+            w.start()
+
+    # feed the first stage, then shut the stages down in order
+    def feed():
+        for job in jobs:
+            queues[0].put((job, 0.0))
+        for i, stage_workers in enumerate(workers):
+            for _ in stage_workers:
+                queues[i].put(None)
+            for w in stage_workers:
+                w.join()
+        queues[-1].put(None)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    while True:
+        item = queues[-1].get()
+        if item is None:
+            break
+        yield item
+    feeder.join()
 
 
 if __name__ == "__main__":
@@ -110,36 +210,113 @@ if __name__ == "__main__":
         action="store_true",
         help="whether to also write files containing MEPOML charges.",
     )
+    parser.add_argument(
+        "--reader_dir",
+        type=str,
+        default=None,
+        help="read <refcode>.cif files from this directory instead of the CSD.",
+    )
+    parser.add_argument(
+        "--fetch_workers",
+        type=int,
+        default=1,
+        help="no. processes retrieving (and filtering) cifs.",
+    )
+    parser.add_argument(
+        "--convert_workers",
+        type=int,
+        default=1,
+        help="no. processes converting cifs to P1.",
+    )
+    parser.add_argument(
+        "--charge_workers",
+        type=int,
+        default=1,
+        help="no. processes writing cifs with partial atomic charges.",
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=16,
+        help="max. no. structures waiting between two stages.",
+    )
+    parser.add_argument(
+        "--shard",
+        type=str,
+        default=None,
+        metavar="i/N",
+        help="retrieve only shard i of N of the refcodes (0 <= i < N).",
+    )
+    parser.add_argument(
+        "--events",
+        type=str,
+        default=None,
+        help="append per-structure JSONL events to this file (default: $MOSAEC_EVENTS).",
+    )
     args = parser.parse_args()
 
-    print("Writing MOSAEC-DB cifs ...\n")
-    for gcd in args.gcd_files:
-        # print tmp cifs
-        cif_dir = "tmp_cifs"
-        os.makedirs(cif_dir, exist_ok=True)
-        refs = print_cifs(gcd, cif_dir, args.remove_disorder)
-
-        # convert cifs to P1 & rename
-        p1_dir = "MOSAEC-DB_unchanged"
-        os.makedirs(p1_dir, exist_ok=True)
-        os.makedirs("./tmp", exist_ok=True)
-        f_end = "_full.cif" if "full" in gcd else "_partial.cif"
-        convert2P1(refs, p1_dir, rename=f_end)
-
-        shutil.rmtree(cif_dir)
-        shutil.rmtree("./tmp")
-
+    # output directories for the P1 cifs and every requested charge scheme
+    p1_dir = "MOSAEC-DB_unchanged"
+    os.makedirs(p1_dir, exist_ok=True)
+    schemes = []
     if args.write_repeat:
-        print("\nWriting MOSAEC-DB REPEAT cifs ...\n")
         repeat_dir = "MOSAEC-DB_unchanged_REPEAT"
         os.makedirs(repeat_dir, exist_ok=True)
         rpt_json = os.path.join(CODE_PATH, "../misc_data/unchanged_repeat.json")
-        assign_partial_atomic_charge(p1_dir, rpt_json, repeat_dir, pac_type="REPEAT")
-
+        schemes.append(("REPEAT", rpt_json, repeat_dir))
     if args.write_mepoml:
-        print("\nWriting MOSAEC-DB MEPO-ML cifs ...\n")
         mepoml_dir = "MOSAEC-DB_unchanged_MEPOML"
         os.makedirs(mepoml_dir, exist_ok=True)
         mpml_json = os.path.join(CODE_PATH, "../misc_data/unchanged_mepoml.json")
-        assign_partial_atomic_charge(p1_dir, mpml_json, mepoml_dir, pac_type="MEPOML")
+        schemes.append(("MEPOML", mpml_json, mepoml_dir))
+
+    if args.reader_dir is not None:
+        reader = DirectoryReader(args.reader_dir)
+    else:
+        reader = CSDReader()
+
+    jobs = []
+    for gcd in args.gcd_files:
+        f_end = "_full.cif" if "full" in gcd else "_partial.cif"
+        jobs += [(ref, f_end, None, None) for ref in read_refcodes(gcd)]
+    if args.shard is not None:
+        # split by output name e.g., ABCDEF_full, identical on every node
+        from mosaec.shard import select_shard
 
+        jobs = select_shard(jobs, args.shard, key=lambda job: f"{job[0]}{job[1]}")
+
+    stages = [
+        (
+            partial(
+                fetch_stage, reader=reader, rm_disordered_sites=args.remove_disorder
+            ),
+            args.fetch_workers,
+        ),
+        (partial(convert_stage, out_dir=p1_dir), args.convert_workers),
+    ]
+    if len(schemes) > 0:
+        stages.append(
+            (partial(charge_stage, schemes=open_schemes(schemes)), args.charge_workers)
+        )
+
+    print("Writing MOSAEC-DB cifs ...\n")
+    from mosaec.progress import Progress
+
+    progress = Progress(total=len(jobs), stage="unchanged", events=args.events)
+    failed = {}
+    for job, seconds in run_pipeline(jobs, stages, args.queue_size):
+        refcode, f_end, data, error = job
+        if error is not None:
+            failed[f"{refcode}{f_end}"] = error
+            # stage that failed e.g., "fetch | ValueError: ..."
+            stage = error.split(" | ", 1)[0] if " | " in error else None
+            progress.record(f"{refcode}{f_end}", "failed", seconds, error, stage)
+        elif len(schemes) > 0 and len(data[1]) > 0:
+            errors = "; ".join(data[1])
+            progress.record(f"{refcode}{f_end}", "partial", seconds, errors, "charge")
+        else:
+            progress.record(f"{refcode}{f_end}", "ok", seconds)
+    progress.close()
+    for name in sorted(failed):
+        print(f"{name} | ERROR | {failed[name]}")
+    print(f"\nWritten ... {len(jobs) - len(failed)} / {len(jobs)}")
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+import os
+import json
+import zlib
+import sqlite3
+import argparse
+
+from collections.abc import Mapping
+
+
+# stream (key, value) pairs of a top-level JSON object without loading it all
+def iter_json_object(json_name, chunk_size=1 << 20):
+    decoder = json.JSONDecoder()
+    with open(json_name, "r") as rf:
+        buf = ""
+        pos = 0
+        # characters dropped from the front of buf, for offsets in the file
+        base = 0
+        eof = False
+
+        def fill():
+            nonlocal buf, pos, base, eof
+            chunk = rf.read(chunk_size)
+            if chunk == "":
+                eof = True
+            base += pos
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        # next non-whitespace character, a truncated file ends with an error
+        def peek():
+            skip_ws()
+            if pos >= len(buf):
+                raise ValueError(
+                    f"{json_name} | unexpected end of input at offset {base + pos}"
+                )
+            return buf[pos]
+
+        def decode():
+            nonlocal pos
+            while True:
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError as e:
+                    if eof:
+                        raise ValueError(
+                            f"{json_name} | {e.msg} at offset {base + e.pos}"
+                        ) from e
+                    fill()
+                    continue
+                # a number could continue in the next chunk
+                if end == len(buf) and not eof:
+                    fill()
+                    continue
+                pos = end
+                return obj
+
+        def expect(char):
+            nonlocal pos
+            if peek() != char:
+                raise ValueError(
+                    f"{json_name} | expected '{char}' at offset {base + pos}"
+                )
+            pos += 1
+
+        fill()
+        expect("{")
+        if peek() == "}":
+            return
+        while True:
+            peek()
+            key = decode()
+            expect(":")
+            peek()
+            yield key, decode()
+            if peek() == ",":
+                pos += 1
+                continue
+            expect("}")
+            return
+
+
+def json_to_store(json_name, db_name, batch_size=1000):
+    """
+    Convert a REPEAT/MEPO-ML charge JSON into an indexed SQLite store with
+    one compressed record per structure.
+
+        Parameters:
+            json_name (str): path to the charge JSON
+            db_name (str): path to the SQLite store to write
+            batch_size (int): records inserted per transaction
+
+        Returns:
+            num_records (int): no. structures stored
+    """
+    if os.path.exists(db_name):
+        os.remove(db_name)
+    conn = sqlite3.connect(db_name)
+    conn.execute("CREATE TABLE charges (cif TEXT PRIMARY KEY, data BLOB)")
+    rows = []
+    num_records = 0
+    for cif, charges in iter_json_object(json_name):
+        data = zlib.compress(json.dumps(charges, separators=(",", ":")).encode())
+        rows.append((cif, data))
+        if len(rows) >= batch_size:
+            conn.executemany("INSERT OR REPLACE INTO charges VALUES (?, ?)", rows)
+            conn.commit()
+            num_records += len(rows)
+            rows = []
+    conn.executemany("INSERT OR REPLACE INTO charges VALUES (?, ?)", rows)
+    conn.commit()
+    num_records += len(rows)
+    conn.close()
+    return num_records
+
+
+class PACStore(Mapping):
+    """Read-only mapping of cif name to stored charges, fetched on demand."""
+
+    def __init__(self, db_name):
+        if not os.path.exists(db_name):
+            raise FileNotFoundError(db_name)
+        self.db_name = db_name
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        # one connection per process, safe to use after fork
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(f"file:{self.db_name}?mode=ro", uri=True)
+            self._pid = os.getpid()
+        return self._conn
+
+    def __getitem__(self, cif):
+        row = self.conn.execute(
+            "SELECT data FROM charges WHERE cif = ?", (cif,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(cif)
+        return json.loads(zlib.decompress(row[0]))
+
+    def __contains__(self, cif):
+        row = self.conn.execute(
+            "SELECT 1 FROM charges WHERE cif = ?", (cif,)
+        ).fetchone()
+        return row is not None
+
+    def __iter__(self):
+        for (cif,) in self.conn.execute("SELECT cif FROM charges"):
+            yield cif
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM charges").fetchone()[0]
+
+    def __getstate__(self):
+        return {"db_name": self.db_name, "_conn": None, "_pid": None}
+
+
+# open a charge store (.sqlite/.db) or fall back to loading a JSON file
+def open_pac_store(path):
+    if path.endswith((".sqlite", ".db")):
+        return PACStore(path)
+    with open(path, "r") as jsonr:
+        return json.load(jsonr)
+
+
+if __name__ == "__main__":
+    code_desc = "Convert a partial atomic charge JSON (REPEAT/MEPO-ML) into an indexed SQLite store."
+    parser = argparse.ArgumentParser(description=code_desc)
+    parser.add_argument("json_file", type=str, help="path to the charge JSON.")
+    parser.add_argument(
+        "db_file",
+        type=str,
+        nargs="?",
+        default=None,
+        help="path to the SQLite store (default: JSON name with .sqlite).",
+    )
+    args = parser.parse_args()
+    db_file = args.db_file
+    if db_file is None:
+        db_file = os.path.splitext(args.json_file)[0] + ".sqlite"
+    num = json_to_store(args.json_file, db_file)
+    print(f"Stored charges for {num} structures ... {db_file}")
@@ -1,18 +1,25 @@
 #!/usr/bin/env python3
 import os
+import sys
 import glob
-import json
+import time
 import argparse
 import warnings
 
 import numpy as np
 
 from datetime import date
+from multiprocessing import Pool
 from pathlib import Path
 from collections import defaultdict
 
 from pymatgen.io.cif import CifParser
 
+from pac_store import open_pac_store
+
+# shared mosaec package (structure cache)
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
 
 # compare floats within a certain tolerance
 def floats_equal(a, b, tol=0.01):
@@ -21,187 +28,384 @@ def floats_equal(a, b, tol=0.01):
     return abs(a - b) <= (min(abs(a), abs(b)) * tol)
 
 
-# read in partial atomic charges stored in JSON file
-def read_pac_json(json_name):
-    with open(json_name, "r") as jsonr:
-        pac_dict = json.load(jsonr)
-    return pac_dict
+def match_sites(symbols, frac_xyz, rand_num, charge_dict_i, tol=0.01):
+    """
+    Match every atom of a structure to its stored site in a single query per
+    element, using the same relative tolerance as floats_equal on the x
+    coordinate and the randomly weighted coordinate sum.
 
+        Parameters:
+            symbols (list of str): element of each atom
+            frac_xyz (numpy array): (n_atoms, 3) fractional coordinates
+            rand_num (numpy array): random weights of the coordinate sum
+            charge_dict_i (dict): stored sites of the structure by element
+            tol (float): relative tolerance
 
-# iterate
-def assign_partial_atomic_charge(
-    cifs_path, repeat_json, dst_path=None, pac_type="REPEAT"
-):
-    # set defaults for arguments
-    if dst_path is None:
-        dst_path = cifs_path.parent
-    else:
-        dst_path = Path(dst_path)
-    # get saved json charge dict
-    charge_dict = read_pac_json(repeat_json)
-    # find all cifs to be processed
-    cifs = glob.glob(f"{cifs_path}/*.cif", recursive=False)
-    #
-    for cif_path in cifs:
-        # check if charges available in stored json
-        if os.path.basename(cif_path) in charge_dict.keys():
-            charge_dict_i = charge_dict[os.path.basename(cif_path)]
-        else:
-            print(f"{cif_path} | ERROR | {pac_type} not stored")
+        Returns:
+            matches (numpy array): index of the first matching stored site
+                                   of the same element for each atom (-1 if
+                                   no site matches)
+            frac_sums (numpy array): randomly weighted sum of each atom
+    """
+    symbols = np.asarray(symbols)
+    frac_xyz = np.asarray(frac_xyz, dtype=float)
+    frac_sums = (frac_xyz * rand_num).sum(axis=1)
+    matches = np.full(len(symbols), -1, dtype=int)
+    for symbol in np.unique(symbols):
+        atom_idx = np.flatnonzero(symbols == symbol)
+        pac_list_Z = charge_dict_i[symbol]
+        if len(pac_list_Z) == 0:
             continue
-        # parse cif using pymatgen
-        cif_path = Path(cif_path)
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            try:
-                cif_struct = CifParser(cif_path).get_structures(primitive=False).pop()
-            except ValueError:
-                print(f"{cif_path} | ERROR | EMPTY cif")
-                continue
-
-        # compare number of atoms between CIF and saved JSON
-        # if len(cif_struct) != len(charge_dict_i):
-        json_num_atoms = sum(
-            [len(v) for k, v in charge_dict_i.items() if k != "rand_key"]
+        site_x = np.array([float(site["x"]) for site in pac_list_Z])
+        site_sum = np.array([float(site["sum_rand"]) for site in pac_list_Z])
+        # sorted x index, candidates lie within |x - q| <= |q| * tol
+        order = np.argsort(site_x, kind="stable")
+        sorted_x = site_x[order]
+        q_x = frac_xyz[atom_idx, 0]
+        q_sum = frac_sums[atom_idx]
+        width = np.abs(q_x) * tol * (1 + 1e-9)
+        lo = np.searchsorted(sorted_x, q_x - width, side="left")
+        hi = np.searchsorted(sorted_x, q_x + width, side="right")
+        counts = hi - lo
+        # expand (atom, candidate site) pairs of every window
+        pair_q = np.repeat(np.arange(len(atom_idx)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts
         )
-        if len(cif_struct) != json_num_atoms:
-            print(
-                cif_path,
-                " | ERROR | Different number of atoms in CIF (",
-                len(cif_struct),
-                ") and JSON (",
-                json_num_atoms,
-                ").",
-            )
-            continue
+        pair_k = order[np.repeat(lo, counts) + offsets]
+        # exact floats_equal checks on x & sum
+        a, b = q_x[pair_q], site_x[pair_k]
+        ok = np.abs(a - b) <= np.minimum(np.abs(a), np.abs(b)) * tol
+        a, b = q_sum[pair_q], site_sum[pair_k]
+        ok &= np.abs(a - b) <= np.minimum(np.abs(a), np.abs(b)) * tol
+        # keep the first stored site that passes all checks
+        best = np.full(len(atom_idx), len(pac_list_Z))
+        np.minimum.at(best, pair_q[ok], pair_k[ok])
+        found = best < len(pac_list_Z)
+        matches[atom_idx[found]] = best[found]
+    return matches, frac_sums
 
-        # Get atomic symbols and fractional coordinates for all atoms
-        symbols = [atom.specie.symbol for atom in cif_struct]
-        frac_xyz = np.around([atom.frac_coords for atom in cif_struct], decimals=6)
-        frac_xyz[frac_xyz == 0.0] = 0.0
-
-        # Reassign labels for all atoms
-        labels = []
-        label_counter = {element: 0 for element in set(symbols)}
-        for symbol in symbols:
-            label_counter[symbol] += 1
-            labels.append(f"{symbol}{label_counter[symbol]}")
-
-        # Create preambles for the new CIF file
-        if pac_type == "REPEAT":
-            new_cif = "# Generated by REPEAT Assigner based on pymatgen\n"
-        else:
-            new_cif = "# Charges generated by MEPO-ML\n"
-        #
-        new_cif += f"data_{cif_path.name.replace('.cif', '')}\n"
-        new_cif += "_audit_creation_date              "
-        new_cif += date.today().strftime("%Y-%m-%d") + "\n"
-        #
-        if pac_type == "REPEAT":
-            new_cif += "_audit_creation_method            REPEAT_Assigner\n"
+
+# read in partial atomic charges stored in JSON file, or open an indexed
+# store (see pac_store.py) that fetches structures on demand
+def read_pac_json(json_name):
+    return open_pac_store(str(json_name))
+
+
+# parse a cif once, the sites & text shared by every charge scheme written
+# (cif_text skips reading the file when the cif is already in memory, cache
+# reads through the shared parsed-structure cache)
+def parse_cif_sites(cif_path, cif_text=None, cache=None):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        if cache is not None:
+            from mosaec.cache import load_structure
+
+            cif_struct = load_structure(str(cif_path), cif_text, cache)
         else:
-            new_cif += "_audit_creation_method            MEPO-ML\n"
-
-        # Create cell info for the new CIF file
-        new_cif += f"_cell_length_a                    {cif_struct.lattice.a:.6f}\n"
-        new_cif += f"_cell_length_b                    {cif_struct.lattice.b:.6f}\n"
-        new_cif += f"_cell_length_c                    {cif_struct.lattice.c:.6f}\n"
-        new_cif += f"_cell_angle_alpha                 {cif_struct.lattice.alpha:.6f}\n"
-        new_cif += f"_cell_angle_beta                  {cif_struct.lattice.beta:.6f}\n"
-        new_cif += f"_cell_angle_gamma                 {cif_struct.lattice.gamma:.6f}\n"
-        new_cif += (
-            f"_cell_volume                      {cif_struct.lattice.volume:.6f}\n"
-        )
+            if cif_text is not None:
+                parser = CifParser.from_str(cif_text)
+            else:
+                parser = CifParser(cif_path)
+            cif_struct = parser.get_structures(primitive=False).pop()
 
-        # [ASSUMED P1] Create symmetry info for the new CIF file
-        new_cif += "_symmetry_space_group_name_H-M    P1\n"
-        new_cif += "_symmetry_Int_Tables_number       1\n"
-        new_cif += "loop_\n"
-        new_cif += "    _symmetry_equiv_pos_site_id\n"
-        new_cif += "    _symmetry_equiv_pos_as_xyz\n"
-        new_cif += "    1  x,y,z\n"
+    # Get atomic symbols and fractional coordinates for all atoms
+    symbols = [atom.specie.symbol for atom in cif_struct]
+    frac_xyz = np.around([atom.frac_coords for atom in cif_struct], decimals=6)
+    frac_xyz[frac_xyz == 0.0] = 0.0
+
+    # Reassign labels for all atoms
+    labels = []
+    label_counter = {element: 0 for element in set(symbols)}
+    for symbol in symbols:
+        label_counter[symbol] += 1
+        labels.append(f"{symbol}{label_counter[symbol]}")
 
+    # Create cell info for the new CIF file
+    lattice = cif_struct.lattice
+    cell_block = [
+        f"_cell_length_a                    {lattice.a:.6f}\n",
+        f"_cell_length_b                    {lattice.b:.6f}\n",
+        f"_cell_length_c                    {lattice.c:.6f}\n",
+        f"_cell_angle_alpha                 {lattice.alpha:.6f}\n",
+        f"_cell_angle_beta                  {lattice.beta:.6f}\n",
+        f"_cell_angle_gamma                 {lattice.gamma:.6f}\n",
+        f"_cell_volume                      {lattice.volume:.6f}\n",
+        # [ASSUMED P1] Create symmetry info for the new CIF file
+        "_symmetry_space_group_name_H-M    P1\n",
+        "_symmetry_Int_Tables_number       1\n",
+        "loop_\n",
+        "    _symmetry_equiv_pos_site_id\n",
+        "    _symmetry_equiv_pos_as_xyz\n",
+        "    1  x,y,z\n",
         # Create atom info for the new CIF file
-        new_cif += "loop_\n"
-        new_cif += "    _atom_site_type_symbol\n"
-        new_cif += "    _atom_site_label\n"
-        new_cif += "    _atom_site_fract_x\n"
-        new_cif += "    _atom_site_fract_y\n"
-        new_cif += "    _atom_site_fract_z\n"
-        new_cif += "    _atom_type_partial_charge\n"
-
-        # Adjust widths for the symbols and labels column
-        symbol_width = len(max(symbols, key=len))
-        label_width = len(max(labels, key=len))
-
-        # flags to gauge if cif is consistent with prior entry
-        # required for changes in atom ordering with different version of
-        # dependencies e.g., pymatgen
-
-        # block writing if error is encountered
-        write_cif = True
-        # whether the ordering of the sites/labels e.g., C1, C2, C3...
-        # equals past ordering (potential for different CifParsing behaviour)
-        label_order_issue = False
-        # dict mapping the current:past cif atom labels
-        label_mismatch = defaultdict(str)
-        # Loop over all atoms and create info line for each of
-        rand_num = np.array(charge_dict_i["rand_key"])
-        # track number of matches
-        try:
-            match_count = 0
-            for j, (symbol, label, frac) in enumerate(zip(symbols, labels, frac_xyz)):
-                # prev_line = charge_dict_i[str(j)]
-                pac_list_Z = charge_dict_i[symbol]
-                # iterate over all sites with shared atomic symbol to find match
-                # match_ind = None
-                # frac_sum = sum(frac)
-                frac_sum = sum(frac * rand_num)
-                for k, site_dict in enumerate(pac_list_Z):
-                    # check X
-                    if not floats_equal(frac[0], site_dict["x"]):
-                        continue
-                    # check sum
-                    # if not floats_equal(frac_sum, site_dict["sum"]):
-                    if not floats_equal(frac_sum, site_dict["sum_rand"]):
-                        continue
-                    # check label
-                    if label != site_dict["label"]:
-                        label_mismatch[label] = site_dict["label"]
-                        label_order_issue = True
-                    # select index that passes all checks
-                    match_ind = k
-                    break
-                # cleanup
-                if match_ind != None:
-                    match_count += 1
-                    charge = pac_list_Z[match_ind]["charge"]
-                    # write line
-                    new_cif += f"    {symbol:{symbol_width}}  {label:{label_width}}  "
-                    new_cif += "{:.6f}  {:.6f}  {:.6f}  ".format(*frac) + f"{charge}\n"
-                else:
-                    print(
-                        f"{cif_path} | ERROR | Did not find a matching atom site ... \n",
-                        label,
-                    )
-                    print(symbol, label, frac, frac_sum)
-                    print(pac_list_Z)
-                    write_cif = False
-                    break
-        except Exception as e:
-            print(f"{cif_path} | ERROR | Issue assigning Charge", e)
-            continue
+        "loop_\n",
+        "    _atom_site_type_symbol\n",
+        "    _atom_site_label\n",
+        "    _atom_site_fract_x\n",
+        "    _atom_site_fract_y\n",
+        "    _atom_site_fract_z\n",
+        "    _atom_type_partial_charge\n",
+    ]
 
-        if label_order_issue:
-            print(
-                f"{cif_path} | WARNING | Label mismatch ... \n",
-                dict(label_mismatch),
-            )
-        if write_cif & (match_count == len(cif_struct)):
+    # Adjust widths for the symbols and labels column
+    symbol_width = len(max(symbols, key=len))
+    label_width = len(max(labels, key=len))
+    site_lines = [
+        f"    {symbol:{symbol_width}}  {label:{label_width}}  "
+        + "{:.6f}  {:.6f}  {:.6f}  ".format(*frac)
+        for symbol, label, frac in zip(symbols, labels, frac_xyz)
+    ]
+
+    return {
+        "symbols": symbols,
+        "labels": labels,
+        "frac_xyz": frac_xyz,
+        "cell_block": "".join(cell_block),
+        "site_lines": site_lines,
+    }
+
+
+# failure reason e.g., "EmptyCif" kept for the run summary (errors is a list)
+def note_error(errors, reason, pac_type=None):
+    if errors is not None:
+        errors.append(reason if pac_type is None else f"{reason}: {pac_type}")
+
+
+# build the text of a cif with partial atomic charges for one charge scheme
+def build_pac_cif(cif_path, sites, charge_dict_i, pac_type="REPEAT", errors=None):
+    symbols = sites["symbols"]
+    labels = sites["labels"]
+    frac_xyz = sites["frac_xyz"]
+
+    # compare number of atoms between CIF and saved JSON
+    json_num_atoms = sum([len(v) for k, v in charge_dict_i.items() if k != "rand_key"])
+    if len(symbols) != json_num_atoms:
+        print(
+            cif_path,
+            " | ERROR | Different number of atoms in CIF (",
+            len(symbols),
+            ") and JSON (",
+            json_num_atoms,
+            ").",
+        )
+        note_error(errors, "AtomCountMismatch", pac_type)
+        return None
+
+    # Create preambles for the new CIF file
+    if pac_type == "REPEAT":
+        new_cif = ["# Generated by REPEAT Assigner based on pymatgen\n"]
+    else:
+        new_cif = ["# Charges generated by MEPO-ML\n"]
+    #
+    new_cif.append(f"data_{cif_path.name.replace('.cif', '')}\n")
+    new_cif.append("_audit_creation_date              ")
+    new_cif.append(date.today().strftime("%Y-%m-%d") + "\n")
+    #
+    if pac_type == "REPEAT":
+        new_cif.append("_audit_creation_method            REPEAT_Assigner\n")
+    else:
+        new_cif.append("_audit_creation_method            MEPO-ML\n")
+    new_cif.append(sites["cell_block"])
+
+    # flags to gauge if cif is consistent with prior entry
+    # required for changes in atom ordering with different version of
+    # dependencies e.g., pymatgen
+
+    # whether the ordering of the sites/labels e.g., C1, C2, C3...
+    # equals past ordering (potential for different CifParsing behaviour)
+    label_order_issue = False
+    # dict mapping the current:past cif atom labels
+    label_mismatch = defaultdict(str)
+    # Loop over all atoms and create info line for each of
+    rand_num = np.array(charge_dict_i["rand_key"])
+    try:
+        matches, frac_sums = match_sites(symbols, frac_xyz, rand_num, charge_dict_i)
+        for j, (symbol, label) in enumerate(zip(symbols, labels)):
+            pac_list_Z = charge_dict_i[symbol]
+            match_ind = matches[j]
+            if match_ind < 0:
+                print(
+                    f"{cif_path} | ERROR | Did not find a matching atom site ... \n",
+                    label,
+                )
+                print(symbol, label, frac_xyz[j], frac_sums[j])
+                print(pac_list_Z)
+                note_error(errors, "UnmatchedSite", pac_type)
+                return None
+            # check label
+            if label != pac_list_Z[match_ind]["label"]:
+                label_mismatch[label] = pac_list_Z[match_ind]["label"]
+                label_order_issue = True
+            charge = pac_list_Z[match_ind]["charge"]
+            # write line
+            new_cif.append(f"{sites['site_lines'][j]}{charge}\n")
+    except Exception as e:
+        print(f"{cif_path} | ERROR | Issue assigning Charge", e)
+        note_error(errors, type(e).__name__, pac_type)
+        return None
+
+    if label_order_issue:
+        print(
+            f"{cif_path} | WARNING | Label mismatch ... \n",
+            dict(label_mismatch),
+        )
+    return "".join(new_cif)
+
+
+# write every requested charge scheme variant of a cif from a single parse
+def write_pac_cifs(cif_path, schemes, cif_text=None, cache=None, errors=None):
+    cif_name = os.path.basename(cif_path)
+    todo = []
+    for pac_type, charge_dict, dst_path in schemes:
+        # check if charges available in stored json
+        if cif_name in charge_dict:
+            todo.append((pac_type, charge_dict[cif_name], dst_path))
+        else:
+            print(f"{cif_path} | ERROR | {pac_type} not stored")
+            note_error(errors, "NotStored", pac_type)
+    if len(todo) == 0:
+        return 0
+    # parse cif using pymatgen
+    cif_path = Path(cif_path)
+    try:
+        sites = parse_cif_sites(cif_path, cif_text, cache)
+    except ValueError:
+        print(f"{cif_path} | ERROR | EMPTY cif")
+        note_error(errors, "EmptyCif")
+        return 0
+
+    num_written = 0
+    for pac_type, charge_dict_i, dst_path in todo:
+        new_cif = build_pac_cif(cif_path, sites, charge_dict_i, pac_type, errors)
+        if new_cif is not None:
             # Write the new CIF
             dst_path.joinpath(
                 cif_path.name.replace(".cif", f"_{pac_type}.cif")
             ).write_text(new_cif)
+            num_written += 1
+    return num_written
+
+
+# open the charge file of every scheme, (pac_type, charges, output directory)
+def open_schemes(schemes):
+    return [
+        (pac_type, read_pac_json(pac_file), Path(dst_path))
+        for pac_type, pac_file, dst_path in schemes
+    ]
+
+
+# charge schemes shared with pool workers (inherited, not pickled per task)
+_schemes = None
+_cache = None
+
+
+def _init_schemes(schemes, cache=None):
+    global _schemes, _cache
+    _schemes = schemes
+    _cache = cache
+
+
+# write one cif, timed & with the reasons of any scheme not written
+def write_pac_job(cif_path, schemes, cache=None):
+    errors = []
+    stime = time.time()
+    num_written = write_pac_cifs(cif_path, schemes, cache=cache, errors=errors)
+    return cif_path, num_written, errors, time.time() - stime
+
+
+def _write_job(cif_path):
+    return write_pac_job(cif_path, _schemes, _cache)
+
+
+def assign_partial_atomic_charges(
+    cifs_path,
+    schemes,
+    num_cpus=1,
+    cache=None,
+    shard=None,
+    shard_by="hash",
+    events=None,
+):
+    """
+    Write cifs with partial atomic charges for several charge schemes, parsing
+    each cif only once.
+
+        Parameters:
+            cifs_path (str): directory of the structure files (cif)
+            schemes (list of tuple): (pac_type, charge file, output directory)
+                                     for every scheme e.g., REPEAT & MEPOML
+            num_cpus (int): no. worker processes
+            cache (str): parsed-structure cache directory ("" for the
+                         default), None to parse every cif
+            shard (str): "i/N" to write only shard i of N of the cifs
+            shard_by (str): "hash" of the cif name or "cost" (file size)
+            events (str): JSONL file of per-cif events (default:
+                          $MOSAEC_EVENTS)
+
+        Returns:
+            num_written (int): no. cifs written over all schemes
+    """
+    # get saved json charge dicts
+    schemes = open_schemes(schemes)
+    # find all cifs to be processed
+    cifs = glob.glob(f"{cifs_path}/*.cif", recursive=False)
+    if shard is not None:
+        from mosaec.shard import select_shard
+
+        cost = os.path.getsize if shard_by == "cost" else None
+        cifs = select_shard(cifs, shard, cost=cost)
+    from mosaec.progress import Progress
+
+    progress = Progress(total=len(cifs), stage="pac", events=events)
+    num_written = 0
+    pool = None
+    if int(num_cpus) > 1:
+        pool = Pool(int(num_cpus), _init_schemes, (schemes, cache))
+        results = pool.imap_unordered(_write_job, cifs, chunksize=8)
+    else:
+        results = (write_pac_job(cif_path, schemes, cache) for cif_path in cifs)
+    try:
+        for cif_path, num, errors, seconds in results:
+            num_written += num
+            if len(errors) == 0:
+                status = "ok"
+            else:
+                status = "partial" if num > 0 else "failed"
+            progress.record(
+                os.path.basename(cif_path), status, seconds, "; ".join(errors) or None
+            )
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    progress.close()
+    return num_written
+
+
+def assign_partial_atomic_charge(
+    cifs_path,
+    repeat_json,
+    dst_path=None,
+    pac_type="REPEAT",
+    num_cpus=1,
+    cache=None,
+    shard=None,
+    shard_by="hash",
+    events=None,
+):
+    # set defaults for arguments
+    if dst_path is None:
+        dst_path = Path(cifs_path).parent
+    return assign_partial_atomic_charges(
+        cifs_path,
+        [(pac_type, repeat_json, dst_path)],
+        num_cpus,
+        cache,
+        shard,
+        shard_by,
+        events,
+    )
 
 
 if __name__ == "__main__":
@@ -220,7 +424,8 @@ if __name__ == "__main__":
         "--repeat_json",
         type=str,
         metavar="REPEAT_JSON",
-        help="Explicitly provide the name of the REPEAT output file.",
+        help="Explicitly provide the name of the REPEAT output file "
+        "(.json, or an indexed .sqlite store made by pac_store.py).",
     )
     ap.add_argument(
         "--pac_type",
@@ -229,6 +434,70 @@ if __name__ == "__main__":
         metavar="PAC_TYPE",
         choices=["REPEAT", "MEPOML"],
     )
+    ap.add_argument(
+        "--scheme",
+        nargs=2,
+        action="append",
+        metavar=("PAC_TYPE", "PAC_FILE"),
+        help="write several charge schemes from a single parse of each cif "
+        "e.g., --scheme REPEAT repeat.json --scheme MEPOML mepoml.json",
+    )
+    ap.add_argument(
+        "--num_cpus",
+        type=int,
+        default=1,
+        help="no. cpus available for multiprocessing.",
+    )
+    ap.add_argument(
+        "--cache",
+        type=str,
+        nargs="?",
+        const="",
+        default=None,
+        help="read through the parsed-structure cache (optional cache directory).",
+    )
+    ap.add_argument(
+        "--shard",
+        type=str,
+        default=None,
+        metavar="i/N",
+        help="write only shard i of N of the cifs (0 <= i < N).",
+    )
+    ap.add_argument(
+        "--shard_by",
+        type=str,
+        default="hash",
+        choices=["hash", "cost"],
+        help="split shards by a stable hash of the cif name, or balance their file size.",
+    )
+    ap.add_argument(
+        "--events",
+        type=str,
+        default=None,
+        help="append per-cif JSONL events to this file (default: $MOSAEC_EVENTS).",
+    )
     args = ap.parse_args()
-    assign_partial_atomic_charge(args.cif, args.repeat_json, args.outdir, args.pac_type)
-
+    if args.scheme:
+        outdir = args.outdir or Path(args.cif_path).parent
+        schemes = [(pac_type, pac_file, outdir) for pac_type, pac_file in args.scheme]
+        assign_partial_atomic_charges(
+            args.cif_path,
+            schemes,
+            args.num_cpus,
+            args.cache,
+            args.shard,
+            args.shard_by,
+            args.events,
+        )
+    else:
+        assign_partial_atomic_charge(
+            args.cif_path,
+            args.repeat_json,
+            args.outdir,
+            args.pac_type,
+            args.num_cpus,
+            args.cache,
+            args.shard,
+            args.shard_by,
+            args.events,
+        )